@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+MetaboChat over HTTP, for many concurrent users (stdlib asyncio, no web framework).
+
+    POST /chat    {"question": "...", "stream": true, "timeout_s": 30}
+    GET  /health  in-flight / queued requests and DB pool usage
+
+Streaming answers are NDJSON over chunked transfer encoding, one event per line:
+    {"event": "token", "text": "..."} ... {"event": "done", "answer": ..., "timings": ...}
+
+The blocking pipeline (run_llma.answer_question) runs on a fixed worker pool;
+at most `workers + queue_size` requests are admitted and the rest get an
+immediate 503 with Retry-After instead of piling up.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+import run_llma as chat
+
+MAX_BODY_BYTES = 64 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+# Raised from the on_token callback; generate_response lets it through to _run.
+DeadlineExceeded = chat.DeadlineExceeded
+
+
+class ChatServer:
+    def __init__(self, workers=8, queue_size=32, default_timeout_s=30.0, max_timeout_s=120.0):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.default_timeout_s = default_timeout_s
+        self.max_timeout_s = max_timeout_s
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat")
+        self.admitted = 0   # admitted and not finished (running + waiting for a worker)
+        self.running = 0
+        self.served = self.rejected = self.timed_out = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    ############################################
+    # Admission / pipeline
+    ############################################
+    def try_admit(self):
+        with self._lock:
+            if self.admitted >= self.workers + self.queue_size:
+                self.rejected += 1
+                return False
+            self.admitted += 1
+            return True
+
+    def _finished(self, future):
+        with self._lock:
+            self.admitted -= 1
+        if not future.cancelled():
+            future.exception()  # a client that hit its deadline never reads the result
+
+    def _run(self, question, on_token, cancelled):
+        with self._lock:
+            self.running += 1
+        try:
+            if cancelled.is_set():  # deadline passed while queued
+                raise DeadlineExceeded()
+
+            def emit(piece):
+                if cancelled.is_set():
+                    raise DeadlineExceeded()  # aborts the LLM stream
+                if on_token is not None:
+                    on_token(piece)
+
+            return chat.answer_question(question, on_token=emit)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def submit(self, question, on_token, cancelled):
+        """Start the pipeline on a worker; the admission slot frees when the worker is done, not the client."""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self._run, question, on_token, cancelled)
+        future.add_done_callback(self._finished)
+        return future
+
+    def health(self):
+        with self._lock:
+            queued = self.admitted - self.running
+            status = {
+                "status": "ok",
+                "uptime_s": round(time.time() - self.started, 1),
+                "running": self.running,
+                "queued": queued,
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "served": self.served,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+        db = chat.get_db_handler()
+        status["db_pool"] = db.pool_status()
+        if hasattr(db, "snapshot_metrics"):
+            status["kb_snapshot"] = db.snapshot_metrics()
+        status["llm_latency"] = chat.llm_latency.summary()
+        status["llm"] = chat.llm_metrics()
+        status["prefetch"] = chat.prefetch_metrics()
+        if self.admitted >= self.workers + self.queue_size:
+            status["status"] = "saturated"
+        elif status["llm"]["breaker_state"] == "open":
+            status["status"] = "degraded"
+        return status
+
+    ############################################
+    # HTTP
+    ############################################
+    async def handle(self, reader, writer):
+        try:
+            try:
+                method, path, headers, body = await read_request(reader)
+            except ValueError as e:
+                return await send_json(writer, 400, {"error": str(e)})
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            if path == "/health":
+                return await send_json(writer, 200, self.health())
+            if path != "/chat":
+                return await send_json(writer, 404, {"error": f"no route {path}"})
+            if method != "POST":
+                return await send_json(writer, 405, {"error": "use POST"})
+            if len(body) > MAX_BODY_BYTES:
+                return await send_json(writer, 413, {"error": "request body too large"})
+            try:
+                payload = json.loads(body or b"{}")
+                question = str(payload.get("question", "")).strip()
+                timeout_s = min(float(payload.get("timeout_s", self.default_timeout_s)), self.max_timeout_s)
+            except (ValueError, AttributeError) as e:
+                return await send_json(writer, 400, {"error": f"bad JSON body: {e}"})
+            if not question:
+                return await send_json(writer, 400, {"error": "missing 'question'"})
+            if not self.try_admit():
+                return await send_json(writer, 503, {"error": "server busy, retry later"}, {"Retry-After": "1"})
+            if payload.get("stream", True):
+                await self.chat_stream(writer, question, timeout_s)
+            else:
+                await self.chat_json(writer, question, timeout_s)
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            writer.close()
+
+    async def chat_json(self, writer, question, timeout_s):
+        cancelled = threading.Event()
+        future = self.submit(question, None, cancelled)
+        try:
+            record = await asyncio.wait_for(asyncio.shield(future), timeout_s)
+        except asyncio.TimeoutError:
+            cancelled.set()
+            self.timed_out += 1
+            return await send_json(writer, 504, {"error": f"deadline of {timeout_s}s exceeded"})
+        except DeadlineExceeded:
+            self.timed_out += 1
+            return await send_json(writer, 504, {"error": f"deadline of {timeout_s}s exceeded"})
+        except Exception as e:
+            return await send_json(writer, 500, {"error": f"{type(e).__name__}: {e}"})
+        self.served += 1
+        await send_json(writer, 200, record)
+
+    async def chat_stream(self, writer, question, timeout_s):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout_s
+        events = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def on_token(piece):
+            loop.call_soon_threadsafe(events.put_nowait, piece)
+
+        future = self.submit(question, on_token, cancelled)
+        future.add_done_callback(lambda _f: events.put_nowait(None))
+        # finally: a client that disconnects mid-stream makes send_event raise
+        # (ConnectionResetError / BrokenPipeError); stop the worker either way
+        try:
+            await start_chunked(writer, 200, "application/x-ndjson")
+            while True:
+                remaining = deadline - loop.time()
+                try:
+                    piece = await asyncio.wait_for(events.get(), max(remaining, 0))
+                except asyncio.TimeoutError:
+                    cancelled.set()
+                    self.timed_out += 1
+                    await send_event(writer, {"event": "error", "error": f"deadline of {timeout_s}s exceeded"})
+                    break
+                if piece is None:
+                    try:
+                        record = future.result()
+                    except DeadlineExceeded:
+                        self.timed_out += 1
+                        await send_event(writer, {"event": "error", "error": f"deadline of {timeout_s}s exceeded"})
+                        break
+                    except Exception as e:
+                        await send_event(writer, {"event": "error", "error": f"{type(e).__name__}: {e}"})
+                        break
+                    self.served += 1
+                    await send_event(writer, dict(record, event="done"))
+                    break
+                await send_event(writer, {"event": "token", "text": piece})
+            await end_chunked(writer)
+        finally:
+            cancelled.set()
+
+
+async def read_request(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise ValueError("malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY_BYTES:
+        return method.upper(), target.split("?", 1)[0], headers, b"x" * (MAX_BODY_BYTES + 1)
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target.split("?", 1)[0], headers, body
+
+
+def _head(status, content_type, extra):
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}", "Connection: close"]
+    lines += [f"{k}: {v}" for k, v in extra.items()]
+    return ("\r\n".join(lines) + "\r\n").encode("latin-1")
+
+
+async def send_json(writer, status, obj, headers=None):
+    body = json.dumps(obj, default=str).encode("utf-8")
+    writer.write(_head(status, "application/json", dict(headers or {}, **{"Content-Length": len(body)})) + b"\r\n" + body)
+    await writer.drain()
+
+
+async def start_chunked(writer, status, content_type):
+    writer.write(_head(status, content_type, {"Transfer-Encoding": "chunked", "Cache-Control": "no-cache"}) + b"\r\n")
+    await writer.drain()
+
+
+async def send_event(writer, obj):
+    data = (json.dumps(obj, default=str) + "\n").encode("utf-8")
+    writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+    await writer.drain()
+
+
+async def end_chunked(writer):
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+async def serve(host, port, server):
+    srv = await asyncio.start_server(server.handle, host, port, limit=MAX_BODY_BYTES)
+    print(f"MetaboChat service on http://{host}:{port} "
+          f"({server.workers} workers, queue {server.queue_size}, pool {chat.get_db_handler().pool_status()})")
+    async with srv:
+        await srv.serve_forever()
+
+
+#######################################
+# Entry point
+#######################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MetaboChat HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=8, help="concurrent pipelines (DB + LLM)")
+    parser.add_argument("--queue-size", type=int, default=32, help="admitted requests waiting for a worker; beyond that 503")
+    parser.add_argument("--pool-size", type=int, default=None,
+                        help="Postgres connections shared by the workers (default: workers + the retriever's "
+                             "ranker threads + prefetch workers, so parallel rankers never wait for a connection)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="default per-request deadline in seconds")
+    args = parser.parse_args()
+
+    try:
+        db_handler = chat.get_db_handler()
+        if hasattr(db_handler, "open_pool"):
+            # each pipeline runs its own lookups while its rankers use the retriever's shared threads
+            fan_out = chat.get_retriever().max_workers + max(chat.PREFETCH_WORKERS, 0)
+            db_handler.open_pool(args.pool_size or args.workers + fan_out)
+        chat.init_all()  # warm up before taking traffic
+    except Exception as e:
+        print(f"Error: Failed to initialize: {e}")
+        sys.exit(1)
+    server = ChatServer(workers=args.workers, queue_size=args.queue_size, default_timeout_s=args.timeout)
+    try:
+        asyncio.run(serve(args.host, args.port, server))
+    except KeyboardInterrupt:
+        pass
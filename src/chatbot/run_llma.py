@@ -1,49 +1,232 @@
 #!/usr/bin/env python3
 
-import time
-start = time.time()
-
-import openai
-import sys
+import functools
 import os
 import re
-import requests
-
-end = time.time()
-print(f"Import time: {end - start:.4f} seconds")
+import sys
+import threading
+import time
 
 # Ensure we can import "query_database.py"
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
 
-from utils.query_database import PostgresDBHandler
+from utils.storage_backend import create_db_handler
+from utils.llm_stream import LatencyLog, StreamTimer, stream_text
+from utils.answer_templates import fast_answer
+from utils.context_packer import estimate_tokens, pack_context
+from utils.chat_session import ChatSession
+from utils.batch_runner import RateLimiter, load_questions, run_batch
+from utils.llm_resilience import CircuitBreaker, LLMDeadlineExceeded, LLMUnavailable, ResilientLLM
+
+# The LLM client, DB handler, retriever, response cache and entity automaton are
+# built on first use by the get_*() functions below (openai alone takes most of a
+# second to import), so importing this module is cheap. Assigning one of these
+# globals directly (e.g. a stub client) takes precedence.
+_UNSET = object()
+client = llm = db_handler = retriever = response_cache = prefetcher = _UNSET
+_init_lock = threading.RLock()
+
+def _lazy(name, factory):
+    value = globals()[name]
+    if value is _UNSET:
+        with _init_lock:
+            value = globals()[name]
+            if value is _UNSET:
+                value = factory()
+                globals()[name] = value
+    return value
+
+model_id = os.environ.get("METABOCHAT_LLM_MODEL", "deepseek-r1-distill-llama-70b")
 
-client = openai.OpenAI(
-    base_url="https://api.groq.com/openai/v1",
-    api_key=os.environ.get("groq"),
-)
+# Bare lookups ("What is the molecular weight of glucose?") with one unambiguous row:
+#   "template" - answer from answer_templates.py, no LLM call
+#   "explain"  - template answer, then a short LLM paragraph of context
+#   "off"      - always ask the LLM
+FAST_ANSWERS = os.environ.get("METABOCHAT_FAST_ANSWERS", "template").lower()
 
-model_id = "deepseek-r1-distill-llama-70b"
+# Token budget for the database context sent to the LLM (see context_packer.py)
+CONTEXT_TOKENS = int(os.environ.get("METABOCHAT_CONTEXT_TOKENS", "600"))
 
-try:
-    db_handler = PostgresDBHandler(
+# Batch mode (--batch) sets a RateLimiter here; every LLM request then waits for
+# requests-per-minute / tokens-per-minute budget and backs off on 429s.
+llm_gate = None
+COMPLETION_TOKENS_RESERVE = 512  # expected completion size charged up front
+
+# Deadline, hedged requests, retries and circuit breaker around every LLM call (llm_resilience.py)
+LLM_DEADLINE_S = float(os.environ.get("METABOCHAT_LLM_DEADLINE_S", "30"))
+LLM_HEDGE = os.environ.get("METABOCHAT_LLM_HEDGE", "auto")  # "auto" (observed p95), seconds, or "off"
+LLM_RETRIES = int(os.environ.get("METABOCHAT_LLM_RETRIES", "2"))
+LLM_BREAKER_FAILURES = int(os.environ.get("METABOCHAT_LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_S = float(os.environ.get("METABOCHAT_LLM_BREAKER_RESET_S", "30"))
+
+# Background workers loading the proteins / concentrations / properties of the
+# metabolites a question resolved to while the LLM answers it (prefetch.py); 0 disables.
+PREFETCH_WORKERS = int(os.environ.get("METABOCHAT_PREFETCH_WORKERS", "2"))
+PREFETCH_MAX_IDS = int(os.environ.get("METABOCHAT_PREFETCH_MAX_IDS", "3"))
+PREFETCH_MAX_PENDING = int(os.environ.get("METABOCHAT_PREFETCH_MAX_PENDING", "16"))
+
+# Shown above DB-only answers served while the LLM circuit is open
+DEGRADED_NOTE = "_The language model is temporarily unavailable; this answer comes straight from the database._"
+
+# Time-to-first-token and total latency of every LLM request (see llm_stream.py)
+llm_latency = LatencyLog()
+
+# Any OpenAI-compatible chat-completions endpoint; point it at
+# utils/llm_stub_server.py for offline runs and benchmarks.
+LLM_BASE_URL = os.environ.get("METABOCHAT_LLM_BASE_URL", "https://api.groq.com/openai/v1")
+
+def get_client():
+    def build():
+        import openai
+        return openai.OpenAI(
+            base_url=LLM_BASE_URL,
+            api_key=os.environ.get("METABOCHAT_LLM_API_KEY") or os.environ.get("groq") or "unused",
+            max_retries=0,  # retries and hedging happen in get_llm()
+        )
+    return _lazy("client", build)
+
+def get_db_handler():
+    """Raises if the database is unreachable; the CLI entry points turn that into exit(1)."""
+    # METABOCHAT_DB_BACKEND=sqlite (+ METABOCHAT_SQLITE_PATH) runs on the embedded backend
+    return _lazy("db_handler", lambda: create_db_handler(
         dbname="metabolites_pg",
         user="postgres",
         password="your_password",  # Replace with your actual password
         host="localhost",
         port="5432"
-    )
-except Exception as e:
-    print(f"Error: Failed to connect to database: {e}")
-    sys.exit(1)
+    ))
+
+def get_retriever():
+    def build():
+        from utils.hybrid_retrieval import HybridRetriever
+        return HybridRetriever(get_db_handler())
+    return _lazy("retriever", build)
+
+def open_response_cache():
+    """
+    Answer cache in front of generate_response ($METABOCHAT_RESPONSE_CACHE, default
+    ~/.cache/metabochat/response_cache.sqlite, "off" disables).
+    METABOCHAT_CACHE_SEMANTIC=1 adds the paraphrase tier (needs the semantic_index model).
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    path = os.environ.get("METABOCHAT_RESPONSE_CACHE", os.path.join(cache_home, "metabochat", "response_cache.sqlite"))
+    if path.lower() in ("", "off", "none"):
+        return None
+    try:
+        from utils.response_cache import ResponseCache
+        embedder = None
+        if os.environ.get("METABOCHAT_CACHE_SEMANTIC") == "1":
+            from utils.semantic_index import get_embedder
+            embedder = get_embedder().encode
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        return ResponseCache(
+            path,
+            dataset_version=get_db_handler().dataset_version,
+            embedder=embedder,
+            similarity_threshold=float(os.environ.get("METABOCHAT_CACHE_SIM_THRESHOLD", "0.92")),
+        )
+    except Exception as e:
+        print(f"Warning: response cache disabled: {e}")
+        return None
+
+def get_response_cache():
+    return _lazy("response_cache", open_response_cache)
+
+def load_entity_recognizer():
+    """
+    Prebuilt automaton (python src/utils/entity_recognizer.py --out ./data/entities.pkl);
+    without it extract_keywords falls back to the regexes below.
+    """
+    try:
+        return get_db_handler().entity_recognizer()
+    except Exception as e:
+        print(f"Warning: could not load entity snapshot: {e}")
+        return None
+
+def get_entity_recognizer():
+    # cached on the handler and rebuilt when the snapshot's dataset version is stale
+    return load_entity_recognizer()
+
+def get_prefetcher():
+    def build():
+        if PREFETCH_WORKERS <= 0:
+            return None
+        from utils.prefetch import Prefetcher
+        return Prefetcher(get_db_handler(), workers=PREFETCH_WORKERS, max_ids=PREFETCH_MAX_IDS,
+                          max_pending=PREFETCH_MAX_PENDING)
+    return _lazy("prefetcher", build)
+
+def prefetch_metrics():
+    """Result-cache and speculative-prefetch counters (hit and waste rates) for /health and the benchmarks."""
+    prefetch = get_prefetcher()
+    return prefetch.snapshot() if prefetch is not None else get_db_handler().result_cache().snapshot()
+
+def init_all():
+    """Build everything up front (long-running services warm up before taking traffic)."""
+    get_db_handler()
+    get_retriever()
+    get_response_cache()
+    get_entity_recognizer()
+    get_db_handler().graph_index()  # built lazily otherwise, by the first similarity question
+    get_prefetcher()
+    get_client()
+
+@functools.lru_cache(maxsize=None)
+def _patterns():
+    """Keyword and intent regexes, compiled on first use."""
+    flags = re.IGNORECASE
+    return {
+        "hmdb_id": re.compile(r'(HMDB0+\d+)', flags),
+        "name": re.compile(r'(?:molecular weight|structure|role of|what is|of|for|in|with|to|by|hmdb id)\s+([\w\s-]+?)(?:\s+(in|of|with|to|for|by|$))', flags),
+        "disease": re.compile(r'(?:disease|disorder|condition)\s*[:\- ]*([\w\s]+)', flags),
+        "pathway": re.compile(r'\b(?:pathway|cycle|metabolism|process)\s+(?:of\s+)?([\w\s]+)', flags),
+        "biofluid": re.compile(r'(urine|blood|plasma|csf|cerebrospinal fluid|serum|saliva|feces|sweat)', flags),
+        "simple": re.compile(r'\b(molecular weight|molar mass|formula|structure|smiles|hmdb id)\b', flags),
+        "not_simple": re.compile(r'\b(compare|list|which|how|altered)\b', flags),
+        # "metabolites related/similar to X", "similar to X", "share ... with X", "in common with X"
+        "related": re.compile(r'\b(metabolites?|compounds?|molecules?)\s+(\w+\s+){0,2}(related|similar)\s+to\b'
+                              r'|\bsimilar\s+to\b|\bshar(e|es|ing)\b.*\bwith\b|\bin common with\b', flags),
+        "comparative": re.compile(r'\b(compare|vs\.?|versus|differences|similarities|contrast)\b', flags),
+        "list_based": re.compile(r'\b(list|key|top|three|several|commonly|which|byproducts|indicators|altered|found in)\b', flags),
+        "think": re.compile(r'<think>.*?</think>', re.DOTALL | flags),
+        "newlines": re.compile(r'\n{3,}'),
+        "tag": re.compile(r'<[^>]+>'),
+    }
+
+ENTITY_KEYWORDS = {"metabolite": "name", "disease": "disease", "pathway": "pathway",
+                   "biofluid": "biofluid", "protein": "protein"}
+
+def extract_entities(prompt):
+    """Map known entity mentions to keywords: canonical names plus database ids."""
+    keywords = {}
+    entities = get_entity_recognizer().recognize(prompt)
+    for ent in entities:
+        key = ENTITY_KEYWORDS[ent.entity_type]
+        if key not in keywords:
+            keywords[key] = ent.canonical
+            if ent.entity_type == "metabolite":
+                keywords['metabolite_hmdb_id'] = ent.entity_id
+    if entities:
+        keywords['entities'] = entities
+    return keywords
 
 def extract_keywords(prompt):
     """Extract keywords from the user prompt."""
+    patterns = _patterns()
+    if get_entity_recognizer() is not None:
+        keywords = extract_entities(prompt)
+        hmdb_id_match = patterns["hmdb_id"].search(prompt)
+        if hmdb_id_match:
+            keywords['hmdb_id'] = hmdb_id_match.group(1).strip()
+        if keywords:
+            return keywords
+
     keywords = {}
-    name_match = re.search(r'(?:molecular weight|structure|role of|what is|of|for|in|with|to|by|hmdb id)\s+([\w\s-]+?)(?:\s+(in|of|with|to|for|by|$))', prompt, re.IGNORECASE)
-    disease_match = re.search(r'(?:disease|disorder|condition)\s*[:\- ]*([\w\s]+)', prompt, re.IGNORECASE)
-    pathway_match = re.search(r'\b(?:pathway|cycle|metabolism|process)\s+(?:of\s+)?([\w\s]+)', prompt, re.IGNORECASE)
-    hmdb_id_match = re.search(r'(HMDB0+\d+)', prompt, re.IGNORECASE)
-    biofluid_match = re.search(r'(urine|blood|plasma|csf|cerebrospinal fluid|serum|saliva|feces|sweat)', prompt, re.IGNORECASE)
+    name_match = patterns["name"].search(prompt)
+    disease_match = patterns["disease"].search(prompt)
+    pathway_match = patterns["pathway"].search(prompt)
+    hmdb_id_match = patterns["hmdb_id"].search(prompt)
+    biofluid_match = patterns["biofluid"].search(prompt)
 
     if name_match:
         keywords['name'] = name_match.group(1).strip()
@@ -58,60 +241,161 @@ def extract_keywords(prompt):
 
     return keywords
 
-def query_database(prompt):
-    """Query the database based on extracted keywords."""
+def _cached(session, key, fetch):
+    """
+    Per-session reuse of DB lookups (a follow-up fetches only what it adds),
+    backed by the handler's result cache, where the prefetcher puts its rows.
+    """
+    shared = get_db_handler().result_cache()
+    fetch_shared = lambda: shared.get_or_fetch(key, fetch)
+    return fetch_shared() if session is None else session.cached(key, fetch_shared)
+
+def _prefetch_related(rows, headers):
+    """Start loading what a follow-up about these metabolites would ask for; returns immediately."""
+    prefetch = get_prefetcher()
+    if prefetch is None or not rows or not headers or "HMDB_ID" not in headers:
+        return
+    i = headers.index("HMDB_ID")
+    prefetch.submit(row[i] for row in rows)
+
+RELATED_VIA = (("protein", ("protein", "enzyme")), ("pathway", ("pathway",)), ("disease", ("disease",)))
+
+def is_similarity_question(prompt, keys):
+    """
+    True for metabolite-similarity questions ("metabolites similar to X",
+    "share a pathway with X"), which query_related answers from the graph.
+    A disease, pathway or biofluid target of its own ("which metabolites are
+    related to depression") goes to retrieval instead. Only recognized
+    entities and the biofluid word list count as targets: the fallback
+    disease/pathway regexes capture whatever follows the word
+    ("share diseases with glucose" -> 's with glucose').
+    """
+    if not _patterns()["related"].search(prompt):
+        return False
+    if 'entities' in keys:
+        return not any(e.entity_type in ("disease", "pathway", "biofluid") for e in keys['entities'])
+    return 'biofluid' not in keys
+
+# (prompt, routed to query_related?) - run with --check-routing
+ROUTING_CASES = [
+    ("What diseases are related to glucose?", False),
+    ("Is serotonin related to depression?", False),
+    ("Which metabolites are found in urine and similar to glucose?", False),
+    ("Which metabolites share diseases with glucose?", True),
+    ("Which metabolites share a pathway with glucose?", True),
+    ("Find metabolites similar to serotonin", True),
+    ("What does dopamine have in common with serotonin?", True),
+]
+
+def check_routing():
+    """Print each ROUTING_CASES decision; True when all match."""
+    ok = True
+    for prompt, expected in ROUTING_CASES:
+        keys = extract_keywords(prompt)
+        routed = is_similarity_question(prompt, keys)
+        ok &= routed == expected
+        print(f"{'ok  ' if routed == expected else 'FAIL'} {'related' if routed else 'other':8} {prompt!r}")
+    return ok
+
+def query_related(prompt, keys, session=None):
+    """
+    "Metabolites related to / sharing enzymes with X" from the in-memory CSR
+    graph (graph_index.py), ranked by Adamic-Adar. None when X can't be
+    resolved or shares nothing, so the caller falls through to retrieval.
+    """
+    db_handler = get_db_handler()
+    anchor = keys.get('hmdb_id')
+    if anchor is None and 'name' in keys:
+        found = db_handler.query_by_name(keys['name'], limit=1)
+        anchor = found[0][1] if found else None
+    if anchor is None:
+        hits = get_retriever().retrieve(prompt, keys, limit=1).hits
+        anchor = hits[0].hmdb_id if hits else None
+    if anchor is None:
+        return None
+    lower = prompt.lower()
+    via = [kind for kind, words in RELATED_VIA if any(w in lower for w in words)] or None
+    related = db_handler.related_metabolites(anchor, via=via, limit=10)
+    if not related:
+        return None
+    headers = ["HMDB_ID", "Name", "Score", "Shared"]
+    rows = [(r["hmdb_id"], r["name"], round(r["score"], 3),
+             ", ".join(f"{n} {kind}{'s' if n > 1 else ''}" for kind, n in r["shared"].items()))
+            for r in related]
+    if session is not None:
+        session.observe(keys, [(anchor, keys.get('name'))], ["HMDB_ID", "Name"])
+    _prefetch_related(rows, headers)
+    return format_results(rows, headers), rows, headers
+
+def query_database(prompt, session=None):
+    """
+    Query the database based on extracted keywords.
+    With a ChatSession, references like "it" resolve to the metabolite under
+    discussion and rows fetched in earlier turns are reused.
+    """
     keys = extract_keywords(prompt)
+    if session is not None:
+        keys, resolved = session.resolve(prompt, keys)
+        if resolved and 'hmdb_id' in keys:
+            print(f"[follow-up: resolved to {keys['name']} ({keys['hmdb_id']})]")
+        elif resolved:
+            print(f"[follow-up: resolved to {', '.join(e.canonical for e in keys['entities'])}]")
+    db_handler = get_db_handler()
     try:
-        if 'name' in keys:
-            by_name = db_handler.query_by_name(keys['name'], limit=5)
-            if by_name:
-                if "hmdb id" in prompt.lower():
-                    return format_results([by_name[0]], ["ID", "HMDB_ID", "Name"]), [by_name[0]], ["ID", "HMDB_ID", "Name"]
-                return format_results(by_name, ["ID", "HMDB_ID", "Name", "Formula", "Molecular Weight", "SMILES"]), by_name, ["ID", "HMDB_ID", "Name", "Formula", "Molecular Weight", "SMILES"]
-            else:
-                fts_rows = db_handler.full_text_search(keys['name'], limit=5)
-                return format_results(fts_rows, ["ID", "HMDB_ID", "Name", "Rank"]), fts_rows, ["ID", "HMDB_ID", "Name", "Rank"]
+        if is_similarity_question(prompt, keys):
+            related = query_related(prompt, keys, session)
+            if related is not None:
+                return related
 
         if 'hmdb_id' in keys:
-            row = db_handler.query_by_hmdb_id(keys['hmdb_id'])
+            hmdb_id = keys['hmdb_id']
+            row = _cached(session, ("hmdb_id", hmdb_id), lambda: db_handler.query_by_hmdb_id(hmdb_id))
             if row:
                 headers = ["ID", "HMDB_ID", "Name", "Formula", "Molecular Weight", "SMILES"]
                 rows = [row]
                 if 'protein' in prompt.lower() or 'proteins' in prompt.lower():
-                    proteins = db_handler.query_proteins(keys['hmdb_id'])
+                    proteins = _cached(session, ("proteins", hmdb_id), lambda: db_handler.query_proteins(hmdb_id))
                     if proteins:
                         headers.extend(["UniProt ID", "Protein Name", "Gene Name"])
                         rows = [(r + p) for r in rows for p in proteins]
                 if 'concentration' in prompt.lower() or 'concentrations' in prompt.lower():
                     ctype = 'abnormal' if 'abnormal' in prompt.lower() else 'normal'
                     biofluid = keys.get('biofluid')
-                    concs = db_handler.query_concentrations(keys['hmdb_id'], ctype, biofluid)
+                    concs = _cached(session, ("concentrations", hmdb_id, ctype),
+                                    lambda: db_handler.query_concentrations(hmdb_id, ctype))
+                    if concs and biofluid:
+                        # keep everything when the biofluid has no measurements
+                        concs = [c for c in concs if biofluid.lower() in str(c[1]).lower()] or concs
                     if concs:
                         headers.extend(["Concentration Type", "Biofluid", "Value", "Age", "Sex", "Condition"])
                         rows = [(r + c) for r in rows for c in concs]
+                if session is not None:
+                    session.observe(keys, rows, headers)
+                _prefetch_related(rows, headers)
                 return format_results(rows, headers), rows, headers
-            else:
-                fts = db_handler.full_text_search(keys['hmdb_id'], limit=5)
-                return format_results(fts, ["ID", "HMDB_ID", "Name", "Rank"]), fts, ["ID", "HMDB_ID", "Name", "Rank"]
-
-        if 'disease' in keys:
-            drows = db_handler.query_by_disease(keys['disease'], limit=5)
-            if drows:
-                return format_results(drows, ["ID", "HMDB_ID", "Name", "Disease"]), drows, ["ID", "HMDB_ID", "Name", "Disease"]
-
-        if 'pathway' in keys:
-            prows = db_handler.query_by_pathway(keys['pathway'], limit=5)
-            if prows:
-                return format_results(prows, ["ID", "HMDB_ID", "Name", "Pathway"]), prows, ["ID", "HMDB_ID", "Name", "Pathway"]
 
-        if 'biofluid' in keys:
-            brows = db_handler.query_by_biofluid(keys['biofluid'], limit=5)
-            if brows:
-                return format_results(brows, ["ID", "HMDB_ID", "Name", "Biofluid"]), brows, ["ID", "HMDB_ID", "Name", "Biofluid"]
-
-        frows = db_handler.full_text_search(prompt, limit=5)
-        if frows:
-            return format_results(frows, ["ID", "HMDB_ID", "Name", "Rank"]), frows, ["ID", "HMDB_ID", "Name", "Rank"]
+        # Everything else: all rankers at once, fused by reciprocal rank (hybrid_retrieval.py)
+        result = get_retriever().retrieve(prompt, keys, limit=5)
+        if result.timed_out:
+            print(f"Retrieval budget exceeded, skipped: {', '.join(result.timed_out)}")
+        if result.hits:
+            from utils.hybrid_retrieval import format_sources
+            if "hmdb id" in prompt.lower():
+                top = result.hits[0]
+                if session is not None:
+                    session.observe(keys, [top[:3]], ["ID", "HMDB_ID", "Name"])
+                _prefetch_related([top[:3]], ["ID", "HMDB_ID", "Name"])
+                return format_results([top[:3]], ["ID", "HMDB_ID", "Name"]), [top[:3]], ["ID", "HMDB_ID", "Name"]
+            headers = ["ID", "HMDB_ID", "Name", "Formula", "Molecular Weight", "SMILES", "Score", "Matched By"]
+            rows = []
+            for hit in result.hits:
+                details = _cached(session, ("hmdb_id", hit.hmdb_id), lambda: db_handler.query_by_hmdb_id(hit.hmdb_id))
+                details = details or tuple(hit[:3]) + (None, None, None)
+                rows.append(tuple(details) + (round(hit.score, 4), format_sources(hit)))
+            if session is not None:
+                session.observe(keys, rows, headers)
+            _prefetch_related(rows, headers)
+            return format_results(rows, headers), rows, headers
 
         return "No relevant database entries found.", None, None
     except Exception as e:
@@ -137,14 +421,67 @@ def format_results(rows, headers, max_items=10):
 def clean_response(response_text):
     """Clean the LLM response for proper formatting."""
     cleaned = response_text.encode('utf-8', 'ignore').decode('utf-8')
-    cleaned = re.sub(r'\n{3,}', '\n\n', cleaned).strip()
-    cleaned = re.sub(r'<[^>]+>', '', cleaned)
+    patterns = _patterns()
+    cleaned = patterns["think"].sub('', cleaned)
+    cleaned = patterns["newlines"].sub('\n\n', cleaned).strip()
+    cleaned = patterns["tag"].sub('', cleaned)
     if not cleaned.endswith(('.', '!', '?')) and not cleaned.endswith('```'):
         cleaned += "."
     return cleaned
 
-def generate_response(prompt, is_comparison=False, is_list_based=False, is_simple=False):
-    """Generate a smart LLM response with timeout and error handling."""
+def create_completion(**kwargs):
+    """One client.chat.completions.create attempt, inside llm_gate's budget when one is set."""
+    client = get_client()
+    if llm_gate is None:
+        return client.chat.completions.create(**kwargs)
+    prompt_text = " ".join(m["content"] for m in kwargs["messages"])
+    reserve = estimate_tokens(prompt_text) + min(kwargs.get("max_tokens", 0), COMPLETION_TOKENS_RESERVE)
+    llm_gate.acquire(reserve)
+    response = client.chat.completions.create(**kwargs)
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        llm_gate.settle(reserve, usage.total_tokens)
+    return response
+
+def _on_rate_limit(delay):
+    print(f"Rate limited (429), backing off {delay:.1f}s")
+    if llm_gate is not None:
+        llm_gate.penalize(delay)
+
+def get_llm():
+    def build():
+        hedge = None if LLM_HEDGE == "off" else (LLM_HEDGE if LLM_HEDGE == "auto" else float(LLM_HEDGE))
+        return ResilientLLM(
+            create_completion,
+            deadline_s=LLM_DEADLINE_S,
+            hedge_after_s=hedge,
+            max_retries=LLM_RETRIES,
+            breaker=CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_S),
+            on_rate_limit=_on_rate_limit,
+        )
+    return _lazy("llm", build)
+
+def llm_metrics():
+    """Retry / hedge / deadline / breaker counters of the LLM call layer."""
+    return get_llm().snapshot()
+
+class DeadlineExceeded(Exception):
+    """Raised from an on_token callback to abandon an answer (the HTTP service's request deadline)."""
+
+def generate_response(prompt, is_comparison=False, is_list_based=False, is_simple=False, on_token=None,
+                      cache_key=None, history=None, fallback=None):
+    """
+    Generate a smart LLM response with timeout and error handling.
+    With on_token, the answer is streamed: on_token(text) receives each
+    visible piece as it arrives (<think> blocks and tags filtered out).
+    cache_key=(user_prompt, db_context) serves/stores the answer in response_cache.
+    history (ChatSession.history()) is sent as a second system message.
+    While the LLM circuit is open, fallback() (if given) supplies the answer instead.
+    """
+    import openai
+    timer = StreamTimer()
+    cached = aborted = False
+    response_cache = get_response_cache()
     try:
         if not prompt.strip():
             return "Error: No valid input provided."
@@ -173,37 +510,101 @@ def generate_response(prompt, is_comparison=False, is_list_based=False, is_simpl
                 "Begin with a general comparison overview, then detail specific differences or similarities."
             )
 
+        if response_cache is not None and cache_key is not None:
+            hit = response_cache.get(model_id, system_content, *cache_key)
+            if hit is not None:
+                cached = True
+                timer.token()
+                if on_token is not None:
+                    on_token(hit)
+                return hit
+
         print("Generating LLM response...")
-        response = client.chat.completions.create(
+        response = get_llm().complete(
             messages=[
                 {"role": "system", "content": system_content},
+                *([{"role": "system", "content": "Conversation so far (use it to resolve references; "
+                                                 "answer only the new query):\n" + history}] if history else []),
                 {"role": "user", "content": prompt}
             ],
             model=model_id,
             max_tokens=2048,
             temperature=0.3,
-            timeout=10
+            stream=on_token is not None
         )
-        final_response = response.choices[0].message.content.strip()
-        return clean_response(final_response)
-    except requests.exceptions.Timeout:
-        print("LLM response timed out after 10 seconds.")
+        if on_token is not None:
+            pieces = []
+            for piece in stream_text(response, timer):
+                pieces.append(piece)
+                on_token(piece)
+            final_response = "".join(pieces)
+        else:
+            timer.token()
+            final_response = response.choices[0].message.content.strip()
+        answer = clean_response(final_response)
+        if response_cache is not None and cache_key is not None:
+            response_cache.put(model_id, system_content, *cache_key, answer)
+        return answer
+    except LLMUnavailable as e:
+        print(f"LLM unavailable: {e}")
+        if fallback is not None:
+            get_llm().count("degraded")
+            return fallback()
+        return "Error: The language model is temporarily unavailable. Please try again shortly."
+    except (LLMDeadlineExceeded, openai.APITimeoutError) as e:
+        print(f"LLM response timed out: {e}")
         return "Error: Response generation took too long. Please try again later."
-    except openai.error.AuthenticationError:
+    except openai.AuthenticationError:
         print("Authentication error: Invalid API key.")
         return "Error: Invalid API key. Please check your Groq API key."
-    except openai.error.APIError as e:
+    except openai.APIError as e:
         print(f"API error: {e}")
         return f"Error: API error occurred. {e}"
+    except DeadlineExceeded:
+        aborted = True  # the caller gave up; not an LLM latency sample
+        raise
     except Exception as e:
         print(f"Unexpected error: {e}")
         return "Error: An unexpected error occurred while generating the response."
+    finally:
+        if not aborted:
+            llm_latency.add(timer.done(), streamed=on_token is not None, cached=cached)
 
-def synthesize_response(user_prompt, db_response):
-    """Synthesize a response combining database results and LLM output."""
-    simple = re.search(r'\b(molecular weight|structure|role of|what is|hmdb id)\b', user_prompt, re.IGNORECASE) and not re.search(r'\b(compare|list|which|how|altered)\b', user_prompt, re.IGNORECASE)
-    comparative = re.search(r'\b(compare|vs\.?|versus|differences|similarities|contrast)\b', user_prompt, re.IGNORECASE)
-    list_based = re.search(r'\b(list|key|top|three|several|commonly|which|byproducts|indicators|altered|found in)\b', user_prompt, re.IGNORECASE)
+def _mentions(prompt):
+    """Recognized entity mentions in the prompt, for the template fast path."""
+    recognizer = get_entity_recognizer()
+    return recognizer.recognize(prompt) if recognizer is not None else []
+
+def degraded_answer(user_prompt, db_response, rows, headers):
+    """DB-only answer for when the LLM circuit is open: the template answer, else the database table."""
+    fast = fast_answer(user_prompt, rows, headers, _mentions(user_prompt))
+    if fast:
+        body = fast[1]
+    elif rows:
+        body = f"Database results for your query:\n\n{db_response}"
+    else:
+        body = ("No matching database entries were found, and general-knowledge answers need the "
+                "language model. Please try again shortly.")
+    return f"{DEGRADED_NOTE}\n\n{body}"
+
+def synthesize_response(user_prompt, db_response, on_token=None, rows=None, headers=None, history=None):
+    """
+    Synthesize a response combining database results and LLM output.
+    rows/headers (as returned by query_database) enable the template fast path;
+    history is the conversation so far (ChatSession.history()).
+    """
+    history_key = "\0history\0" + history if history else ""
+    cache_key = (user_prompt, (db_response or "") + history_key)
+    patterns = _patterns()
+    simple = patterns["simple"].search(user_prompt) and not patterns["not_simple"].search(user_prompt)
+    comparative = patterns["comparative"].search(user_prompt)
+    list_based = patterns["list_based"].search(user_prompt)
+
+    def degraded():
+        answer = degraded_answer(user_prompt, db_response, rows, headers)
+        if on_token is not None:
+            on_token(answer)
+        return answer
 
     if not db_response or db_response.strip() in ["No relevant database entries found.", "Error querying database."]:
         fallback_prompt = (
@@ -212,7 +613,29 @@ def synthesize_response(user_prompt, db_response):
             "and then includes specific details. If applicable, suggest why the information might not be available "
             "(e.g., rare metabolite, incomplete database) and offer related insights or alternative queries."
         )
-        return generate_response(fallback_prompt, is_comparison=comparative, is_list_based=list_based, is_simple=simple)
+        return generate_response(fallback_prompt, is_comparison=comparative, is_list_based=list_based, is_simple=simple, on_token=on_token, cache_key=cache_key, history=history, fallback=degraded)
+
+    if simple and FAST_ANSWERS in ("template", "explain"):
+        fast = fast_answer(user_prompt, rows, headers, _mentions(user_prompt))
+        if fast:
+            _, answer = fast
+            if FAST_ANSWERS == "template":
+                if on_token is not None:
+                    on_token(answer)
+                return answer
+            if on_token is not None:
+                on_token(answer + "\n\n")
+            instructions = (
+                f"User Query:\n{user_prompt}\n\n"
+                f"Database Results:\n{db_response}\n\n"
+                f"The direct answer has already been shown to the user:\n{answer}\n\n"
+                "Add one short explanatory paragraph (2-3 sentences) of scientific context in markdown. "
+                "Do not restate the value."
+            )
+            explanation = generate_response(instructions, is_simple=True, on_token=on_token,
+                                            cache_key=(user_prompt, "explain\0" + db_response + history_key),
+                                            history=history, fallback=lambda: "")
+            return f"{answer}\n\n{explanation}" if explanation else answer
 
     if simple:
         instructions = (
@@ -221,7 +644,7 @@ def synthesize_response(user_prompt, db_response):
             "Provide a concise, direct answer in markdown format using the database data. "
             "Start with a brief general statement, followed by the specific answer."
         )
-        return generate_response(instructions, is_comparison=False, is_list_based=False, is_simple=True)
+        return generate_response(instructions, is_comparison=False, is_list_based=False, is_simple=True, on_token=on_token, cache_key=cache_key, history=history, fallback=degraded)
     elif comparative:
         instructions = (
             f"User Query:\n{user_prompt}\n\n"
@@ -229,7 +652,7 @@ def synthesize_response(user_prompt, db_response):
             "Format the answer as a markdown table comparing relevant features. "
             "Begin with a general overview of the comparison, then provide specific details from the database."
         )
-        return generate_response(instructions, is_comparison=True, is_list_based=False, is_simple=False)
+        return generate_response(instructions, is_comparison=True, is_list_based=False, is_simple=False, on_token=on_token, cache_key=cache_key, history=history, fallback=degraded)
     elif list_based:
         instructions = (
             f"User Query:\n{user_prompt}\n\n"
@@ -237,7 +660,7 @@ def synthesize_response(user_prompt, db_response):
             "Format the answer as a markdown table listing the key items with descriptions. "
             "Start with a general explanation of the list’s context, then include specific database entries."
         )
-        return generate_response(instructions, is_comparison=False, is_list_based=True, is_simple=False)
+        return generate_response(instructions, is_comparison=False, is_list_based=True, is_simple=False, on_token=on_token, cache_key=cache_key, history=history, fallback=degraded)
     else:
         instructions = (
             f"User Query:\n{user_prompt}\n\n"
@@ -245,10 +668,59 @@ def synthesize_response(user_prompt, db_response):
             "Provide a thorough explanation in markdown format. "
             "Begin with a general overview, then incorporate all relevant database data and supplement with specific details."
         )
-        return generate_response(instructions, is_comparison=False, is_list_based=False, is_simple=False)
+        return generate_response(instructions, is_comparison=False, is_list_based=False, is_simple=False, on_token=on_token, cache_key=cache_key, history=history, fallback=degraded)
+
+def pack_for_llm(db_response, rows, headers):
+    """Token-budgeted DB context for the LLM prompt (the verbose text when there are no rows)."""
+    if not rows:
+        return db_response, None
+    packed = pack_context(rows, headers, CONTEXT_TOKENS, baseline=db_response)
+    return packed.text, packed
+
+def answer_question(question, on_token=None, session=None):
+    """One question end to end without printing: the batch-mode / HTTP-service record."""
+    timings = {}
+    t = time.perf_counter()
+    db_response, rows, headers = query_database(question, session)
+    timings["retrieval_s"] = time.perf_counter() - t
+    t = time.perf_counter()
+    llm_context, packed = pack_for_llm(db_response, rows, headers)
+    timings["packing_s"] = time.perf_counter() - t
+    t = time.perf_counter()
+    history = session.history() if session is not None else None
+    answer = synthesize_response(question, llm_context, on_token=on_token, rows=rows, headers=headers,
+                                 history=history)
+    timings["answer_s"] = time.perf_counter() - t
+    if session is not None:
+        session.add_turn(question, answer)
+    return {
+        "answer": answer,
+        "headers": headers,
+        "db_rows": [list(r) for r in rows] if rows else [],
+        "context_tokens": packed.tokens if packed else None,
+        "timings": timings,
+        "error": (answer if answer.startswith("Error:") else
+                  "llm unavailable (degraded DB-only answer)" if answer.startswith(DEGRADED_NOTE) else None),
+    }
+
+def run_batch_mode(args):
+    global llm_gate
+    llm_gate = RateLimiter(rpm=args.rpm, tpm=args.tpm)
+    # Throughput over latency: ride out 429 storms instead of failing the question
+    llm = get_llm()
+    llm.max_retries = max(llm.max_retries, 5)
+    llm.deadline_s = max(llm.deadline_s, 300.0)
+    questions = load_questions(args.batch)
+    summary = run_batch(questions, answer_question, args.out, concurrency=args.concurrency)
+    print(f"Answered {summary['answered']}, errors {summary['errors']}, skipped {summary['skipped']} "
+          f"in {summary['elapsed_s']:.1f}s; rate-limit wait {llm_gate.waited_s:.1f}s, "
+          f"{llm_gate.penalties} 429 backoffs")
+    print(f"LLM latency: {llm_latency.summary()}")
+    print(f"LLM call layer: {llm_metrics()}")
 
 def main():
     print("Welcome to MetaboChat! Ask any question about metabolites, diseases, or pathways (or type 'exit' to quit).")
+    session = ChatSession()
     while True:
         user_q = input("\nEnter your query: ").strip()
         if not user_q:
@@ -258,18 +730,58 @@ def main():
             print("Exiting MetaboChat. Goodbye!")
             break
 
-        db_response, raw_rows, used_headers = query_database(user_q)
+        db_response, raw_rows, used_headers = query_database(user_q, session)
+        llm_context, packed = pack_for_llm(db_response, raw_rows, used_headers)
+        if packed:
+            print(f"[context: {packed.tokens} tokens, {packed.saved} saved vs verbose; "
+                  f"{packed.rows_kept}/{packed.rows_total} metabolites{', truncated' if packed.truncated else ''}]")
         if db_response and db_response not in ["No relevant database entries found.", "Error querying database."]:
             print("\n[Database Results]:")
             print(db_response)
-            final_answer = synthesize_response(user_q, db_response)
             print("\n[Final Answer]:")
-            print(final_answer)
         else:
             print("\n[No relevant DB data or empty results] => LLM fallback.")
-            fallback_answer = synthesize_response(user_q, db_response)
             print("\n[LLM Response]:")
-            print(fallback_answer)
+        streamed = []
+
+        def show(piece):
+            streamed.append(piece)
+            print(piece, end="", flush=True)
+
+        requests_before = llm_latency.count
+        answer = synthesize_response(user_q, llm_context, on_token=show, rows=raw_rows, headers=used_headers,
+                                     history=session.history())
+        session.add_turn(user_q, answer)
+        if streamed:
+            print()
+        else:
+            print(answer)
+        if llm_latency.count > requests_before:
+            last = llm_latency.records[-1]
+            ttft = f"first token {last['ttft_s']:.2f}s, " if last["ttft_s"] is not None else ""
+            print(f"[{ttft}total {last['total_s']:.2f}s]")
+        else:
+            print("[answered from template, no LLM call]")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MetaboChat: interactive, or batch QA over a JSONL file")
+    parser.add_argument("--batch", help='JSONL of {"id": ..., "question": ...} to answer non-interactively')
+    parser.add_argument("--out", default="answers.jsonl", help="output JSONL (also the resume checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=int, default=30, help="LLM requests per minute (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=6000, help="LLM tokens per minute (0 = unlimited)")
+    parser.add_argument("--check-routing", action="store_true", help="print the ROUTING_CASES decisions and exit")
+    args = parser.parse_args()
+    if args.check_routing:
+        sys.exit(0 if check_routing() else 1)
+    try:
+        get_db_handler()
+    except Exception as e:
+        print(f"Error: Failed to connect to database: {e}")
+        sys.exit(1)
+    if args.batch:
+        run_batch_mode(args)
+    else:
+        main()
\ No newline at end of file
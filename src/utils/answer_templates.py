@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+import re
+
+# (intent, field regex, required fields, template). A template only answers a
+# bare lookup: the whole prompt is "what is / give me the <field> of <entity>".
+TEMPLATES = [
+    ("hmdb_id", r"hmdb id", ("Name", "HMDB_ID"),
+     "The HMDB ID of **{Name}** is **{HMDB_ID}**."),
+    ("molecular_weight", r"(?:average )?(?:molecular weight|molar mass)", ("Name", "HMDB_ID", "Molecular Weight"),
+     "**{Name}** ({HMDB_ID}) has an average molecular weight of **{Molecular Weight} g/mol**{formula_clause}."),
+    ("formula", r"(?:chemical |molecular )?formula", ("Name", "HMDB_ID", "Formula"),
+     "The chemical formula of **{Name}** ({HMDB_ID}) is **{Formula}**."),
+    ("structure", r"(?:chemical )?structure|smiles(?: string)?", ("Name", "HMDB_ID", "SMILES"),
+     "**{Name}** ({HMDB_ID}){formula_paren} has the structure (SMILES):\n\n```\n{SMILES}\n```"),
+]
+
+_LEAD = r"^\s*(?:(?:what(?:'s| is)|give me|show me|tell me)\s+)?(?:the\s+)?"
+_TAIL = r"\s+(?:of|for)\s+(?:the\s+)?(?P<entity>.+?)\s*[?.!]*\s*$"
+_COMPILED = [(intent, re.compile(_LEAD + f"(?:{rx})" + _TAIL, re.IGNORECASE), req, tpl)
+             for intent, rx, req, tpl in TEMPLATES]
+# Exact (ranker, rank) pairs that single out the top row; see hybrid_retrieval.format_sources
+_STRONG_SOURCES = {("identifier", 1), ("entity", 1), ("name", 1)}
+# Rankers with one list position per metabolite named in the prompt
+_PER_MENTION = ("identifier", "entity")
+
+
+def _present(value):
+    return value is not None and str(value).strip() not in ("", "N/A", "None")
+
+
+def _sources(value):
+    """{(ranker, rank)} from a Matched By cell like 'entity#1, fts#3'."""
+    pairs = set()
+    for part in str(value or "").split(","):
+        ranker, _, rank = part.strip().partition("#")
+        if rank.isdigit():
+            pairs.add((ranker, int(rank)))
+    return pairs
+
+
+def pick_row(rows, headers):
+    """
+    The single row a simple question is about, or None when the result is
+    ambiguous: several distinct metabolites and no exact identifier, entity
+    or name match singling out the first, or more than one metabolite named.
+    """
+    if not rows or not headers or "HMDB_ID" not in headers:
+        return None
+    idx = headers.index("HMDB_ID")
+    if len({r[idx] for r in rows}) == 1:
+        return dict(zip(headers, rows[0]))
+    if "Matched By" in headers:
+        src = headers.index("Matched By")
+        sources = [_sources(r[src]) for r in rows]
+        if any(ranker in _PER_MENTION and rank > 1 for pairs in sources for ranker, rank in pairs):
+            return None  # "glucose and fructose": a second metabolite was named
+        strong = [r for r, pairs in zip(rows, sources) if pairs & _STRONG_SOURCES]
+        if len({r[idx] for r in strong}) == 1 and strong[0] is rows[0]:
+            return dict(zip(headers, rows[0]))
+    return None
+
+
+def match_intent(prompt):
+    """(intent, entity text, required fields, template) when the prompt is a bare lookup, else None."""
+    for intent, rx, required, template in _COMPILED:
+        m = rx.match(prompt)
+        if m:
+            return intent, m.group("entity"), required, template
+    return None
+
+
+def _names_row(text, row, entities):
+    """Whether `text` is exactly the row's name or HMDB id, or a recognized mention of it."""
+    text = text.strip().lower()
+    if text in (str(row.get("Name") or "").lower(), str(row.get("HMDB_ID") or "").lower()):
+        return True
+    return any(e.entity_type == "metabolite" and e.entity_id == row.get("HMDB_ID")
+               and e.surface.strip().lower() == text for e in entities)
+
+
+def render(intent_prompt, row, entities=()):
+    """Markdown answer when the prompt is a bare lookup of this row and its fields are present, else None."""
+    match = match_intent(intent_prompt)
+    if match is None:
+        return None
+    intent, entity, required, template = match
+    if not _names_row(entity, row, entities):
+        return None
+    if not all(_present(row.get(f)) for f in required):
+        return None
+    formula = row.get("Formula")
+    extra = {
+        "formula_clause": f" (formula {formula})" if _present(formula) else "",
+        "formula_paren": f", {formula}," if _present(formula) else "",
+    }
+    return intent, template.format_map({**row, **extra})
+
+
+def fast_answer(prompt, rows, headers, entities=()):
+    """
+    (intent, markdown) for a bare lookup ("What is the molecular weight of
+    glucose?") with one unambiguous row, or None when the question needs the
+    LLM. `entities` are the recognizer's matches in the prompt: with more
+    than one distinct metabolite among them the answer is left to the LLM.
+    """
+    if len({e.entity_id for e in entities if e.entity_type == "metabolite"}) > 1:
+        return None
+    row = pick_row(rows, headers)
+    if row is None:
+        return None
+    return render(prompt, row, entities)
+
+
+#######################################
+# Demo Testing
+#######################################
+if __name__ == "__main__":
+    import os
+    import sys
+    import time
+
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+    from utils.entity_recognizer import Entity
+
+    headers = ["ID", "HMDB_ID", "Name", "Formula", "Molecular Weight", "SMILES", "Score", "Matched By"]
+    rows = [(1, "HMDB0000122", "D-Glucose", "C6H12O6", 180.1559, "OC[C@H]1OC(O)[C@H](O)[C@@H](O)[C@@H]1O", 0.08, "entity#1, fts#1"),
+            (7, "HMDB0000660", "D-Fructose", "C6H12O6", 180.1559, None, 0.01, "fts#2")]
+    glucose = [Entity("metabolite", "HMDB0000122", "D-Glucose", "glucose", 0, 7)]
+    for q in ["What is the molecular weight of glucose?", "What is the structure of glucose?",
+              "What is the HMDB ID of glucose?", "What is glucose?", "How is glucose altered in diabetes?",
+              "What is the structure of the glucose transporter binding site?"]:
+        start = time.perf_counter()
+        out = fast_answer(q, rows, headers, glucose)
+        print(f"{q!r} ({1e6 * (time.perf_counter() - start):.0f} us)\n{out}\n")
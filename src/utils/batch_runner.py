@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budget shared by all worker
+    threads, as two continuously refilling buckets. acquire() blocks until
+    both have room; penalize() pauses everyone after a 429.
+
+    Token reservations are estimates (prompt + expected completion); settle()
+    charges the difference once the real usage is known, so the bucket can
+    go briefly negative and later requests wait it out.
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm or 0)
+        self._tokens = float(tpm or 0)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        self.waited_s = 0.0
+        self.penalties = 0
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+    def _delay(self, tokens, now):
+        delay = max(0.0, self._paused_until - now)
+        if self.rpm and self._requests < 1:
+            delay = max(delay, (1 - self._requests) * 60.0 / self.rpm)
+        if self.tpm:
+            # a single request larger than the whole budget waits for a full bucket
+            need = min(tokens, self.tpm)
+            if self._tokens < need:
+                delay = max(delay, (need - self._tokens) * 60.0 / self.tpm)
+        return delay
+
+    def acquire(self, tokens=0):
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                delay = self._delay(tokens, now)
+                if delay <= 0:
+                    break
+                self._cond.wait(delay)
+            if self.rpm:
+                self._requests -= 1
+            if self.tpm:
+                self._tokens -= tokens
+        self.waited_s += time.monotonic() - start
+
+    def settle(self, reserved, actual):
+        if self.tpm and actual is not None:
+            with self._cond:
+                self._tokens -= actual - reserved
+                self._cond.notify_all()
+
+    def penalize(self, seconds):
+        with self._cond:
+            self.penalties += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+
+def retry_after_seconds(exc, attempt, base=1.0, cap=60.0):
+    """Server's Retry-After when the 429 carries one, else exponential backoff with jitter."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for name in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        value = headers.get(name)
+        if value:
+            try:
+                return min(cap, float(str(value).rstrip("s")))
+            except ValueError:
+                pass
+    return min(cap, base * 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+############################################
+# JSONL input / checkpointed output
+############################################
+def load_questions(path):
+    """JSONL of {"id": ..., "question": ...}; a missing id defaults to the line number."""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"question": item}
+            item.setdefault("id", lineno)
+            questions.append(item)
+    return questions
+
+
+def completed_ids(out_path):
+    """Ids already written to `out_path` by an earlier (possibly interrupted) run."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:  # torn last line from a crash
+                continue
+            if record.get("error") is None:
+                done.add(record["id"])
+    return done
+
+
+def compact_output(out_path):
+    """
+    Rewrite `out_path` with one record per id, the last one written. A retried
+    question appends a new record after its failed one, so a resumed file can
+    hold several rows per id until this runs. Returns the number of rows dropped.
+    """
+    records, rows = {}, 0
+    with open(out_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:  # torn last line from a crash
+                continue
+            rows += 1
+            records.pop(record["id"], None)  # re-insert so ids keep their latest position
+            records[record["id"]] = record
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        for record in records.values():
+            out.write(json.dumps(record, default=str) + "\n")
+    os.replace(tmp_path, out_path)
+    return rows - len(records)
+
+
+def run_batch(questions, answer_fn, out_path, concurrency=4, progress_every=50):
+    """
+    Answer `questions` with answer_fn(question_text) -> dict on a bounded
+    thread pool, appending one JSONL record per finished question. The
+    output file doubles as the checkpoint: rerunning skips ids already
+    answered without error (a record whose "error" is set, or an exception
+    from answer_fn, is retried next time). Once all questions are through,
+    the file is compacted to the last record per id.
+    """
+    done = completed_ids(out_path)
+    todo = [q for q in questions if q["id"] not in done]
+    print(f"{len(questions)} questions, {len(done)} already answered, {len(todo)} to go")
+    write_lock = threading.Lock()
+    summary = {"answered": 0, "errors": 0, "skipped": len(done)}
+    start = time.perf_counter()
+
+    def work(item):
+        t = time.perf_counter()
+        try:
+            record = dict(answer_fn(item["question"]))
+            record.setdefault("error", None)
+        except Exception as e:
+            record = {"answer": None, "error": f"{type(e).__name__}: {e}"}
+        record.setdefault("timings", {})["total_s"] = time.perf_counter() - t
+        return {"id": item["id"], "question": item["question"], **record}
+
+    with open(out_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = set()
+        items = iter(todo)
+        while True:
+            while len(pending) < 2 * concurrency:
+                item = next(items, None)
+                if item is None:
+                    break
+                pending.add(pool.submit(work, item))
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                record = fut.result()
+                with write_lock:
+                    out.write(json.dumps(record, default=str) + "\n")
+                    out.flush()
+                summary["errors" if record["error"] else "answered"] += 1
+                n = summary["answered"] + summary["errors"]
+                if progress_every and n % progress_every == 0:
+                    rate = n / (time.perf_counter() - start)
+                    print(f"  {n}/{len(todo)} done ({rate:.2f} q/s, {summary['errors']} errors)")
+    summary["superseded"] = compact_output(out_path)
+    summary["elapsed_s"] = time.perf_counter() - start
+    return summary
+
+
+#######################################
+# Demo Testing
+#######################################
+if __name__ == "__main__":
+    limiter = RateLimiter(rpm=120, tpm=6000)
+    start = time.perf_counter()
+    for i in range(8):
+        limiter.acquire(tokens=1000)
+        print(f"request {i} at {time.perf_counter() - start:5.2f}s")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Run the same lookup workload against the Postgres and SQLite backends and
+compare per-method latency (from each handler's QueryStats).
+
+    python src/utils/benchmark_backends.py --sqlite-path ./data/metabolites.sqlite --pg-password ...
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from utils.storage_backend import create_db_handler
+
+WORKLOAD = [
+    ("full_text_search", ("glucose",)),
+    ("full_text_search", ("oxidative stress",)),
+    ("query_by_name", ("histidine",)),
+    ("query_by_name", ("glucose",)),
+    ("query_by_disease", ("diabetes",)),
+    ("query_by_pathway", ("glycolysis",)),
+    ("query_by_biofluid", ("Urine",)),
+    ("query_by_hmdb_id", ("HMDB0000122",)),
+    ("query_proteins", ("HMDB0000122",)),
+]
+
+
+def run_workload(db, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for method, args in WORKLOAD:
+            getattr(db, method)(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Postgres and SQLite backend latency.")
+    parser.add_argument("--repeat", type=int, default=50, help="Workload repetitions (default: 50)")
+    parser.add_argument("--sqlite-path", default="./data/metabolites.sqlite")
+    parser.add_argument("--pg-dbname", default="metabolites_pg")
+    parser.add_argument("--pg-user", default="postgres")
+    parser.add_argument("--pg-password", default="your_password")
+    parser.add_argument("--pg-host", default="localhost")
+    parser.add_argument("--pg-port", default="5432")
+    parser.add_argument("--skip", choices=["postgres", "sqlite"], action="append", default=[],
+                        help="Backend to leave out (repeatable)")
+    args = parser.parse_args()
+
+    results = {}
+    for backend in ("postgres", "sqlite"):
+        if backend in args.skip:
+            continue
+        db = create_db_handler(
+            backend, sqlite_path=args.sqlite_path, kb_snapshot="off",
+            dbname=args.pg_dbname, user=args.pg_user, password=args.pg_password,
+            host=args.pg_host, port=args.pg_port
+        )
+        try:
+            run_workload(db, 1)  # warm-up (page cache, plan cache)
+            db.stats.reset()
+            wall = run_workload(db, args.repeat)
+        except Exception as e:
+            print(f"[{backend}] skipped: {e}")
+            continue
+        results[backend] = (wall, db.stats.snapshot())
+
+    for backend, (wall, snap) in results.items():
+        calls = sum(s["calls"] for s in snap.values())
+        print(f"\n=== {backend}: {calls} calls in {wall:.3f}s ({calls / wall:.0f} calls/s) ===")
+        print(f"{'method':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'conn ms':>10}")
+        for method, s in sorted(snap.items()):
+            conn_ms = 1000 * s["conn_wait_seconds"] / max(s["conn_waits"], 1)
+            print(f"{method:<22}{1000 * s['p50_seconds']:>10.3f}{1000 * s['p95_seconds']:>10.3f}"
+                  f"{1000 * s['p99_seconds']:>10.3f}{conn_ms:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
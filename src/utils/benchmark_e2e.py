@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency benchmark of the chat pipeline: replay a question set
+through query_database -> pack_context -> synthesize_response and report
+p50/p95/p99 per stage. By default the LLM is the bundled stub server
+(llm_stub_server.py) so the numbers are reproducible offline.
+
+    python src/utils/benchmark_e2e.py --ttft 0.3 --tokens-per-s 80
+    python src/utils/benchmark_e2e.py --questions eval.jsonl --repeat 3 --concurrency 4 --json e2e.json
+    python src/utils/benchmark_e2e.py --llm-base-url https://api.groq.com/openai/v1   # real endpoint
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from utils.batch_runner import load_questions
+from utils.llm_stub_server import add_stub_arguments, config_from_args, start_stub_server
+
+QUESTIONS = [
+    "What is the molecular weight of glucose?",
+    "What is the chemical formula of serotonin?",
+    "What is the HMDB ID of citric acid?",
+    "What is the structure of dopamine?",
+    "How is serotonin altered in depression?",
+    "Which metabolites are found in urine?",
+    "Compare glucose and fructose",
+    "List metabolites involved in the citric acid cycle",
+    "What proteins interact with HMDB0000122?",
+    "What are the normal concentrations of HMDB0000122 in blood?",
+    "Tell me about glucse",
+    "Which metabolites are associated with diabetes?",
+]
+
+STAGES = ("retrieval_s", "packing_s", "answer_s", "ttft_s", "total_s")
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(records):
+    out = {}
+    for stage in STAGES:
+        values = sorted(r[stage] for r in records if r.get(stage) is not None)
+        if values:
+            out[stage] = {"n": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+                          "p99": percentile(values, 99), "max": values[-1]}
+    return out
+
+
+def run_question(chat, question):
+    first = []
+    start = time.perf_counter()
+
+    def on_token(_piece):
+        if not first:
+            first.append(time.perf_counter())
+
+    try:
+        record = chat.answer_question(question, on_token=on_token)
+    except Exception as e:
+        record = {"timings": {}, "error": f"{type(e).__name__}: {e}"}
+    timings = dict(record["timings"])
+    timings["total_s"] = time.perf_counter() - start
+    # what the user waits for before text appears (template answers count too)
+    timings["ttft_s"] = first[0] - start if first else None
+    timings["error"] = record.get("error")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end chat pipeline latency (p50/p95/p99 per stage).")
+    parser.add_argument("--questions", help='JSONL of {"question": ...} (default: a built-in mixed set)')
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the question set (default: 3)")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--llm-base-url", help="Use this endpoint instead of the bundled stub")
+    parser.add_argument("--cache", action="store_true", help="Keep the response cache on (default: off)")
+    parser.add_argument("--json", help="Also write per-question timings and the summary here")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    stub = None
+    if args.llm_base_url:
+        os.environ["METABOCHAT_LLM_BASE_URL"] = args.llm_base_url
+    else:
+        stub, url = start_stub_server(config=config_from_args(args))
+        os.environ["METABOCHAT_LLM_BASE_URL"] = url
+        os.environ.setdefault("METABOCHAT_LLM_API_KEY", "stub")
+    if not args.cache:
+        os.environ["METABOCHAT_RESPONSE_CACHE"] = "off"
+
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../chatbot")))
+    import run_llma as chat
+
+    questions = [q["question"] for q in load_questions(args.questions)] if args.questions else QUESTIONS
+    workload = questions * args.repeat
+    print(f"{len(workload)} questions ({len(questions)} x {args.repeat}), concurrency {args.concurrency}, "
+          f"LLM {'stub ' if stub else ''}{os.environ['METABOCHAT_LLM_BASE_URL']}")
+
+    init = time.perf_counter()
+    chat.init_all()
+    init = time.perf_counter() - init
+    start = time.perf_counter()
+    log = io.StringIO()
+    with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(log):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            records = list(pool.map(lambda q: run_question(chat, q), workload))
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(records)
+    errors = sum(1 for r in records if r["error"])
+    print(f"init {init * 1000:.0f} ms, {len(records) / elapsed:.2f} questions/s, {errors} errors\n")
+    print(f"{'stage':<12}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, s in summary.items():
+        print(f"{stage[:-2]:<12}{s['n']:>6}" + "".join(f"{s[k] * 1000:>10.1f}" for k in ("p50", "p95", "p99", "max")))
+    print(f"\nLLM requests: {chat.llm_latency.count}" +
+          (f", stub served {stub.RequestHandlerClass.config.requests}" if stub else ""))
+    print(f"LLM call layer: {chat.llm_metrics()}")
+    print(f"DB result cache / prefetch: {chat.prefetch_metrics()}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"summary": summary, "llm": chat.llm_metrics(), "prefetch": chat.prefetch_metrics(),
+                       "records": [dict(r, question=q) for r, q in zip(records, workload)],
+                       "init_s": init, "elapsed_s": elapsed}, f, indent=2)
+        print(f"Wrote {args.json}")
+    if stub:
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
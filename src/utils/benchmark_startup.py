@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the chatbot: time `import run_llma` in fresh
+interpreters, with a `python -X importtime` breakdown of where it goes, and
+optionally the lazy initialization of each resource (DB handler, entity
+automaton, response cache, LLM client).
+
+    python src/utils/benchmark_startup.py --runs 10
+    python src/utils/benchmark_startup.py --save startup_baseline.json
+    python src/utils/benchmark_startup.py --baseline startup_baseline.json --max-import-ms 200
+
+Exits non-zero when the median import time is over --max-import-ms, or
+more than --tolerance slower than the saved baseline (regression check).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CHATBOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../chatbot"))
+
+PROBE = r"""
+import json, sys, time
+sys.path.insert(0, {chatbot_dir!r})
+t = time.perf_counter()
+import run_llma
+result = {{"import_s": time.perf_counter() - t}}
+if {init!r}:
+    for name in ("get_db_handler", "get_entity_recognizer", "get_retriever", "get_response_cache", "get_client"):
+        t = time.perf_counter()
+        getattr(run_llma, name)()
+        result[name + "_s"] = time.perf_counter() - t
+print("STARTUP " + json.dumps(result))
+"""
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us, depth)] from `-X importtime` output."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def run_once(init=False):
+    code = PROBE.format(chatbot_dir=CHATBOT_DIR, init=init)
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, env=os.environ.copy())
+    wall = time.perf_counter() - start
+    line = next((l for l in proc.stdout.splitlines() if l.startswith("STARTUP ")), None)
+    if proc.returncode != 0 or line is None:
+        raise RuntimeError(f"probe failed (exit {proc.returncode}):\n{proc.stderr[-2000:]}")
+    result = json.loads(line[len("STARTUP "):])
+    result["process_s"] = wall
+    return result, parse_importtime(proc.stderr)
+
+
+def breakdown(entries, top):
+    """Direct imports of run_llma by cumulative time, and the heaviest modules overall by self time."""
+    root = next((i for i, e in enumerate(entries) if e[0] == "run_llma"), None)
+    direct = []
+    if root is not None:
+        # children are listed before their parent, one level deeper
+        base = entries[root][3]
+        i = root - 1
+        while i >= 0 and entries[i][3] > base:
+            if entries[i][3] == base + 1:
+                direct.append(entries[i])
+            i -= 1
+    direct.sort(key=lambda e: -e[2])
+    heaviest = sorted(entries, key=lambda e: -e[1])[:top]
+    return direct[:top], heaviest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure run_llma cold-start and import-time breakdown.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to time (default: 5)")
+    parser.add_argument("--init", action="store_true",
+                        help="Also time first-use initialization of each resource (needs the database)")
+    parser.add_argument("--top", type=int, default=10, help="Modules to list in the breakdown")
+    parser.add_argument("--max-import-ms", type=float, default=None, help="Fail if the median import exceeds this")
+    parser.add_argument("--baseline", help="JSON from a previous --save to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown vs the baseline (default: 0.25 = 25%%)")
+    parser.add_argument("--save", help="Write the medians to this JSON file")
+    args = parser.parse_args()
+
+    runs = []
+    entries = None
+    for _ in range(args.runs):
+        result, entries = run_once(args.init)
+        runs.append(result)
+
+    medians = {k: statistics.median(r[k] for r in runs) for k in runs[0]}
+    print(f"{'stage':<28}{'median ms':>12}{'min ms':>10}{'max ms':>10}   ({args.runs} runs)")
+    for key in runs[0]:
+        values = [r[key] * 1000 for r in runs]
+        print(f"{key[:-2]:<28}{statistics.median(values):>12.1f}{min(values):>10.1f}{max(values):>10.1f}")
+
+    direct, heaviest = breakdown(entries, args.top)
+    print("\nimports of run_llma (cumulative ms, last run):")
+    for name, _, cumulative, _ in direct:
+        print(f"  {name:<56}{cumulative / 1000:>10.1f}")
+    print("\nheaviest modules (self ms, last run):")
+    for name, self_us, _, _ in heaviest:
+        print(f"  {name:<56}{self_us / 1000:>10.1f}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(medians, f, indent=2)
+        print(f"\nSaved medians to {args.save}")
+
+    failures = []
+    import_ms = medians["import_s"] * 1000
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        failures.append(f"import {import_ms:.1f} ms > limit {args.max_import_ms:.1f} ms")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key, old in baseline.items():
+            new = medians.get(key)
+            # ignore sub-5ms stages: their noise is larger than any tolerance
+            if new is not None and old and new > old * (1 + args.tolerance) and new - old > 0.005:
+                failures.append(f"{key[:-2]} {new * 1000:.1f} ms vs baseline {old * 1000:.1f} ms")
+    if failures:
+        print("\nSTARTUP REGRESSION: " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
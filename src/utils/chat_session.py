@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+from collections import OrderedDict, deque
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from utils.context_packer import estimate_tokens
+
+# Words that point back at the metabolite under discussion.
+_SINGULAR_RE = re.compile(
+    r"\b(it|its|itself|the former|the latter"
+    r"|(this|that|the same) (metabolite|compound|molecule|one|substance))\b",
+    re.IGNORECASE)
+# ... or at the metabolites of the previous turn, when it had several.
+_PLURAL_RE = re.compile(
+    r"\b(they|them|their|themselves|both|(these|those|the same) (metabolites|compounds|molecules|ones|substances))\b",
+    re.IGNORECASE)
+# Short elliptical follow-ups with no entity at all: "and the proteins?", "what about urine?"
+_ELLIPSIS_RE = re.compile(r"^\s*(and|also|what about|how about)\b", re.IGNORECASE)
+# Questions asking for a set of metabolites ("which metabolites ...") rather than about one
+_SET_RE = re.compile(
+    r"\b(which|what|list|name|show( me)?|find|all)\s+(\w+\s+)?(metabolites|compounds|molecules)\b",
+    re.IGNORECASE)
+_METABOLITE_KEYS = ("hmdb_id", "metabolite_hmdb_id", "name")
+# A disease, pathway or biofluid of its own makes "they" / "it" likely refer to that instead
+_TARGET_KEYS = ("disease", "pathway", "biofluid")
+
+
+def _refers_back(text):
+    return _SINGULAR_RE.search(text) or _PLURAL_RE.search(text)
+
+
+def _names_metabolite(keywords):
+    # the regex fallback happily extracts "its formula" as a name
+    return any(k in keywords and not (k == "name" and _refers_back(keywords[k]))
+               for k in _METABOLITE_KEYS)
+
+
+def _first_sentences(text, max_tokens):
+    """Leading sentences of `text` that fit in max_tokens (at least a truncated first one)."""
+    text = re.sub(r"\s+", " ", text or "").strip()
+    out = ""
+    for sentence in re.split(r"(?<=[.!?])\s+", text):
+        candidate = f"{out} {sentence}".strip()
+        if estimate_tokens(candidate) > max_tokens:
+            break
+        out = candidate
+    return out or text[:max_tokens * 4]
+
+
+class ChatSession:
+    """
+    State carried across the turns of one conversation:
+
+    - `focus`: the metabolite (hmdb_id, name) the conversation is about, so a
+      follow-up like "which proteins interact with it?" resolves to it
+      instead of re-running keyword extraction and fuzzy search; `subjects`
+      are all the metabolites the last such turn named, for "they" / "their"
+    - a per-session cache of DB lookups already made (keyed by query), so a
+      follow-up only fetches what it adds, e.g. proteins but not the base row
+    - a bounded history for the LLM: the last `window` turns verbatim
+      (answers trimmed), older turns folded into a rolling extractive summary
+      capped at `summary_tokens`, so prompt size stays flat however long the
+      conversation runs
+    """
+
+    def __init__(self, window=3, turn_tokens=120, summary_tokens=200, max_cached=256):
+        self.window = window
+        self.turn_tokens = turn_tokens
+        self.summary_tokens = summary_tokens
+        self.max_cached = max_cached
+        self.focus = None
+        self.subjects = []
+        self.turns = deque()
+        self.summary = deque()  # one line per folded turn, oldest first
+        self._cache = OrderedDict()
+        self.cache_hits = self.cache_misses = 0
+
+    ############################################
+    # Entity resolution
+    ############################################
+    def resolve(self, prompt, keywords):
+        """
+        Keywords with the session focus filled in when the prompt refers back
+        to it and names no metabolite itself. Returns (keywords, resolved).
+
+        Not resolved: prompts with a disease, pathway or biofluid of their own
+        or asking for a set ("which metabolites ..."), unless they are short
+        elliptical follow-ups ("and in urine?"); and plural references when
+        the previous turn was about a single metabolite.
+        """
+        if self.focus is None or _names_metabolite(keywords):
+            return keywords, False
+        elliptical = _ELLIPSIS_RE.search(prompt) and len(prompt.split()) <= 8
+        if not elliptical and (any(k in keywords for k in _TARGET_KEYS) or _SET_RE.search(prompt)):
+            return keywords, False
+        singular, plural = _SINGULAR_RE.search(prompt), _PLURAL_RE.search(prompt)
+        if plural and not singular and not elliptical and len(self.subjects) < 2:
+            return keywords, False
+        if not (singular or plural or elliptical):
+            return keywords, False
+
+        if plural and not singular and len(self.subjects) > 1:
+            from utils.entity_recognizer import Entity  # imported here: the module pulls in numpy
+            entities = [Entity("metabolite", hmdb_id, name, name, -1, -1) for hmdb_id, name in self.subjects]
+            return dict(keywords, name=self.subjects[0][1], entities=entities), True
+        hmdb_id, name = self.focus
+        if singular and singular.group(0).lower() == "the latter" and len(self.subjects) > 1:
+            hmdb_id, name = self.subjects[-1]
+        elif singular and singular.group(0).lower() == "the former" and self.subjects:
+            hmdb_id, name = self.subjects[0]
+        return dict(keywords, hmdb_id=hmdb_id, name=name), True
+
+    def observe(self, keywords, rows, headers):
+        """Move the focus (and subjects) to the metabolite(s) a turn that named one resolved to."""
+        if not rows or not headers or "HMDB_ID" not in headers:
+            return
+        if not _names_metabolite(keywords):
+            return
+        row = rows[0]
+        name = row[headers.index("Name")] if "Name" in headers else None
+        self.focus = (row[headers.index("HMDB_ID")], name)
+        named = OrderedDict((e.entity_id, e.canonical) for e in keywords.get("entities", ())
+                            if e.entity_type == "metabolite")
+        self.subjects = list(named.items()) if len(named) > 1 else [self.focus]
+
+    ############################################
+    # Lookup cache
+    ############################################
+    def cached(self, key, fetch):
+        """fetch() once per session for `key`; later turns reuse the rows."""
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return self._cache[key]
+        self.cache_misses += 1
+        value = fetch()
+        self._cache[key] = value
+        if len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+        return value
+
+    ############################################
+    # History window
+    ############################################
+    def add_turn(self, question, answer):
+        self.turns.append((question, _first_sentences(answer, self.turn_tokens)))
+        while len(self.turns) > self.window:
+            old_q, old_a = self.turns.popleft()
+            self.summary.append(f"- Asked: {old_q} -> {_first_sentences(old_a, 40)}")
+        while self.summary and sum(estimate_tokens(line) for line in self.summary) > self.summary_tokens:
+            self.summary.popleft()
+
+    def history(self):
+        """Text block describing the conversation so far (empty on the first turn)."""
+        parts = []
+        if self.focus is not None:
+            hmdb_id, name = self.focus
+            parts.append(f"Current topic: {name} ({hmdb_id})")
+        if self.summary:
+            parts.append("Earlier in this conversation:\n" + "\n".join(self.summary))
+        if self.turns:
+            parts.append("Recent turns:\n" + "\n".join(f"User: {q}\nAssistant: {a}" for q, a in self.turns))
+        return "\n\n".join(parts)
+
+
+#######################################
+# Demo Testing
+#######################################
+if __name__ == "__main__":
+    from utils.entity_recognizer import Entity
+
+    session = ChatSession()
+    session.observe({"name": "glucose"}, [(1, "HMDB0000122", "D-Glucose")], ["ID", "HMDB_ID", "Name"])
+    for prompt, keywords in [("Which proteins interact with it?", {}),
+                             ("And its concentration in urine?", {"biofluid": "urine"}),
+                             ("Which metabolites are found in urine?", {"biofluid": "urine"}),
+                             ("Which metabolites are linked to depression and what are their roles?",
+                              {"disease": "depression"}),
+                             ("How do their levels change?", {}),
+                             ("Compare it with fructose", {"name": "fructose"})]:
+        print(f"{prompt!r:72} -> {session.resolve(prompt, keywords)[1]}")
+    both = [Entity("metabolite", "HMDB0000122", "D-Glucose", "glucose", 8, 15),
+            Entity("metabolite", "HMDB0000660", "D-Fructose", "fructose", 20, 28)]
+    session.observe({"name": "D-Glucose", "entities": both}, [(1, "HMDB0000122", "D-Glucose")], ["ID", "HMDB_ID", "Name"])
+    keys, _ = session.resolve("How do their levels change?", {})
+    print(f"after a two-metabolite turn, 'their' -> {[e.canonical for e in keys['entities']]}")
+    for i in range(30):
+        session.add_turn(f"Question {i} about glucose metabolism?",
+                         f"Answer {i}. Glucose is a simple sugar used for energy. " * 20)
+        if i in (0, 2, 5, 10, 29):
+            print(f"after {i + 1:2} turns: history {estimate_tokens(session.history())} tokens")
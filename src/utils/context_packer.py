@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import functools
+import math
+from collections import namedtuple
+
+# Column groups that query_database multiplies out per metabolite
+# (proteins x concentrations); each is rendered as its own deduplicated table.
+DETAIL_GROUPS = {
+    "Proteins": ("UniProt ID", "Protein Name", "Gene Name"),
+    "Concentrations": ("Concentration Type", "Biofluid", "Value", "Age", "Sex", "Condition"),
+}
+# Internal ids and retrieval bookkeeping (used for ordering only).
+DROP_COLUMNS = ("ID", "Score", "Matched By")
+
+PackedContext = namedtuple("PackedContext", "text tokens baseline_tokens saved rows_kept rows_total truncated")
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding():
+    try:
+        import tiktoken  # optional: exact counts for OpenAI-style BPE vocabularies
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def estimate_tokens(text):
+    """Token count: tiktoken when installed, else the usual ~4 characters per token."""
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def _cell(value):
+    if value is None:
+        return "N/A"
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value).replace("|", "/").replace("\n", " ")
+
+
+def _table(headers, rows):
+    lines = ["| " + " | ".join(headers) + " |", "|" + "---|" * len(headers)]
+    lines += ["| " + " | ".join(_cell(v) for v in row) + " |" for row in rows]
+    return lines
+
+
+class _Budget:
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.lines = []
+
+    def fits(self, lines):
+        return self.used + sum(estimate_tokens(line) + 1 for line in lines) <= self.budget
+
+    def add(self, line):
+        cost = estimate_tokens(line) + 1
+        if self.used + cost > self.budget:
+            return False
+        self.lines.append(line)
+        self.used += cost
+        return True
+
+
+def pack_context(rows, headers, budget_tokens=600, baseline=None):
+    """
+    Compact, token-bounded rendering of query_database rows for the LLM prompt.
+
+    - metabolite fields are shown once per metabolite in one table, instead
+      of repeated on every protein x concentration row
+    - detail groups become small deduplicated tables under their metabolite
+    - columns that are empty everywhere, and internal ids, are dropped
+    - metabolites are ordered by the fused 'Score' column when present
+    - whatever does not fit in `budget_tokens` is summarized in one line
+
+    `baseline` is the text it replaces (format_results output) for the
+    tokens-saved report.
+    """
+    baseline_tokens = estimate_tokens(baseline) if baseline is not None else None
+    if not rows or not headers:
+        text = "No relevant database entries found."
+        tokens = estimate_tokens(text)
+        saved = baseline_tokens - tokens if baseline_tokens is not None else None
+        return PackedContext(text, tokens, baseline_tokens, saved, 0, 0, False)
+
+    col = {h: i for i, h in enumerate(headers)}
+    detail_cols = {g: [h for h in cols if h in col] for g, cols in DETAIL_GROUPS.items()}
+    detail_set = {h for cols in detail_cols.values() for h in cols}
+    base_cols = [h for h in headers if h not in detail_set and h not in DROP_COLUMNS]
+    base_cols = [h for h in base_cols if any(r[col[h]] not in (None, "", "N/A") for r in rows)]
+
+    # Group the cross product back into one entry per metabolite.
+    key_col = col.get("HMDB_ID", 0)
+    groups = {}
+    for row in rows:
+        entry = groups.setdefault(row[key_col], {"base": row, "details": {g: {} for g in detail_cols}})
+        for g, cols in detail_cols.items():
+            if cols:
+                values = tuple(row[col[h]] for h in cols)
+                if any(v is not None for v in values):
+                    entry["details"][g].setdefault(values, None)
+    entries = list(groups.values())
+    if "Score" in col:
+        entries.sort(key=lambda e: -(e["base"][col["Score"]] or 0))
+
+    out = _Budget(budget_tokens)
+    header, rule = _table(base_cols, [])
+    out.add(header)
+    out.add(rule)
+    kept = 0
+    truncated = False
+    for i, entry in enumerate(entries):
+        if not out.add(_table(base_cols, [[entry["base"][col[h]] for h in base_cols]])[2]):
+            truncated = True
+            omitted = entries[i:]
+            break
+        kept += 1
+    else:
+        omitted = []
+
+    total_details = sum(len(v) for e in entries[:kept] for v in e["details"].values())
+    shown_details = 0
+    for entry in entries[:kept]:
+        name = entry["base"][col["Name"]] if "Name" in col else entry["base"][key_col]
+        for g, values in entry["details"].items():
+            if not values or truncated:
+                continue
+            table = _table(detail_cols[g], list(values))
+            head = ["", f"{g} for {name}:"] + table[:2]
+            if not out.fits(head + table[2:3]):  # no heading without at least one row
+                truncated = True
+                continue
+            for line in head:
+                out.add(line)
+            for line in table[2:]:
+                if not out.add(line):
+                    truncated = True
+                    break
+                shown_details += 1
+    omitted_details = total_details - shown_details
+
+    if truncated:
+        parts = []
+        if omitted:
+            parts.append(f"{len(omitted)} more metabolites ({', '.join(_cell(e['base'][key_col]) for e in omitted[:5])}"
+                         f"{', ...' if len(omitted) > 5 else ''})")
+        if omitted_details:
+            parts.append(f"{omitted_details} more detail rows")
+        out.lines.append(f"[... {' and '.join(parts) or 'more rows'} omitted to fit the context budget]")
+
+    text = "\n".join(out.lines)
+    tokens = estimate_tokens(text)
+    saved = baseline_tokens - tokens if baseline_tokens is not None else None
+    return PackedContext(text, tokens, baseline_tokens, saved, kept, len(entries), truncated)
+
+
+#######################################
+# Demo Testing
+#######################################
+if __name__ == "__main__":
+    headers = ["ID", "HMDB_ID", "Name", "Formula", "Molecular Weight", "SMILES",
+               "UniProt ID", "Protein Name", "Gene Name",
+               "Concentration Type", "Biofluid", "Value", "Age", "Sex", "Condition"]
+    base = (2, "HMDB0000259", "Serotonin", "C10H12N2O", 176.2151, "NCCC1=CNC2=C1C=C(O)C=C2")
+    proteins = [(f"P{i:05d}", f"Protein {i}", f"GENE{i}") for i in range(8)]
+    concs = [("normal", fluid, f"{i}.{i} uM", "Adult", "Both", "Normal") for i, fluid in
+             enumerate(["Blood", "Urine", "CSF", "Saliva", "Feces"])]
+    rows = [base + p + c for p in proteins for c in concs]
+    verbose = "\n\n".join("\n".join(f"- {h}: {v}" for h, v in zip(headers, r)) for r in rows[:10])
+    for budget in (1000, 150):
+        packed = pack_context(rows, headers, budget, baseline=verbose)
+        print(packed.text)
+        print(f"-- {packed.tokens} tokens vs {packed.baseline_tokens} verbose (10 of {len(rows)} rows), "
+              f"saved {packed.saved}, truncated={packed.truncated}\n")
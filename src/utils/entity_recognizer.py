@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import pickle
+import re
+import sys
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+ENTITY_TYPES = ("metabolite", "disease", "pathway", "protein", "biofluid")
+SNAPSHOT_FORMAT = 1
+
+# A recognized mention. entity_id is the handler-facing id: HMDB ID for
+# metabolites, UniProt ID for proteins, table primary key (as text) for
+# diseases and pathways, the location string for biofluids.
+Entity = namedtuple("Entity", "entity_type entity_id canonical surface start end")
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Single-token surfaces that are ordinary words in a question (gene symbols
+# such as "CAT" or "SET", synonyms such as "AS") would flood the results.
+_STOPWORDS = frozenset("""
+    a an and are as at be by can did do does for from had has have how i if in is it its of on or
+    that the their this to was what when where which who why will with
+    set cat max was impact act can type best large small level levels role found high low
+""".split())
+
+
+def tokenize(text):
+    """Lower-cased alphanumeric tokens with their character spans."""
+    return [(m.group(0), m.start(), m.end()) for m in _TOKEN.finditer(text.lower())]
+
+
+def _keep_surface(tokens):
+    if not tokens:
+        return False
+    if len(tokens) == 1:
+        tok = tokens[0]
+        return tok not in _STOPWORDS and (len(tok) > 2 or any(c.isdigit() for c in tok))
+    return not all(t in _STOPWORDS for t in tokens)
+
+
+class EntityRecognizer:
+    """
+    Token-level Aho–Corasick automaton over every known surface form
+    (metabolite names and synonyms, diseases, pathways, protein and gene
+    names, biofluids). recognize() walks the prompt once, collects every
+    dictionary hit and keeps the longest non-overlapping mentions.
+
+    Matching on tokens rather than characters gives word boundaries for free
+    and makes "3-hydroxybutyric acid" and "3 hydroxybutyric acid" the same
+    key. The compiled automaton is plain NumPy arrays (sorted edge keys,
+    fail and dictionary-suffix links, CSR outputs) so a snapshot loads in a
+    single pickle read with no rebuilding.
+    """
+
+    def __init__(self, vocab, edge_keys, edge_child, fail, out_link, depth,
+                 out_ptr, out_entry, entry_type, entry_id, entry_canonical, version=None):
+        self.vocab = vocab
+        self.edge_keys = edge_keys
+        self.edge_child = edge_child
+        self.fail = fail
+        self.out_link = out_link
+        self.depth = depth
+        self.out_ptr = out_ptr
+        self.out_entry = out_entry
+        self.entry_type = entry_type
+        self.entry_id = entry_id
+        self.entry_canonical = entry_canonical
+        self.version = version
+        self._width = len(vocab) + 1
+
+    ############################################
+    # Build
+    ############################################
+    @classmethod
+    def build(cls, names, version=None):
+        """Compile from (entity_type, entity_id, canonical, surface) rows."""
+        vocab = {}
+        children = [{}]
+        terminal = {}
+        entries = {}
+        labels = []
+        for entity_type, entity_id, canonical, surface in names:
+            if not surface or entity_type not in ENTITY_TYPES:
+                continue
+            tokens = [t for t, _, _ in tokenize(surface)]
+            if not _keep_surface(tokens):
+                continue
+            node = 0
+            for tok in tokens:
+                tid = vocab.setdefault(tok, len(vocab))
+                nxt = children[node].get(tid)
+                if nxt is None:
+                    nxt = len(children)
+                    children[node][tid] = nxt
+                    children.append({})
+                node = nxt
+            entry = entries.get((entity_type, entity_id))
+            if entry is None:
+                entry = entries[(entity_type, entity_id)] = len(entries)
+                labels.append(canonical or surface)
+            bucket = terminal.setdefault(node, [])
+            if entry not in bucket:
+                bucket.append(entry)
+
+        n = len(children)
+        fail = np.zeros(n, dtype=np.int32)
+        out_link = np.full(n, -1, dtype=np.int32)
+        depth = np.zeros(n, dtype=np.int16)
+        queue = deque()
+        for child in children[0].values():
+            depth[child] = 1
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for tid, child in children[node].items():
+                depth[child] = depth[node] + 1
+                f = fail[node]
+                while f and tid not in children[f]:
+                    f = fail[f]
+                f = children[f].get(tid, 0)
+                fail[child] = f
+                out_link[child] = f if f in terminal else out_link[f]
+                queue.append(child)
+
+        width = len(vocab) + 1
+        keys, kids = [], []
+        for node, edges in enumerate(children):
+            for tid, child in edges.items():
+                keys.append(node * width + tid)
+                kids.append(child)
+        order = np.argsort(np.asarray(keys, dtype=np.int64), kind="stable")
+        edge_keys = np.asarray(keys, dtype=np.int64)[order]
+        edge_child = np.asarray(kids, dtype=np.int32)[order]
+
+        out_ptr = np.zeros(n + 1, dtype=np.int32)
+        for node in range(n):
+            out_ptr[node + 1] = out_ptr[node] + len(terminal.get(node, ()))
+        out_entry = np.empty(out_ptr[-1], dtype=np.int32)
+        for node in range(n):
+            if node in terminal:
+                out_entry[out_ptr[node]:out_ptr[node + 1]] = terminal[node]
+
+        type_code = {t: i for i, t in enumerate(ENTITY_TYPES)}
+        entry_type = np.empty(len(entries), dtype=np.int8)
+        entry_id = [None] * len(entries)
+        for (entity_type, entity_id), e in entries.items():
+            entry_type[e] = type_code[entity_type]
+            entry_id[e] = entity_id
+        return cls(vocab, edge_keys, edge_child, fail, out_link, depth,
+                   out_ptr, out_entry, entry_type, entry_id, labels, version)
+
+    @classmethod
+    def from_handler(cls, db_handler):
+        return cls.build(db_handler.iter_entity_names(), db_handler.dataset_version())
+
+    ############################################
+    # Snapshot
+    ############################################
+    def save(self, path):
+        state = {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((SNAPSHOT_FORMAT, state), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            fmt, state = pickle.load(f)
+        if fmt != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported entity snapshot format {fmt} in {path}")
+        return cls(**state)
+
+    ############################################
+    # Matching
+    ############################################
+    def __len__(self):
+        return len(self.entry_id)
+
+    def _goto(self, node, tid):
+        key = node * self._width + tid
+        i = int(np.searchsorted(self.edge_keys, key))
+        if i < len(self.edge_keys) and self.edge_keys[i] == key:
+            return int(self.edge_child[i])
+        return -1
+
+    def find_all(self, text):
+        """Every dictionary hit as (first_token, last_token, entry), overlaps included."""
+        tokens = tokenize(text)
+        hits = []
+        node = 0
+        for pos, (tok, _, _) in enumerate(tokens):
+            tid = self.vocab.get(tok)
+            if tid is None:
+                node = 0
+                continue
+            nxt = self._goto(node, tid)
+            while nxt < 0 and node:
+                node = int(self.fail[node])
+                nxt = self._goto(node, tid)
+            node = max(nxt, 0)
+            out = node if self.out_ptr[node] != self.out_ptr[node + 1] else int(self.out_link[node])
+            while out >= 0:
+                first = pos - int(self.depth[out]) + 1
+                for e in self.out_entry[self.out_ptr[out]:self.out_ptr[out + 1]]:
+                    hits.append((first, pos, int(e)))
+                out = int(self.out_link[out])
+        return tokens, hits
+
+    def recognize(self, text, types=None):
+        """
+        Longest non-overlapping mentions in `text`, in order of appearance.
+        A span that names several entities (a gene symbol shared by two
+        proteins) yields one Entity per id.
+        """
+        tokens, hits = self.find_all(text)
+        if types is not None:
+            wanted = {ENTITY_TYPES.index(t) for t in types}
+            hits = [h for h in hits if self.entry_type[h[2]] in wanted]
+        hits.sort(key=lambda h: (h[0] - h[1], h[0]))
+        taken = [False] * len(tokens)
+        chosen = {}
+        for first, last, e in hits:
+            span = (first, last)
+            if span not in chosen and any(taken[first:last + 1]):
+                continue
+            for i in range(first, last + 1):
+                taken[i] = True
+            chosen.setdefault(span, []).append(e)
+
+        out = []
+        for (first, last), es in sorted(chosen.items()):
+            start, end = tokens[first][1], tokens[last][2]
+            for e in dict.fromkeys(es):
+                out.append(Entity(ENTITY_TYPES[self.entry_type[e]], self.entry_id[e],
+                                  self.entry_canonical[e], text[start:end], start, end))
+        return out
+
+
+def load_recognizer(path=None, db_handler=None):
+    """
+    Load the snapshot at `path` (default $METABOCHAT_ENTITY_SNAPSHOT), or None
+    if absent. With `db_handler`, a snapshot built from another dataset
+    version is rebuilt from the handler and saved back in its place.
+    """
+    path = path or os.environ.get("METABOCHAT_ENTITY_SNAPSHOT", "./data/entities.pkl")
+    if not os.path.exists(path):
+        return None
+    recognizer = EntityRecognizer.load(path)
+    if db_handler is not None and recognizer.version != db_handler.dataset_version():
+        recognizer = EntityRecognizer.from_handler(db_handler)
+        try:
+            recognizer.save(path)
+        except OSError:
+            pass  # read-only deployment: use the rebuilt automaton from memory
+    return recognizer
+
+
+#######################################
+# Build snapshot / Demo Testing
+#######################################
+if __name__ == "__main__":
+    from utils.storage_backend import BACKENDS, create_db_handler
+
+    parser = argparse.ArgumentParser(description="Build the entity recognizer snapshot.")
+    parser.add_argument("--backend", choices=BACKENDS, default=None)
+    parser.add_argument("--sqlite-path", default=None)
+    parser.add_argument("--out", default="./data/entities.pkl")
+    parser.add_argument("prompts", nargs="*")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    db = create_db_handler(args.backend, sqlite_path=args.sqlite_path)
+    recognizer = EntityRecognizer.from_handler(db)
+    recognizer.save(args.out)
+    print(f"Built {len(recognizer)} entities, {len(recognizer.fail)} states "
+          f"in {time.perf_counter() - start:.2f}s -> {args.out}")
+
+    start = time.perf_counter()
+    recognizer = EntityRecognizer.load(args.out)
+    print(f"Snapshot load: {1000 * (time.perf_counter() - start):.1f} ms")
+    for prompt in args.prompts:
+        start = time.perf_counter()
+        found = recognizer.recognize(prompt)
+        print(f"{prompt!r} ({1e6 * (time.perf_counter() - start):.0f} us)")
+        for ent in found:
+            print(f"  {ent.entity_type:<10} {ent.entity_id:<12} {ent.canonical!r} <- {ent.surface!r}")
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+try:
+    from pyroaring import BitMap  # optional: compressed Roaring bitmaps
+except ImportError:
+    BitMap = None
+
+FACETS = ("biospecimen", "tissue", "cellular", "disease", "pathway", "protein", "gene", "taxonomy_class")
+
+
+class _IntBitmap:
+    """
+    Fallback bitmap when pyroaring is not installed: a Python int used as a
+    bitset. &, | and popcount run in C over ~30 KB for all of HMDB, which is
+    microseconds; only materializing positions touches NumPy.
+    """
+    __slots__ = ("bits",)
+
+    def __init__(self, bits=0):
+        self.bits = bits
+
+    @classmethod
+    def from_positions(cls, positions):
+        arr = np.zeros(max(positions) + 1 if len(positions) else 0, dtype=bool)
+        arr[list(positions)] = True
+        return cls(int.from_bytes(np.packbits(arr, bitorder="little").tobytes(), "little"))
+
+    def __and__(self, other):
+        return _IntBitmap(self.bits & other.bits)
+
+    def __or__(self, other):
+        return _IntBitmap(self.bits | other.bits)
+
+    def __sub__(self, other):
+        return _IntBitmap(self.bits & ~other.bits)
+
+    def __len__(self):
+        return self.bits.bit_count()
+
+    def to_array(self):
+        if not self.bits:
+            return np.array([], dtype=np.int64)
+        raw = np.frombuffer(self.bits.to_bytes((self.bits.bit_length() + 7) // 8, "little"), dtype=np.uint8)
+        return np.flatnonzero(np.unpackbits(raw, bitorder="little"))
+
+
+def _make_bitmap(positions):
+    if BitMap is not None:
+        return BitMap(positions)
+    return _IntBitmap.from_positions(positions)
+
+
+def _empty():
+    return BitMap() if BitMap is not None else _IntBitmap()
+
+
+def _positions(bitmap):
+    return np.asarray(bitmap.to_array() if BitMap is None else list(bitmap), dtype=np.int64)
+
+
+class FacetIndex:
+    """
+    One bitmap per (facet, value) over dense metabolite positions, e.g.
+    ("biospecimen", "urine") or ("disease", "alzheimer's disease"). Compound
+    filters ("in urine AND in CSF AND linked to X") are bitmap intersections
+    instead of several SQL round trips plus Python set logic.
+
+    Values are matched case-insensitively. Built from a backend's
+    iter_facet_memberships() and rebuilt when the dataset version changes.
+    """
+
+    def __init__(self, memberships, version=None):
+        self.version = version
+        positions = {}
+        pos_of = {}
+        for facet, value, metabolite_id in memberships:
+            if value is None:
+                continue
+            pos = pos_of.setdefault(metabolite_id, len(pos_of))
+            positions.setdefault((facet, value.strip().lower()), []).append(pos)
+        self.ids = np.empty(len(pos_of), dtype=np.int64)
+        for mid, pos in pos_of.items():
+            self.ids[pos] = mid
+        self._bitmaps = {key: _make_bitmap(sorted(set(p))) for key, p in positions.items()}
+        self._universe = _make_bitmap(range(len(pos_of)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def bitmap(self, facet, value):
+        if facet not in FACETS:
+            raise ValueError(f"Unknown facet '{facet}', expected one of {FACETS}")
+        return self._bitmaps.get((facet, value.strip().lower()), _empty())
+
+    def values(self, facet, top=None):
+        """(value, count) pairs for a facet, most common first."""
+        out = sorted(((v, len(b)) for (f, v), b in self._bitmaps.items() if f == facet),
+                     key=lambda x: -x[1])
+        return out[:top] if top else out
+
+    def query(self, all_of=(), any_of=(), none_of=()):
+        """
+        Combine facet bitmaps: every (facet, value) in all_of must hold, at
+        least one in any_of (if given), none in none_of. Returns the bitmap.
+        """
+        result = None
+        for facet, value in all_of:
+            b = self.bitmap(facet, value)
+            result = b if result is None else result & b
+        if any_of:
+            union = _empty()
+            for facet, value in any_of:
+                union = union | self.bitmap(facet, value)
+            result = union if result is None else result & union
+        if result is None:
+            result = self._universe
+        for facet, value in none_of:
+            result = result - self.bitmap(facet, value)
+        return result
+
+    def count(self, all_of=(), any_of=(), none_of=()):
+        return len(self.query(all_of, any_of, none_of))
+
+    def ids_of(self, bitmap, limit=None):
+        """Metabolite ids (database primary keys) for a bitmap returned by query()."""
+        pos = _positions(bitmap)
+        if limit is not None:
+            pos = pos[:limit]
+        return self.ids[pos].tolist()
+
+    def ids_for(self, all_of=(), any_of=(), none_of=(), limit=None):
+        return self.ids_of(self.query(all_of, any_of, none_of), limit)
+
+
+#######################################
+# Demo Testing
+#######################################
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    n = 220_000
+    members = [("biospecimen", "Urine", i) for i in range(n) if rng.random() < 0.3]
+    members += [("biospecimen", "Cerebrospinal Fluid (CSF)", i) for i in range(n) if rng.random() < 0.05]
+    members += [("disease", "Alzheimer's disease", i) for i in rng.integers(0, n, 500).tolist()]
+    idx = FacetIndex(members)
+    q = dict(all_of=[("biospecimen", "urine"), ("biospecimen", "cerebrospinal fluid (csf)")],
+             any_of=[("disease", "alzheimer's disease")])
+    start = time.perf_counter()
+    for _ in range(1000):
+        idx.count(**q)
+    print(f"count: {idx.count(**q)} hits, {1e6 * (time.perf_counter() - start) / 1000:.1f} us/query "
+          f"({'pyroaring' if BitMap else 'int bitsets'})")
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import json
+import re
+from collections import Counter
+
+import numpy as np
+
+_TOKEN = re.compile(r"([A-Z][a-z]?)(\d*)|([(\[])|([)\]])(\d*)")
+# Trailing charge: "+", "2-", "-3"; digits before the sign only count as charge after "]".
+_CHARGE = re.compile(r"(?:(?<=\])\d*[+-]+|[+-]+\d*)$")
+
+
+def parse_formula(formula):
+    """
+    Parse a molecular formula into {element: count}.
+
+    Handles nested groups ("Ca(NO3)2"), dotted components with a leading
+    multiplier ("CuSO4.5H2O") and trailing charges ("C5H5N+", "C2H3O2-").
+    Raises ValueError on anything it cannot read.
+    """
+    if not formula:
+        raise ValueError("empty formula")
+    total = Counter()
+    for part in re.split(r"[.·]", formula.strip()):
+        part = _CHARGE.sub("", part.strip())
+        m = re.match(r"(\d+)(.*)", part)
+        mult, part = (int(m.group(1)), m.group(2)) if m else (1, part)
+        for element, count in _parse_component(part).items():
+            total[element] += count * mult
+    return dict(total)
+
+
+def _parse_component(text):
+    stack = [Counter()]
+    pos = 0
+    while pos < len(text):
+        m = _TOKEN.match(text, pos)
+        if not m:
+            raise ValueError(f"cannot parse formula {text!r} at {pos}")
+        element, count, opening, closing, group_count = m.groups()
+        if element:
+            stack[-1][element] += int(count) if count else 1
+        elif opening:
+            stack.append(Counter())
+        else:
+            if len(stack) == 1:
+                raise ValueError(f"unbalanced ')' in {text!r}")
+            group = stack.pop()
+            mult = int(group_count) if group_count else 1
+            for el, n in group.items():
+                stack[-1][el] += n * mult
+        pos = m.end()
+    if len(stack) != 1:
+        raise ValueError(f"unbalanced '(' in {text!r}")
+    return stack[0]
+
+
+def hill_formula(counts):
+    """Canonical Hill-order string (C, H, then alphabetical) for a count dict."""
+    counts = {el: n for el, n in counts.items() if n}
+    if "C" in counts:
+        order = ["C"] + (["H"] if "H" in counts else []) + sorted(el for el in counts if el not in ("C", "H"))
+    else:
+        order = sorted(counts)
+    return "".join(f"{el}{counts[el] if counts[el] != 1 else ''}" for el in order)
+
+
+class FormulaIndex:
+    """
+    Element-count matrix over all metabolites: one int16 column per element
+    seen in the data, one row per metabolite. Exact/isomer lookups go
+    through a composition hash; per-element range queries are vectorized
+    boolean masks over the matrix (a few ms for the whole of HMDB).
+    """
+
+    def __init__(self, ids, hmdb_ids, names, formulas, compositions):
+        self.elements = sorted({el for comp in compositions for el in comp})
+        self._col = {el: i for i, el in enumerate(self.elements)}
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.hmdb_ids = np.asarray(hmdb_ids, dtype=object)
+        self.names = np.asarray(names, dtype=object)
+        self.formulas = np.asarray(formulas, dtype=object)
+        self.counts = np.zeros((len(compositions), len(self.elements)), dtype=np.int16)
+        self._by_composition = {}
+        for row, comp in enumerate(compositions):
+            for el, n in comp.items():
+                self.counts[row, self._col[el]] = n
+            self._by_composition.setdefault(hill_formula(comp), []).append(row)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build from (id, hmdb_id, name, chemical_formula, element_counts) rows.
+        element_counts (filled at ingestion) is used when present, otherwise
+        the formula is parsed; unparseable formulas are skipped.
+        """
+        ids, hmdb_ids, names, formulas, comps = [], [], [], [], []
+        for mid, hmdb_id, name, formula, element_counts in rows:
+            if element_counts is None:
+                try:
+                    element_counts = parse_formula(formula)
+                except ValueError:
+                    continue
+            elif isinstance(element_counts, str):
+                element_counts = json.loads(element_counts)
+            ids.append(mid)
+            hmdb_ids.append(hmdb_id)
+            names.append(name)
+            formulas.append(formula)
+            comps.append(element_counts)
+        return cls(ids, hmdb_ids, names, formulas, comps)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _rows(self, idx):
+        return [(int(self.ids[i]), self.hmdb_ids[i], self.names[i], self.formulas[i]) for i in idx]
+
+    def exact(self, formula):
+        """Metabolites whose composition equals `formula` (any notation)."""
+        return self._rows(self._by_composition.get(hill_formula(parse_formula(formula)), []))
+
+    def isomers_of(self, hmdb_id):
+        """Metabolites sharing the composition of `hmdb_id`, excluding itself."""
+        hits = np.flatnonzero(self.hmdb_ids == hmdb_id)
+        if not len(hits):
+            return []
+        row = hits[0]
+        key = hill_formula(dict(zip(self.elements, self.counts[row].tolist())))
+        return self._rows(i for i in self._by_composition.get(key, []) if i != row)
+
+    def mask(self, ranges, only=False):
+        """
+        Boolean row mask for per-element constraints. `ranges` maps element to
+        an exact count or an inclusive (low, high) tuple; None = unbounded.
+        With only=True, elements not mentioned must be absent.
+        """
+        mask = np.ones(len(self.ids), dtype=bool)
+        for el, bounds in ranges.items():
+            low, high = (bounds, bounds) if isinstance(bounds, int) else bounds
+            if el not in self._col:
+                # Nobody has this element: only a range that admits 0 can match.
+                if (low or 0) > 0:
+                    mask[:] = False
+                continue
+            col = self.counts[:, self._col[el]]
+            if low is not None:
+                mask &= col >= low
+            if high is not None:
+                mask &= col <= high
+        if only:
+            others = [self._col[el] for el in self.elements if el not in ranges]
+            if others:
+                mask &= ~self.counts[:, others].any(axis=1)
+        return mask
+
+    def element_ranges(self, ranges, only=False, limit=None):
+        """Rows (id, hmdb_id, name, formula) satisfying mask(ranges, only)."""
+        idx = np.flatnonzero(self.mask(ranges, only))
+        return self._rows(idx[:limit] if limit else idx)
+
+
+#######################################
+# Demo Testing
+#######################################
+if __name__ == "__main__":
+    for f in ["C6H12O6", "Ca(NO3)2", "CuSO4.5H2O", "C5H5N+", "C2H3O2-", "[Fe(CN)6]3-"]:
+        print(f, "=>", parse_formula(f), hill_formula(parse_formula(f)))
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Sync the metabolite knowledge graph in Neo4j from the relational store:
+Metabolite, Protein, Disease and Pathway nodes, and the
+(:Metabolite)-[:INTERACTS_WITH|ASSOCIATED_WITH|IN_PATHWAY]->() links.
+
+    python src/utils/graph_sync.py                    # no-op when the dataset version is already synced
+    python src/utils/graph_sync.py --full --batch-size 10000
+    METABOCHAT_DB_BACKEND=sqlite python src/utils/graph_sync.py
+
+Neo4j is reached through Neo4JConnection (NEO4J_URI, NEO4J_USER,
+NEO4J_PASSWORD). A throwaway local instance for testing:
+
+    docker run --rm -p 7687:7687 -e NEO4J_AUTH=neo4j/metabochat neo4j:5
+    NEO4J_URI=bolt://localhost:7687 NEO4J_USER=neo4j NEO4J_PASSWORD=metabochat python src/utils/graph_sync.py
+
+Incremental: the synced dataset_version is kept on a (:SyncState) node and
+a run with an unchanged version does nothing. When it has changed, every
+node carries a hash of its properties, so only new or changed nodes and
+missing links are written, and nodes / links no longer in the source are
+deleted. Writes go in parameterized UNWIND batches (Neo4JConnection.query_many,
+one retried write transaction each), after the uniqueness constraints (which
+back every MERGE) and lookup indexes exist; existing keys are streamed.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from utils.storage_backend import create_db_handler
+
+SOURCE = "hmdb"
+
+# export kind -> (label, key property, other properties in GRAPH_EXPORTS column order)
+NODES = {
+    "metabolites": ("Metabolite", "hmdb_id", ("name", "formula", "molecular_weight_avg",
+                                              "molecular_weight_monoisotopic", "inchikey", "taxonomy_class")),
+    "proteins": ("Protein", "uniprot_id", ("name", "gene_name")),
+    "diseases": ("Disease", "name", ()),
+    "pathways": ("Pathway", "name", ("kegg_id", "smpdb_id")),
+}
+
+# export kind -> (relationship type, target node kind); the source is always a Metabolite
+LINKS = {
+    "metabolite_proteins": ("INTERACTS_WITH", "proteins"),
+    "metabolite_diseases": ("ASSOCIATED_WITH", "diseases"),
+    "metabolite_pathways": ("IN_PATHWAY", "pathways"),
+}
+
+INDEXES = [("Metabolite", "name"), ("Metabolite", "inchikey"), ("Protein", "gene_name")]
+
+
+def schema_statements():
+    """Uniqueness constraints for every MERGE key, then the lookup indexes."""
+    for label, key, _ in NODES.values():
+        yield (f"CREATE CONSTRAINT {label.lower()}_{key} IF NOT EXISTS "
+               f"FOR (n:{label}) REQUIRE n.{key} IS UNIQUE")
+    yield "CREATE CONSTRAINT syncstate_source IF NOT EXISTS FOR (n:SyncState) REQUIRE n.source IS UNIQUE"
+    for label, prop in INDEXES:
+        yield f"CREATE INDEX {label.lower()}_{prop} IF NOT EXISTS FOR (n:{label}) ON (n.{prop})"
+
+
+def row_hash(props):
+    return hashlib.sha1(json.dumps(props, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def _phase(kind, read, written, unchanged, deleted, start):
+    elapsed = time.perf_counter() - start
+    return {"kind": kind, "read": read, "written": written, "unchanged": unchanged, "deleted": deleted,
+            "elapsed_s": elapsed, "written_per_s": written / elapsed if elapsed else None}
+
+
+############################################
+# Nodes and links
+############################################
+def sync_nodes(conn, handler, kind, batch_size=5000, full=False):
+    """Upsert one node label from its export (changed rows only unless full) and delete the rest."""
+    label, key, names = NODES[kind]
+    start = time.perf_counter()
+    existing = {r["k"]: r["h"] for r in conn.stream(f"MATCH (n:{label}) RETURN n.{key} AS k, n.row_hash AS h")}
+    seen = set()
+    read = unchanged = 0
+
+    def changed():
+        nonlocal read, unchanged
+        for row in handler.iter_graph_rows(kind):
+            read += 1
+            props = {name: value for name, value in zip(names, row[1:])}
+            h = row_hash(props)
+            seen.add(row[0])
+            if not full and existing.get(row[0]) == h:
+                unchanged += 1
+                continue
+            yield {"key": row[0], "props": props, "hash": h}
+
+    written = conn.query_many(
+        f"UNWIND $rows AS r MERGE (n:{label} {{{key}: r.key}}) SET n += r.props, n.row_hash = r.hash",
+        changed(), batch_size)["rows"]
+    stale = [k for k in existing if k not in seen]
+    conn.query_many(f"UNWIND $rows AS k MATCH (n:{label} {{{key}: k}}) DETACH DELETE n", stale, batch_size)
+    return _phase(kind, read, written, unchanged, len(stale), start)
+
+
+def sync_links(conn, handler, kind, batch_size=5000):
+    """Create the links of one export missing from the graph and delete those gone from the source."""
+    rel, target = LINKS[kind]
+    label, key, _ = NODES[target]
+    source_node, target_node = "(m:Metabolite {hmdb_id: r[0]})", f"(t:{label} {{{key}: r[1]}})"
+    start = time.perf_counter()
+    existing = {(r["s"], r["t"]) for r in conn.stream(
+        f"MATCH (m:Metabolite)-[:{rel}]->(t:{label}) RETURN m.hmdb_id AS s, t.{key} AS t")}
+    seen = set()
+    read = 0
+
+    def missing():
+        nonlocal read
+        for source, dest in handler.iter_graph_rows(kind):
+            read += 1
+            seen.add((source, dest))
+            if (source, dest) not in existing:
+                yield [source, dest]
+
+    written = conn.query_many(f"UNWIND $rows AS r MATCH {source_node}, {target_node} MERGE (m)-[:{rel}]->(t)",
+                              missing(), batch_size)["rows"]
+    stale = [list(pair) for pair in existing if pair not in seen]
+    conn.query_many(f"UNWIND $rows AS r MATCH {source_node}-[e:{rel}]->{target_node} DELETE e", stale, batch_size)
+    return _phase(kind, read, written, read - written, len(stale), start)
+
+
+############################################
+# Sync state
+############################################
+def synced_version(conn):
+    records = conn.execute_read("MATCH (s:SyncState {source: $source}) RETURN s.dataset_version AS v", {"source": SOURCE})
+    return records[0]["v"] if records else None
+
+
+def record_sync(conn, version, report):
+    conn.execute_write("""
+        MERGE (s:SyncState {source: $source})
+        SET s.dataset_version = $version, s.synced_at = datetime(),
+            s.nodes = $nodes, s.links = $links, s.elapsed_s = $elapsed
+    """, {"source": SOURCE, "version": version, "nodes": report["nodes"], "links": report["links"],
+          "elapsed": report["elapsed_s"]})
+
+
+def sync_graph(conn, handler, batch_size=5000, full=False, progress=print):
+    """
+    Bring the graph up to the handler's dataset version. Returns a report with
+    per-kind phases and node / link write rates; "skipped" when already synced.
+    """
+    start = time.perf_counter()
+    version = handler.dataset_version()
+    previous = synced_version(conn)
+    if not full and version is not None and version == previous:
+        return {"version": version, "skipped": True, "phases": [], "elapsed_s": time.perf_counter() - start}
+
+    for statement in schema_statements():
+        conn.query(statement)
+    phases = []
+    for kind in NODES:
+        phases.append(sync_nodes(conn, handler, kind, batch_size, full))
+        progress(_describe(phases[-1]))
+    for kind in LINKS:
+        phases.append(sync_links(conn, handler, kind, batch_size))
+        progress(_describe(phases[-1]))
+
+    node_phases = [p for p in phases if p["kind"] in NODES]
+    link_phases = [p for p in phases if p["kind"] in LINKS]
+    report = {
+        "version": version, "previous_version": previous, "skipped": False, "phases": phases,
+        "nodes": sum(p["read"] for p in node_phases), "links": sum(p["read"] for p in link_phases),
+        "elapsed_s": time.perf_counter() - start,
+    }
+    for name, group in (("nodes", node_phases), ("links", link_phases)):
+        seconds = sum(p["elapsed_s"] for p in group)
+        written = sum(p["written"] for p in group)
+        report[f"{name}_written"] = written
+        report[f"{name}_per_s"] = written / seconds if seconds else None
+    record_sync(conn, version, report)
+    return report
+
+
+def verify(conn, report):
+    """Graph counts that differ from the rows exported in this run: [(kind, source rows, graph count)]."""
+    mismatches = []
+    for phase in report["phases"]:
+        if phase["kind"] in NODES:
+            label = NODES[phase["kind"]][0]
+            cypher = f"MATCH (n:{label}) RETURN count(n) AS c"
+        else:
+            rel, target = LINKS[phase["kind"]]
+            cypher = f"MATCH (:Metabolite)-[e:{rel}]->(:{NODES[target][0]}) RETURN count(e) AS c"
+        count = conn.execute_read(cypher)[0]["c"]
+        if count != phase["read"]:
+            mismatches.append((phase["kind"], phase["read"], count))
+    return mismatches
+
+
+def _describe(phase):
+    rate = f"{phase['written_per_s']:,.0f}/s" if phase["written_per_s"] else "-"
+    return (f"{phase['kind']:<22} read {phase['read']:>9,}  written {phase['written']:>9,} ({rate})  "
+            f"unchanged {phase['unchanged']:>9,}  deleted {phase['deleted']:>7,}  {phase['elapsed_s']:.1f}s")
+
+
+#######################################
+# Entry point
+#######################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync metabolites, proteins, diseases and pathways into Neo4j.")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Rows per UNWIND statement (default: 5000)")
+    parser.add_argument("--full", action="store_true",
+                        help="Rewrite every node even if the dataset version and row hashes are unchanged")
+    parser.add_argument("--no-verify", action="store_true", help="Skip comparing graph counts with the source")
+    args = parser.parse_args()
+
+    from utils.neo4j_connection import Neo4JConnection
+
+    handler = create_db_handler()
+    conn = Neo4JConnection()
+    try:
+        report = sync_graph(conn, handler, batch_size=args.batch_size, full=args.full)
+        if report["skipped"]:
+            print(f"Graph already at dataset version {report['version']}; nothing to do (--full to force).")
+            sys.exit(0)
+        print(f"\nSynced {report['previous_version']} -> {report['version']} in {report['elapsed_s']:.1f}s: "
+              f"{report['nodes_written']:,} nodes written ({report['nodes_per_s'] or 0:,.0f}/s), "
+              f"{report['links_written']:,} links written ({report['links_per_s'] or 0:,.0f}/s)")
+        if not args.no_verify:
+            mismatches = verify(conn, report)
+            for kind, expected, actual in mismatches:
+                print(f"MISMATCH {kind}: {expected:,} source rows, {actual:,} in the graph")
+            if mismatches:
+                sys.exit(1)
+            print("Graph counts match the source.")
+    finally:
+        conn.close()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from utils.identifiers import normalize_inchikey
+
+HMDB_ID_RE = re.compile(r"\bHMDB\d{5,7}\b", re.IGNORECASE)
+INCHIKEY_TOKEN_RE = re.compile(r"\b[A-Z]{14}-[A-Z]{10}-[A-Z]\b", re.IGNORECASE)
+
+# One fused metabolite. sources maps ranker -> (1-based rank, raw score).
+FusedHit = namedtuple("FusedHit", "id hmdb_id name score sources")
+HybridResult = namedtuple("HybridResult", "hits timings timed_out errors")
+
+# RRF weight per ranker: exact identifiers outrank everything, fuzzy and
+# relation-based lists only break ties among them.
+DEFAULT_WEIGHTS = {
+    "identifier": 3.0,
+    "entity": 2.0,
+    "name": 1.5,
+    "fts": 1.0,
+    "trigram": 0.8,
+    "semantic": 0.8,
+    "disease": 0.7,
+    "pathway": 0.7,
+    "biofluid": 0.5,
+}
+
+# Question words and metabolomics boilerplate never worth a fuzzy name lookup.
+_QUERY_STOPWORDS = frozenset("""
+    about all and are can compare does for from have how into list many most much role show tell than
+    that the their them there these they this what when where which with within
+    metabolite metabolites level levels concentration concentrations molecular weight structure
+    formula hmdb disease diseases pathway pathways found linked associated involved human
+""".split())
+
+
+def fuzzy_terms(prompt, max_terms=3):
+    """Longest content words of a prompt, for trigram lookups when no name was extracted."""
+    words = {w for w in re.findall(r"[a-z][a-z0-9-]{3,}", prompt.lower()) if w not in _QUERY_STOPWORDS}
+    return sorted(words, key=lambda w: (-len(w), w))[:max_terms]
+
+
+def _normalize_hmdb_id(raw):
+    """HMDB IDs are 7 digits since HMDB 4; pad old 5-digit forms (HMDB00122)."""
+    digits = raw[4:]
+    return f"HMDB{digits.zfill(7)}"
+
+
+class HybridRetriever:
+    """
+    Runs every applicable ranker concurrently against a MetaboliteStore and
+    fuses their lists with reciprocal-rank fusion:
+
+        score(m) = sum over rankers r of  weight_r / (k + rank_r(m))
+
+    Rankers that miss the latency budget are dropped from the fusion (their
+    thread finishes in the background; the handler calls are read-only).
+    The database calls release the GIL, so threads are enough here.
+    """
+
+    def __init__(self, db_handler, weights=None, k=60, per_ranker=20,
+                 budget_s=0.5, semantic=None, max_workers=8):
+        self.db = db_handler
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.k = k
+        self.per_ranker = per_ranker
+        self.budget_s = budget_s
+        # None = use semantic_search only if the index exists and matches the dataset version.
+        self.semantic = semantic
+        self.max_workers = max_workers  # concurrent ranker queries across all requests
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hybrid")
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+    ############################################
+    # Rankers: each returns [(id, hmdb_id, name, raw_score), ...] best first
+    ############################################
+    def _identifier(self, prompt):
+        rows = []
+        for raw in HMDB_ID_RE.findall(prompt):
+            row = self.db.query_by_hmdb_id(_normalize_hmdb_id(raw.upper()))
+            if row:
+                rows.append((row[0], row[1], row[2], 1.0))
+        keys = [k for k in INCHIKEY_TOKEN_RE.findall(prompt) if normalize_inchikey(k)]
+        if keys:
+            for matches in self.db.query_by_inchikeys(keys).values():
+                rows.extend((m[0], m[1], m[2], 1.0 if m[4] == "exact" else 0.5) for m in matches)
+        return rows
+
+    def _entity(self, entities):
+        rows = []
+        for ent in entities:
+            if ent.entity_type == "metabolite":
+                row = self.db.query_by_hmdb_id(ent.entity_id)
+                if row:
+                    rows.append((row[0], row[1], row[2], 1.0))
+        return rows
+
+    def _name(self, name):
+        return [(r[0], r[1], r[2], 1.0) for r in self.db.query_by_name(name, limit=self.per_ranker)]
+
+    def _fts(self, text):
+        return [(r[0], r[1], r[2], r[3] if len(r) > 3 else None)
+                for r in self.db.full_text_search(text, limit=self.per_ranker)]
+
+    def _trigram(self, terms):
+        best = {}
+        for term in terms:
+            for row in self.db.trigram_search(term, limit=self.per_ranker):
+                if row[0] not in best or row[3] > best[row[0]][3]:
+                    best[row[0]] = row
+        return sorted(best.values(), key=lambda r: (-r[3], r[0]))
+
+    def _semantic(self, prompt):
+        return list(self.db.semantic_search(prompt, limit=self.per_ranker))
+
+    def _related(self, method, value):
+        return [(r[0], r[1], r[2], None) for r in method(value, limit=self.per_ranker)]
+
+    def _semantic_enabled(self):
+        if self.semantic is not None:
+            return self.semantic
+        path = os.environ.get("METABOCHAT_SEMANTIC_INDEX", "./data/semantic")
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return False
+        # None when the index is stale for the store's dataset version
+        return self.db.semantic_index() is not None
+
+    def plan(self, prompt, keys=None):
+        """{ranker name: zero-arg callable} for the rankers this prompt can use."""
+        keys = keys or {}
+        name = keys.get("name")
+        jobs = {}
+        if HMDB_ID_RE.search(prompt) or INCHIKEY_TOKEN_RE.search(prompt):
+            jobs["identifier"] = lambda: self._identifier(prompt)
+        if keys.get("entities"):
+            jobs["entity"] = lambda: self._entity(keys["entities"])
+        if name:
+            jobs["name"] = lambda: self._name(name)
+        # The regex extractor's name can be garbage ("the HMDB ID"); also try the prompt's own words.
+        terms = list(dict.fromkeys(([name] if name else []) + fuzzy_terms(prompt)))
+        if terms:
+            jobs["trigram"] = lambda: self._trigram(terms)
+        jobs["fts"] = lambda: self._fts(name or prompt)
+        if self._semantic_enabled():
+            jobs["semantic"] = lambda: self._semantic(prompt)
+        if keys.get("disease"):
+            jobs["disease"] = lambda: self._related(self.db.query_by_disease, keys["disease"])
+        if keys.get("pathway"):
+            jobs["pathway"] = lambda: self._related(self.db.query_by_pathway, keys["pathway"])
+        if keys.get("biofluid"):
+            jobs["biofluid"] = lambda: self._related(self.db.query_by_biofluid, keys["biofluid"])
+        return jobs
+
+    ############################################
+    # Fusion
+    ############################################
+    def fuse(self, ranked_lists):
+        """Reciprocal-rank fusion of {ranker: rows}. Returns FusedHits, best first."""
+        fused = {}
+        for ranker, rows in ranked_lists.items():
+            weight = self.weights.get(ranker, 1.0)
+            seen = set()
+            for mid, hmdb_id, name, raw in rows:
+                if mid in seen:  # count each metabolite once per ranker, at its best rank
+                    continue
+                seen.add(mid)
+                rank = len(seen)
+                entry = fused.setdefault(mid, [hmdb_id, name, 0.0, {}])
+                entry[2] += weight / (self.k + rank)
+                entry[3][ranker] = (rank, raw)
+        hits = [FusedHit(mid, e[0], e[1], e[2], e[3]) for mid, e in fused.items()]
+        hits.sort(key=lambda h: (-h.score, h.id))
+        return hits
+
+    def retrieve(self, prompt, keys=None, limit=10, budget_s=None):
+        """
+        Run the planned rankers in parallel for at most `budget_s` seconds and
+        fuse whatever finished. Returns HybridResult(hits, timings, timed_out, errors).
+        """
+        budget = self.budget_s if budget_s is None else budget_s
+        timings = {}
+        timings_lock = threading.Lock()
+        returned = False
+
+        def timed(ranker, job):
+            start = time.perf_counter()
+            try:
+                return job()
+            finally:
+                with timings_lock:
+                    if not returned:  # a straggler finishing after the budget is not reported
+                        timings[ranker] = time.perf_counter() - start
+
+        futures = {self._pool.submit(timed, r, job): r for r, job in self.plan(prompt, keys).items()}
+        done, pending = wait(futures, timeout=budget)
+        for fut in pending:
+            fut.cancel()  # frees the pool slot if the ranker has not started yet
+        with timings_lock:
+            returned = True
+            reported = dict(timings)
+        ranked, errors = {}, {}
+        for fut in done:
+            ranker = futures[fut]
+            try:
+                ranked[ranker] = fut.result()
+            except Exception as e:
+                errors[ranker] = str(e)
+        timed_out = sorted(futures[f] for f in pending)
+        return HybridResult(self.fuse(ranked)[:limit], reported, timed_out, errors)
+
+
+def format_sources(hit):
+    """'name#1, fts#3, trigram#2' - which rankers found the hit and where."""
+    return ", ".join(f"{r}#{rank}" for r, (rank, _) in sorted(hit.sources.items(), key=lambda x: x[1][0]))
+
+
+#######################################
+# Demo Testing
+#######################################
+if __name__ == "__main__":
+    from utils.storage_backend import create_db_handler
+
+    db = create_db_handler()
+    retriever = HybridRetriever(db)
+    for prompt in sys.argv[1:] or ["What is the role of serotonin in depression?"]:
+        result = retriever.retrieve(prompt, {"name": prompt})
+        print(f"\n{prompt!r}")
+        for ranker, seconds in sorted(result.timings.items()):
+            print(f"  {ranker:<10} {1000 * seconds:7.1f} ms")
+        if result.timed_out:
+            print(f"  timed out: {', '.join(result.timed_out)}")
+        for hit in result.hits:
+            print(f"  {hit.hmdb_id}  {hit.score:.4f}  {hit.name}  [{format_sources(hit)}]")
+    retriever.close()
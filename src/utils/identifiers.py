@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import re
+
+# Full InChIKey: 14-char connectivity block, 10-char stereo/isotope block, protonation flag.
+INCHIKEY_RE = re.compile(r"^[A-Z]{14}(-[A-Z]{10}(-[A-Z])?)?$")
+
+
+def normalize_inchikey(key):
+    """Upper-case, strip whitespace and an 'InChIKey=' prefix. Returns None if malformed."""
+    if not key:
+        return None
+    key = key.strip().upper()
+    if key.startswith("INCHIKEY="):
+        key = key[len("INCHIKEY="):]
+    return key if INCHIKEY_RE.match(key) else None
+
+
+def inchikey_block(key):
+    """First (connectivity) block: identical for all stereoisomers of a skeleton."""
+    return key[:14]
+
+
+def group_inchikey_matches(keys, rows):
+    """
+    Map each input key to its matching rows, best first.
+
+    `rows` are (id, hmdb_id, name, inchikey) for every metabolite sharing a
+    first block with any input. A row is an "exact" match when the full key
+    equals the input, otherwise a stereo-insensitive "connectivity" match.
+    Output rows are (id, hmdb_id, name, inchikey, match_type); malformed
+    inputs map to [].
+    """
+    by_block = {}
+    for row in rows:
+        if row[3]:
+            by_block.setdefault(inchikey_block(row[3]), []).append(row)
+
+    out = {}
+    for raw in keys:
+        key = normalize_inchikey(raw)
+        if key is None:
+            out[raw] = []
+            continue
+        hits = [
+            r + ("exact" if r[3] == key else "connectivity",)
+            for r in by_block.get(inchikey_block(key), [])
+        ]
+        hits.sort(key=lambda r: r[4] != "exact")
+        out[raw] = hits
+    return out
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Read-only knowledge-base snapshot: the core metabolite records, the
+name/synonym dictionary, proteins, diseases, pathways and the metabolite
+link adjacency in one memory-mapped file, so chat workers start without
+thousands of small database queries and share one copy through the page
+cache.
+
+    python src/utils/kb_snapshot.py --out ./data/kb_snapshot.bin      # after each ingestion
+    python src/utils/kb_snapshot.py --out ./data/kb_snapshot.bin HMDB0000122 glucose
+
+Layout: 8-byte magic, header length, a JSON header (format, dataset_version,
+section table), then 64-byte aligned fixed-width NumPy arrays and one UTF-8
+string heap. Strings are (start, length) references into the heap (length
+-1 = NULL). Opening maps the file and wraps each section with
+np.frombuffer: nothing is parsed or copied beyond the header.
+
+create_db_handler() puts SnapshotStore in front of the configured backend
+when $METABOCHAT_KB_SNAPSHOT (default ./data/kb_snapshot.bin) exists. It
+serves query_by_hmdb_id, exact query_by_name, query_proteins and the graph
+exports from the snapshot while its dataset version matches the backend's;
+everything else, and everything once the snapshot is stale, goes to the
+backend.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from utils.storage_backend import MetaboliteStore
+
+MAGIC = b"MBKBSNP\x01"
+SNAPSHOT_FORMAT = 1
+ALIGN = 64
+
+# metabolite string columns, beyond hmdb_id
+METABOLITE_STRINGS = ("name", "formula", "smiles", "inchikey", "taxonomy_class")
+# link kind -> (GRAPH_EXPORTS link table, target table, target string columns)
+LINK_TABLES = {
+    "protein": ("metabolite_proteins", "proteins", ("uniprot_id", "protein_name", "gene_name")),
+    "disease": ("metabolite_diseases", "diseases", ("disease_name",)),
+    "pathway": ("metabolite_pathways", "pathways", ("pathway_name", "kegg_id", "smpdb_id")),
+}
+
+
+def name_hash(text):
+    """64-bit key of a case-folded name or synonym (collisions are checked against the heap)."""
+    return int.from_bytes(hashlib.blake2b(text.lower().encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class _StringHeap:
+    def __init__(self):
+        self.data = bytearray()
+        self._seen = {}
+
+    def ref(self, text):
+        if text is None:
+            return (0, -1)
+        text = str(text)
+        found = self._seen.get(text)
+        if found is None:
+            raw = text.encode("utf-8")
+            found = self._seen[text] = (len(self.data), len(raw))
+            self.data += raw
+        return found
+
+    def refs(self, values):
+        return np.array([self.ref(v) for v in values], dtype=np.int64).reshape(-1, 2)
+
+
+def _csr(rows_of_source, n):
+    """indptr / indices arrays from {source row: [target index, ...]}."""
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(rows_of_source.get(i, ())) for i in range(n)], out=indptr[1:])
+    indices = np.fromiter((t for i in range(n) for t in rows_of_source.get(i, ())), dtype=np.int32,
+                          count=int(indptr[-1]))
+    return indptr, indices
+
+
+############################################
+# Builder
+############################################
+def build_snapshot(handler, path):
+    """Write the snapshot of `handler`'s current dataset to `path` (atomically replaced). Returns the header."""
+    version = handler.dataset_version()
+    heap = _StringHeap()
+    sections = {}
+
+    # Metabolite records, sorted by hmdb_id for binary search
+    records = {r[1]: r for r in handler.iter_graph_rows("metabolite_records")}
+    extra = {r[0]: r for r in handler.iter_graph_rows("metabolites")}
+    hmdb_ids = sorted(records)
+    row_of = {h: i for i, h in enumerate(hmdb_ids)}
+    width = max((len(h) for h in hmdb_ids), default=1)
+    sections["met.hmdb_id"] = np.array(hmdb_ids, dtype=f"S{width}")
+    sections["met.id"] = np.array([records[h][0] for h in hmdb_ids], dtype=np.int64)
+    for col, values in (("mw_avg", [records[h][4] for h in hmdb_ids]),
+                        ("mw_mono", [extra.get(h, (None,) * 7)[4] for h in hmdb_ids])):
+        sections[f"met.{col}"] = np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+    columns = {"name": lambda h: records[h][2], "formula": lambda h: records[h][3],
+               "smiles": lambda h: records[h][5], "inchikey": lambda h: extra.get(h, (None,) * 7)[5],
+               "taxonomy_class": lambda h: extra.get(h, (None,) * 7)[6]}
+    for col in METABOLITE_STRINGS:
+        sections[f"met.{col}"] = heap.refs(columns[col](h) for h in hmdb_ids)
+
+    # Name / synonym dictionary: sorted hashes -> metabolite row
+    entries = {(name_hash(records[h][2]), i, records[h][2], True) for h, i in row_of.items() if records[h][2]}
+    for entity_type, hmdb_id, _canonical, surface in handler.iter_entity_names():
+        if entity_type == "metabolite" and surface and hmdb_id in row_of:
+            entries.add((name_hash(surface), row_of[hmdb_id], surface, False))
+    entries = sorted(entries, key=lambda e: (e[0], e[1], not e[3]))
+    sections["dict.hash"] = np.array([e[0] for e in entries], dtype=np.uint64)
+    sections["dict.row"] = np.array([e[1] for e in entries], dtype=np.int32)
+    sections["dict.canonical"] = np.array([e[3] for e in entries], dtype=bool)
+    sections["dict.surface"] = heap.refs(e[2] for e in entries)
+
+    # Proteins / diseases / pathways and the metabolite -> target adjacency
+    counts = {"metabolites": len(hmdb_ids), "dictionary": len(entries)}
+    for kind, (link_table, target_table, cols) in LINK_TABLES.items():
+        targets = list(handler.iter_graph_rows(target_table))
+        index = {t[0]: i for i, t in enumerate(targets)}
+        for c, col in enumerate(cols):
+            sections[f"{kind}.{col}"] = heap.refs(t[c] for t in targets)
+        links = defaultdict(list)
+        n_links = 0
+        for hmdb_id, key in handler.iter_graph_rows(link_table):
+            if hmdb_id in row_of and key in index:
+                links[row_of[hmdb_id]].append(index[key])
+                n_links += 1
+        sections[f"{kind}.ptr"], sections[f"{kind}.idx"] = _csr(links, len(hmdb_ids))
+        counts[target_table] = len(targets)
+        counts[link_table] = n_links
+    sections["heap"] = np.frombuffer(bytes(heap.data), dtype=np.uint8)
+
+    # Lay out: header, then aligned sections
+    table, offset = {}, 0
+    for name, arr in sections.items():
+        offset = -(-offset // ALIGN) * ALIGN
+        table[name] = [offset, arr.dtype.str, list(arr.shape)]
+        offset += arr.nbytes
+    header = {"format": SNAPSHOT_FORMAT, "dataset_version": version, "built_at": time.time(),
+              "counts": counts, "sections": table}
+    raw = json.dumps(header).encode("utf-8")
+    base = -(-(16 + len(raw)) // ALIGN) * ALIGN
+
+    tmp = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + len(raw).to_bytes(8, "little") + raw)
+        for name, arr in sections.items():
+            f.seek(base + table[name][0])
+            f.write(np.ascontiguousarray(arr).tobytes())
+        f.truncate(base + offset)
+    os.replace(tmp, path)  # workers that still map the old file keep reading it
+    return header
+
+
+############################################
+# Reader
+############################################
+class KBSnapshot:
+    """Zero-copy view over a snapshot file; lookups are binary searches over memory-mapped arrays."""
+
+    def __init__(self, path):
+        self.path = path
+        self._mm = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(self._mm[:8]) != MAGIC:
+            raise ValueError(f"{path} is not a knowledge-base snapshot")
+        header_len = int.from_bytes(bytes(self._mm[8:16]), "little")
+        self.meta = json.loads(bytes(self._mm[16:16 + header_len]))
+        if self.meta["format"] != SNAPSHOT_FORMAT:
+            raise ValueError(f"Snapshot format {self.meta['format']} != {SNAPSHOT_FORMAT}; rebuild {path}")
+        self.version = self.meta["dataset_version"]
+        base = -(-(16 + header_len) // ALIGN) * ALIGN
+        self.a = {}
+        for name, (offset, dtype, shape) in self.meta["sections"].items():
+            count = int(np.prod(shape)) if shape else 1
+            dtype = np.dtype(dtype)
+            self.a[name] = (np.frombuffer(self._mm, dtype=dtype, count=count, offset=base + offset).reshape(shape)
+                            if count else np.empty(shape, dtype=dtype))
+        self.heap = self.a["heap"]
+
+    def __len__(self):
+        return len(self.a["met.hmdb_id"])
+
+    def _str(self, ref):
+        start, length = int(ref[0]), int(ref[1])
+        return None if length < 0 else bytes(self.heap[start:start + length]).decode("utf-8")
+
+    @staticmethod
+    def _float(value):
+        return None if np.isnan(value) else float(value)
+
+    def row(self, hmdb_id):
+        """Row number of `hmdb_id`, or None."""
+        ids = self.a["met.hmdb_id"]
+        key = hmdb_id.encode("utf-8")
+        if len(key) > ids.dtype.itemsize:
+            return None
+        i = int(np.searchsorted(ids, key))
+        return i if i < len(ids) and ids[i] == key else None
+
+    def record(self, row):
+        """(id, hmdb_id, name, formula, molecular_weight_avg, smiles), the query_by_hmdb_id shape."""
+        a = self.a
+        return (int(a["met.id"][row]), a["met.hmdb_id"][row].decode("utf-8"), self._str(a["met.name"][row]),
+                self._str(a["met.formula"][row]), self._float(a["met.mw_avg"][row]), self._str(a["met.smiles"][row]))
+
+    def rows_by_name(self, name, synonyms=False):
+        """Rows whose name (and, with synonyms=True, any synonym) equals `name` case-insensitively."""
+        hashes = self.a["dict.hash"]
+        key = np.uint64(name_hash(name))
+        lo, hi = np.searchsorted(hashes, key, "left"), np.searchsorted(hashes, key, "right")
+        wanted = name.lower()
+        rows = []
+        for i in range(lo, hi):
+            if not (synonyms or self.a["dict.canonical"][i]):
+                continue
+            if (self._str(self.a["dict.surface"][i]) or "").lower() == wanted:
+                row = int(self.a["dict.row"][i])
+                if row not in rows:
+                    rows.append(row)
+        return rows
+
+    def targets(self, kind, row):
+        """Tuples of the `kind` ("protein", "disease", "pathway") rows linked to metabolite `row`."""
+        ptr, idx = self.a[f"{kind}.ptr"], self.a[f"{kind}.idx"]
+        cols = [self.a[f"{kind}.{c}"] for c in LINK_TABLES[kind][2]]
+        return [tuple(self._str(col[t]) for col in cols) for t in idx[ptr[row]:ptr[row + 1]]]
+
+    def export(self, kind):
+        """Rows of one GRAPH_EXPORTS table, in its column order."""
+        a = self.a
+        n = len(self)
+        if kind == "metabolite_records":
+            for row in range(n):
+                yield self.record(row)
+        elif kind == "metabolites":
+            for row in range(n):
+                yield (a["met.hmdb_id"][row].decode("utf-8"), self._str(a["met.name"][row]),
+                       self._str(a["met.formula"][row]), self._float(a["met.mw_avg"][row]),
+                       self._float(a["met.mw_mono"][row]), self._str(a["met.inchikey"][row]),
+                       self._str(a["met.taxonomy_class"][row]))
+        elif kind in ("proteins", "diseases", "pathways"):
+            target = next(k for k, (_, table, _) in LINK_TABLES.items() if table == kind)
+            cols = [a[f"{target}.{c}"] for c in LINK_TABLES[target][2]]
+            for t in range(len(cols[0])):
+                yield tuple(self._str(col[t]) for col in cols)
+        else:
+            target = next(k for k, (table, _, _) in LINK_TABLES.items() if table == kind)
+            ptr, idx, keys = a[f"{target}.ptr"], a[f"{target}.idx"], a[f"{target}.{LINK_TABLES[target][2][0]}"]
+            for row in range(n):
+                hmdb_id = a["met.hmdb_id"][row].decode("utf-8")
+                for t in idx[ptr[row]:ptr[row + 1]]:
+                    yield (hmdb_id, self._str(keys[t]))
+
+
+class SnapshotStore(MetaboliteStore):
+    """
+    MetaboliteStore answering point lookups from a KBSnapshot and delegating
+    everything else to `fallback` (the Postgres or SQLite handler). The
+    snapshot is only used while its dataset version equals the backend's,
+    re-checked at most every index_version_check_interval seconds; it is
+    authoritative for the tables it holds, so a miss there is not re-asked.
+    """
+
+    def __init__(self, snapshot, fallback):
+        self.snapshot = snapshot
+        self.fallback = fallback
+        self.stats = fallback.stats
+        self.metrics = Counter()
+        self._fresh_at = None
+        self._is_fresh = False
+
+    @classmethod
+    def open(cls, path, fallback):
+        return cls(KBSnapshot(path), fallback)
+
+    def __getattr__(self, name):
+        # backend-specific extras (open_pool, close_pool, itersize, ...)
+        if name == "fallback":
+            raise AttributeError(name)
+        return getattr(self.fallback, name)
+
+    def _fresh(self, method):
+        now = time.monotonic()
+        if self._fresh_at is None or now - self._fresh_at >= self.index_version_check_interval:
+            self._is_fresh = self.snapshot.version is not None and self.snapshot.version == self.dataset_version()
+            self._fresh_at = now
+        self.metrics[f"{'snapshot' if self._is_fresh else 'stale'}:{method}"] += 1
+        return self._is_fresh
+
+    def dataset_version(self):
+        return self.fallback.dataset_version()
+
+    def pool_status(self):
+        return self.fallback.pool_status()
+
+    def query_by_hmdb_id(self, hmdb_id):
+        if not self._fresh("query_by_hmdb_id"):
+            return self.fallback.query_by_hmdb_id(hmdb_id)
+        row = self.snapshot.row(hmdb_id)
+        return None if row is None else self.snapshot.record(row)
+
+    def query_by_name(self, name, limit=5):
+        if self._fresh("query_by_name"):
+            rows = self.snapshot.rows_by_name(name)
+            if rows:
+                return [self.snapshot.record(r) for r in rows[:limit]]
+            self.metrics["fallback:query_by_name"] += 1  # partial matches need the backend
+        return self.fallback.query_by_name(name, limit)
+
+    def query_proteins(self, hmdb_id):
+        if not self._fresh("query_proteins"):
+            return self.fallback.query_proteins(hmdb_id)
+        row = self.snapshot.row(hmdb_id)
+        return [] if row is None else self.snapshot.targets("protein", row)
+
+    def iter_graph_rows(self, kind):
+        if self._fresh("iter_graph_rows"):
+            return self.snapshot.export(kind)
+        return self.fallback.iter_graph_rows(kind)
+
+    def snapshot_metrics(self):
+        return {"path": self.snapshot.path, "version": self.snapshot.version, "fresh": self._is_fresh,
+                **dict(self.metrics)}
+
+
+def _delegate(name):
+    def method(self, *args, **kwargs):
+        return getattr(self.fallback, name)(*args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+for _name in sorted(MetaboliteStore.__abstractmethods__):
+    if _name not in SnapshotStore.__dict__:
+        setattr(SnapshotStore, _name, _delegate(_name))
+SnapshotStore.__abstractmethods__ = frozenset()
+
+
+#######################################
+# Build snapshot / Demo Testing
+#######################################
+if __name__ == "__main__":
+    from utils.storage_backend import BACKENDS, create_db_handler
+
+    parser = argparse.ArgumentParser(description="Build the memory-mapped knowledge-base snapshot.")
+    parser.add_argument("--backend", choices=BACKENDS, default=None)
+    parser.add_argument("--sqlite-path", default=None)
+    parser.add_argument("--out", default="./data/kb_snapshot.bin")
+    parser.add_argument("lookups", nargs="*", help="HMDB ids or names to look up afterwards")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    db = create_db_handler(args.backend, sqlite_path=args.sqlite_path, kb_snapshot="off")
+    header = build_snapshot(db, args.out)
+    print(f"Built {args.out} ({os.path.getsize(args.out) / 1e6:.1f} MB, version {header['dataset_version']}) "
+          f"in {time.perf_counter() - start:.2f}s: {header['counts']}")
+
+    start = time.perf_counter()
+    store = SnapshotStore.open(args.out, db)
+    print(f"Open: {1000 * (time.perf_counter() - start):.2f} ms")
+    for lookup in args.lookups:
+        start = time.perf_counter()
+        if lookup.upper().startswith("HMDB"):
+            found = [store.query_by_hmdb_id(lookup.upper())]
+            proteins = store.query_proteins(lookup.upper())
+        else:
+            found, proteins = store.query_by_name(lookup), None
+        print(f"{lookup!r} ({1e6 * (time.perf_counter() - start):.0f} us): {found}"
+              + (f", proteins {proteins}" if proteins else ""))
+    print(store.snapshot_metrics())
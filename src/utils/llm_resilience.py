@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from utils.batch_runner import retry_after_seconds
+
+
+class LLMUnavailable(Exception):
+    """The circuit breaker is open: the upstream is failing, don't call it."""
+
+
+class LLMDeadlineExceeded(Exception):
+    """No response (or first streamed chunk) before the call's deadline."""
+
+
+def classify_error(exc):
+    """
+    "rate_limit", "retryable" (timeouts, connection errors, 5xx) or "fatal"
+    (auth, bad request: retrying can't help and it says nothing about upstream health).
+    """
+    status = getattr(exc, "status_code", None)
+    name = type(exc).__name__
+    if status == 429 or name == "RateLimitError":
+        return "rate_limit"
+    if isinstance(exc, (LLMDeadlineExceeded, TimeoutError, ConnectionError)):
+        return "retryable"
+    if name in ("APITimeoutError", "APIConnectionError", "InternalServerError"):
+        return "retryable"
+    if status is not None and (status >= 500 or status == 408):
+        return "retryable"
+    return "fatal"
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive upstream failures;
+    open -> half_open after `reset_timeout_s`, letting one probe through;
+    the probe's outcome closes or re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout_s=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.transitions = Counter()
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set(self, state):
+        if state != self.state:
+            self.transitions[f"{self.state}->{state}"] += 1
+            self.state = state
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout_s:
+                self._set("half_open")
+                self._probing = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def available(self):
+        """Would a call be let through now (without claiming the half-open probe)?"""
+        with self._lock:
+            return self.state != "open" or time.monotonic() - self.opened_at >= self.reset_timeout_s
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set("open")
+
+
+class _Stream:
+    """A streaming response whose first chunk has already arrived."""
+
+    def __init__(self, response, first, rest):
+        self.response = response
+        self.first = first
+        self.rest = rest
+
+    def __iter__(self):
+        return itertools.chain([] if self.first is None else [self.first], self.rest)
+
+    def close(self):
+        close = getattr(self.response, "close", None)
+        if close:
+            close()
+
+
+class ResilientLLM:
+    """
+    Wraps a single-attempt completion function, call(**kwargs) -> response,
+    with:
+
+    - an overall deadline per call (each attempt gets the remaining time as
+      its `timeout`)
+    - hedging: if the first response (for streams: the first chunk) is not
+      back after the observed p95 latency, a second identical request is
+      started and whichever answers first wins; the loser is closed
+    - retries of rate-limit / timeout / 5xx failures with jittered
+      exponential backoff (Retry-After honoured), within the deadline
+    - a CircuitBreaker: while open, calls fail fast with LLMUnavailable so
+      the caller can degrade instead of waiting on a dead upstream
+
+    Every decision is counted in `metrics` (see snapshot()).
+    """
+
+    def __init__(self, call, deadline_s=30.0, hedge_after_s="auto", max_retries=2, backoff_base_s=0.5,
+                 breaker=None, on_rate_limit=None, min_hedge_s=0.25, hedge_samples=20, max_workers=32):
+        self.call = call
+        self.deadline_s = deadline_s
+        self.hedge_after_s = hedge_after_s  # "auto" (observed p95), a number of seconds, or None (off)
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.breaker = breaker or CircuitBreaker()
+        self.on_rate_limit = on_rate_limit
+        self.min_hedge_s = min_hedge_s
+        self.hedge_samples = hedge_samples
+        self.metrics = Counter()
+        self._latency = {False: deque(maxlen=500), True: deque(maxlen=500)}  # by stream flag
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+
+    def count(self, key, n=1):
+        with self._lock:
+            self.metrics[key] += n
+
+    def hedge_delay(self, stream):
+        """Seconds to wait before hedging, or None when hedging is off / not enough samples yet."""
+        if self.hedge_after_s is None:
+            return None
+        if self.hedge_after_s != "auto":
+            return float(self.hedge_after_s)
+        with self._lock:
+            samples = sorted(self._latency[stream])
+        if len(samples) < self.hedge_samples:
+            return None
+        return max(self.min_hedge_s, samples[min(len(samples) - 1, int(0.95 * len(samples)))])
+
+    ############################################
+    # One attempt (possibly hedged)
+    ############################################
+    def _attempt(self, kwargs, timeout):
+        start = time.monotonic()
+        response = self.call(**dict(kwargs, timeout=timeout))
+        if kwargs.get("stream"):
+            rest = iter(response)
+            response = _Stream(response, next(rest, None), rest)
+        with self._lock:
+            self._latency[bool(kwargs.get("stream"))].append(time.monotonic() - start)
+        return response
+
+    def _discard(self, future):
+        """Close a losing / abandoned attempt whenever it finishes."""
+        def close(f):
+            if not f.cancelled() and f.exception() is None:
+                result = f.result()
+                if isinstance(result, _Stream):
+                    result.close()
+        if not future.cancel():
+            future.add_done_callback(close)
+
+    def _hedged(self, kwargs, deadline):
+        stream = bool(kwargs.get("stream"))
+        futures = [self._pool.submit(self._attempt, kwargs, deadline - time.monotonic())]
+        hedge = self.hedge_delay(stream)
+        if hedge is not None and hedge < deadline - time.monotonic():
+            done, _ = wait(futures, timeout=hedge)
+            if not done:
+                self.count("hedges")
+                futures.append(self._pool.submit(self._attempt, kwargs, deadline - time.monotonic()))
+        pending = set(futures)
+        errors = []
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                for f in pending:
+                    self._discard(f)
+                raise LLMDeadlineExceeded(f"no response within {self.deadline_s:.1f}s")
+            for f in done:
+                if f.exception() is None:
+                    for other in pending:
+                        self._discard(other)
+                    if len(futures) > 1:
+                        self.count("hedge_won" if f is futures[1] else "hedge_lost")
+                    return f.result()
+                errors.append(f.exception())
+        raise errors[0]
+
+    ############################################
+    # Public API
+    ############################################
+    def available(self):
+        return self.breaker.available()
+
+    def complete(self, deadline_s=None, **kwargs):
+        """call(**kwargs) with deadline, hedging, retries and the breaker; streams come back already started."""
+        self.count("calls")
+        if not self.breaker.allow():
+            self.count("breaker_rejected")
+            raise LLMUnavailable(f"LLM circuit open after {self.breaker.failures} consecutive failures")
+        deadline = time.monotonic() + (deadline_s or self.deadline_s)
+        for attempt in itertools.count():
+            try:
+                response = self._hedged(kwargs, deadline)
+            except Exception as e:
+                kind = classify_error(e)
+                self.count(f"error_{kind}")
+                if kind == "fatal":
+                    self.breaker.record_success()  # the upstream answered; the request was bad
+                    raise
+                self.breaker.record_failure()
+                if isinstance(e, LLMDeadlineExceeded):
+                    self.count("deadline_exceeded")
+                    raise
+                if attempt >= self.max_retries:
+                    raise
+                delay = retry_after_seconds(e, attempt, base=self.backoff_base_s)
+                if kind == "rate_limit" and self.on_rate_limit is not None:
+                    self.on_rate_limit(delay)
+                if time.monotonic() + delay >= deadline:
+                    self.count("deadline_exceeded")
+                    raise LLMDeadlineExceeded(f"retry backoff {delay:.1f}s would pass the deadline") from e
+                if not self.breaker.allow():
+                    self.count("breaker_rejected")
+                    raise LLMUnavailable("LLM circuit opened during retries") from e
+                self.count("retries")
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            self.count("successes")
+            return response
+
+    def snapshot(self):
+        with self._lock:
+            out = dict(self.metrics)
+        out["breaker_state"] = self.breaker.state
+        out["breaker_transitions"] = dict(self.breaker.transitions)
+        out["hedge_delay_s"] = {"stream": self.hedge_delay(True), "plain": self.hedge_delay(False)}
+        return out
+
+
+#######################################
+# Demo Testing
+#######################################
+if __name__ == "__main__":
+    import random
+
+    rng = random.Random(0)
+
+    def flaky(timeout=None, **kwargs):
+        # 4% slow tail, 5% dropped connections
+        roll = rng.random()
+        if roll < 0.05:
+            raise ConnectionError("upstream reset")
+        time.sleep(2.0 if roll > 0.96 else 0.05)
+        return "ok"
+
+    llm = ResilientLLM(flaky, deadline_s=3.0, hedge_samples=10, backoff_base_s=0.05)
+    latencies = []
+    for _ in range(100):
+        start = time.perf_counter()
+        try:
+            llm.complete()
+        except Exception as e:
+            print(f"failed: {type(e).__name__}: {e}")
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"p50 {latencies[50]:.2f}s  p95 {latencies[95]:.2f}s  max {latencies[-1]:.2f}s")
+    print(llm.snapshot())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+import time
+from collections import deque
+
+
+class ThinkTagFilter:
+    """
+    Incremental version of run_llma.clean_response's tag handling for
+    streamed output: drops <think>...</think> reasoning blocks entirely,
+    strips any other <tag>, and collapses runs of 3+ newlines to 2.
+
+    Text is released as soon as it cannot be part of a tag, so a '<' split
+    across two chunks ("...<thi" + "nk>...") is held back only until the
+    tag closes or `max_tag` characters pass without a '>'.
+    """
+
+    def __init__(self, max_tag=64):
+        self.max_tag = max_tag
+        self._buf = ""
+        self._in_think = False
+        self._newlines = 0
+        self._started = False
+
+    def _emit(self, text):
+        out = []
+        for ch in text:
+            if ch == "\n":
+                self._newlines += 1
+                if self._newlines > 2 or not self._started:
+                    continue
+            else:
+                self._newlines = 0
+                if not self._started and ch.isspace():
+                    continue
+                self._started = True
+            out.append(ch)
+        return "".join(out)
+
+    def feed(self, chunk):
+        """Add streamed text; return the part that is safe to show now."""
+        self._buf += chunk
+        out = []
+        while self._buf:
+            if self._in_think:
+                end = self._buf.lower().find("</think>")
+                if end < 0:
+                    # keep a possible partial "</think" suffix, drop the rest
+                    self._buf = self._buf[-len("</think>"):]
+                    break
+                self._buf = self._buf[end + len("</think>"):]
+                self._in_think = False
+                continue
+            lt = self._buf.find("<")
+            if lt < 0:
+                out.append(self._buf)
+                self._buf = ""
+                break
+            out.append(self._buf[:lt])
+            self._buf = self._buf[lt:]
+            gt = self._buf.find(">")
+            if gt < 0:
+                if len(self._buf) > self.max_tag:  # not a tag after all
+                    out.append(self._buf[0])
+                    self._buf = self._buf[1:]
+                    continue
+                break
+            tag = self._buf[1:gt].strip().lower()
+            self._buf = self._buf[gt + 1:]
+            if tag == "think":
+                self._in_think = True
+        return self._emit("".join(out))
+
+    def flush(self):
+        """End of stream: release anything held back (an unclosed '<...' is plain text)."""
+        rest, self._buf = ("" if self._in_think else self._buf), ""
+        return self._emit(rest)
+
+
+class StreamTimer:
+    """Time-to-first-token and total latency of one LLM request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.end = None
+        self.chunks = 0
+
+    def token(self):
+        self.chunks += 1
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+
+    def done(self):
+        self.end = time.perf_counter()
+        return self
+
+    @property
+    def ttft(self):
+        return None if self.first_token is None else self.first_token - self.start
+
+    @property
+    def total(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def as_dict(self):
+        return {"ttft_s": self.ttft, "total_s": self.total, "chunks": self.chunks}
+
+
+class LatencyLog:
+    """Bounded history of per-request timings with simple percentiles."""
+
+    def __init__(self, maxlen=1000):
+        self.records = deque(maxlen=maxlen)
+        self.count = 0  # requests ever logged (records is bounded)
+
+    def add(self, timer, streamed, **extra):
+        record = dict(timer.as_dict(), streamed=streamed, **extra)
+        self.records.append(record)
+        self.count += 1
+        return record
+
+    def summary(self):
+        out = {}
+        for key in ("ttft_s", "total_s"):
+            values = sorted(r[key] for r in self.records if r[key] is not None)
+            if values:
+                out[key] = {"p50": values[len(values) // 2],
+                            "p95": values[min(len(values) - 1, int(0.95 * len(values)))],
+                            "n": len(values)}
+        return out
+
+
+def stream_text(chunks, timer=None, text_filter=None):
+    """
+    Turn an OpenAI-compatible streaming response into filtered text pieces.
+    Marks the timer at the first visible piece (what the user perceives).
+    """
+    text_filter = text_filter or ThinkTagFilter()
+    for chunk in chunks:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        piece = text_filter.feed(delta)
+        if piece:
+            if timer:
+                timer.token()
+            yield piece
+    tail = text_filter.flush()
+    if tail:
+        if timer:
+            timer.token()
+        yield tail
+
+
+#######################################
+# Demo Testing
+#######################################
+if __name__ == "__main__":
+    text = "<think>Let me reason\nabout this.</think>\n\n**Glucose** is a <b>sugar</b>.\n\n\n\nMW: 180 g/mol; 1 < 2."
+    for size in (1, 3, 7, len(text)):
+        f = ThinkTagFilter()
+        out = "".join(f.feed(text[i:i + size]) for i in range(0, len(text), size)) + f.flush()
+        print(f"chunk={size:<3} {out!r}")
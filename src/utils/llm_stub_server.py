@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an OpenAI-compatible chat-completions endpoint, for
+offline runs and latency regression tests of the chat pipeline.
+
+    python src/utils/llm_stub_server.py --port 8099 --ttft 0.3 --tokens-per-s 80 --error-rate 0.02
+    METABOCHAT_LLM_BASE_URL=http://127.0.0.1:8099/v1 python src/chatbot/run_llma.py
+
+Serves POST /v1/chat/completions (plain JSON, or SSE chunks with
+"stream": true) and GET /v1/models. Replies are canned text that echoes
+the question, optionally wrapped around a <think> block, and are
+delivered at a scripted time-to-first-token and token rate. A share of
+requests can fail with 500s or 429s (with Retry-After).
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubConfig:
+    def __init__(self, ttft=0.2, tokens_per_s=50.0, jitter=0.0, reply_tokens=60, think_tokens=0,
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0, model="stub-model", seed=None):
+        self.ttft = ttft                    # seconds before the first token
+        self.tokens_per_s = tokens_per_s    # generation speed after that (0 = instant)
+        self.jitter = jitter                # +- fraction applied to ttft and per-token delay
+        self.reply_tokens = reply_tokens    # visible answer length, in words
+        self.think_tokens = think_tokens    # length of a leading <think> block (0 = none)
+        self.error_rate = error_rate        # share of requests answered with HTTP 500
+        self.rate_limit_rate = rate_limit_rate  # share answered with HTTP 429
+        self.retry_after = retry_after
+        self.model = model
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def delay(self, base):
+        if not base or not self.jitter:
+            return base
+        return max(0.0, base * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+
+
+def reply_words(messages, config):
+    """Deterministic answer text for a conversation: echoes the question, padded to reply_tokens words."""
+    prompt = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    match = re.search(r"User Query:\n(.+)", prompt)
+    question = (match.group(1) if match else prompt).strip()[:200]
+    words = f"Stub answer to: {question}".split()
+    filler = "This placeholder text stands in for the model output during offline benchmarking.".split()
+    while len(words) < config.reply_tokens:
+        words.extend(filler)
+    words = words[:max(config.reply_tokens, 1)]
+    pieces = [w + " " for w in words]
+    pieces[-1] = pieces[-1].rstrip() + "."
+    if config.think_tokens:
+        pieces = ["<think>"] + ["reasoning "] * config.think_tokens + ["</think>\n"] + pieces
+    return pieces
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = StubConfig()
+
+    def log_message(self, format, *args):  # quiet
+        pass
+
+    def _json(self, status, obj, headers=None):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            return self._json(200, {"object": "list", "data": [{"id": self.config.model, "object": "model"}]})
+        self._json(404, {"error": {"message": f"no route {self.path}"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._json(404, {"error": {"message": f"no route {self.path}"}})
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._json(400, {"error": {"message": "invalid JSON", "type": "invalid_request_error"}})
+
+        config = self.config
+        with config.lock:
+            config.requests += 1
+            roll = config.rng.random()
+        if roll < config.rate_limit_rate:
+            return self._json(429, {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_error",
+                                              "code": "rate_limit_exceeded"}},
+                              {"Retry-After": f"{config.retry_after:g}"})
+        if roll < config.rate_limit_rate + config.error_rate:
+            return self._json(500, {"error": {"message": "Injected failure (stub)", "type": "server_error"}})
+
+        pieces = reply_words(request.get("messages", []), config)
+        model = request.get("model") or config.model
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in request.get("messages", []))
+        per_token = 1.0 / config.tokens_per_s if config.tokens_per_s else 0.0
+        time.sleep(config.delay(config.ttft))
+
+        if not request.get("stream"):
+            time.sleep(config.delay(per_token * (len(pieces) - 1)))
+            return self._json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces)},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces),
+                          "total_tokens": prompt_tokens + len(pieces)},
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta, finish=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            event({"role": "assistant", "content": ""})
+            for i, piece in enumerate(pieces):
+                if i:
+                    time.sleep(config.delay(per_token))
+                event({"content": piece})
+            event({}, "stop")
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):  # client gave up mid-stream
+            pass
+
+
+def start_stub_server(host="127.0.0.1", port=0, config=None):
+    """Run the stub in a daemon thread; returns (server, base_url). server.shutdown() stops it."""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config or StubConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def add_stub_arguments(parser):
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-s", type=float, default=50.0, help="Token rate after the first (0 = instant)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+- fraction of random variation in delays")
+    parser.add_argument("--reply-tokens", type=int, default=60, help="Answer length in words")
+    parser.add_argument("--think-tokens", type=int, default=0, help="Length of a leading <think> block")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests failing with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on injected 429s")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args):
+    return StubConfig(ttft=args.ttft, tokens_per_s=args.tokens_per_s, jitter=args.jitter,
+                      reply_tokens=args.reply_tokens, think_tokens=args.think_tokens,
+                      error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                      retry_after=args.retry_after, seed=args.seed)
+
+
+#######################################
+# Entry point
+#######################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port),
+                                 type("ConfiguredStubHandler", (StubHandler,), {"config": config_from_args(args)}))
+    server.daemon_threads = True
+    print(f"Stub LLM on http://{args.host}:{args.port}/v1 (ttft {args.ttft}s, {args.tokens_per_s} tok/s, "
+          f"errors {args.error_rate:.0%}, 429s {args.rate_limit_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+from collections import namedtuple
+
+import numpy as np
+
+# name -> (molecule multiplier, mass shift in Da, charge); m/z = (n*M + shift) / |z|
+ADDUCTS = {
+    "[M]": (1, 0.0, 0),
+    "[M+H]+": (1, 1.007276, 1),
+    "[M+Na]+": (1, 22.989218, 1),
+    "[M+K]+": (1, 38.963158, 1),
+    "[M+NH4]+": (1, 18.033823, 1),
+    "[M+2H]2+": (1, 2.014552, 2),
+    "[M-H]-": (1, -1.007276, -1),
+    "[M+Cl]-": (1, 34.969402, -1),
+    "[2M+H]+": (2, 1.007276, 1),
+}
+
+DEFAULT_ADDUCTS = ("[M+H]+", "[M+Na]+", "[M-H]-")
+
+# Flat, vectorized result of a batch search, sorted by (peak, |ppm error|).
+MassMatches = namedtuple("MassMatches", ["peak", "adduct", "position", "neutral_mass", "ppm_error"])
+
+MassCandidate = namedtuple("MassCandidate", ["id", "hmdb_id", "name", "adduct", "mass", "ppm_error"])
+
+
+def neutral_masses(mzs, adduct):
+    """Neutral monoisotopic mass implied by observed m/z values for an adduct."""
+    n, shift, charge = ADDUCTS[adduct]
+    return (np.asarray(mzs, dtype=np.float64) * max(abs(charge), 1) - shift) / n
+
+
+def mass_window(mz, tolerance=10.0, unit="ppm", adduct="[M]"):
+    """(neutral_mass, low, high) search window for a single observed m/z."""
+    n, shift, charge = ADDUCTS[adduct]
+    mass = (mz * max(abs(charge), 1) - shift) / n
+    if unit == "ppm":
+        half = abs(mass) * tolerance * 1e-6
+    elif unit == "Da":
+        half = tolerance * max(abs(charge), 1) / n
+    else:
+        raise ValueError(f"unit must be 'ppm' or 'Da', got {unit!r}")
+    return mass, mass - half, mass + half
+
+
+class MassIndex:
+    """
+    In-memory monoisotopic mass index: masses sorted once into a float64
+    array (ids/names kept in the same order), queried with np.searchsorted.
+    A batch of 10k peaks x a few adducts is a handful of vectorized passes.
+    """
+
+    def __init__(self, ids, hmdb_ids, names, masses):
+        masses = np.asarray(masses, dtype=np.float64)
+        order = np.argsort(masses, kind="stable")
+        self.masses = masses[order]
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.hmdb_ids = np.asarray(hmdb_ids, dtype=object)[order]
+        self.names = np.asarray(names, dtype=object)[order]
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (id, hmdb_id, name, monoisotopic_mass) rows, skipping NULL masses."""
+        rows = [r for r in rows if r[3] is not None]
+        if not rows:
+            return cls([], [], [], [])
+        ids, hmdb_ids, names, masses = zip(*rows)
+        return cls(ids, hmdb_ids, names, masses)
+
+    def __len__(self):
+        return len(self.masses)
+
+    def search_arrays(self, mzs, tolerance=10.0, unit="ppm", adducts=DEFAULT_ADDUCTS, top_k=5):
+        """
+        Vectorized batch search. Returns MassMatches (parallel NumPy arrays)
+        holding at most `top_k` candidates per peak, best first.
+        `tolerance` is in ppm, or in m/z units when unit="Da".
+        """
+        if unit not in ("ppm", "Da"):
+            raise ValueError(f"unit must be 'ppm' or 'Da', got {unit!r}")
+        mzs = np.atleast_1d(np.asarray(mzs, dtype=np.float64))
+        # searchsorted is markedly faster with sorted needles; remember where each came from.
+        peak_ids = np.argsort(mzs, kind="stable")
+        mzs = mzs[peak_ids]
+
+        parts = []
+        for a_idx, adduct in enumerate(adducts):
+            n, _, charge = ADDUCTS[adduct]
+            neutral = neutral_masses(mzs, adduct)
+            if unit == "ppm":
+                half = np.abs(neutral) * tolerance * 1e-6
+            else:
+                half = np.full_like(neutral, tolerance * max(abs(charge), 1) / n)
+            lo = np.searchsorted(self.masses, neutral - half, side="left")
+            hi = np.searchsorted(self.masses, neutral + half, side="right")
+            counts = hi - lo
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            # Expand each [lo, hi) window into explicit positions without a Python loop.
+            sorted_peak = np.repeat(np.arange(len(mzs)), counts)
+            starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+            position = starts + np.arange(total)
+            obs = neutral[sorted_peak]
+            peak = peak_ids[sorted_peak]
+            ppm = (self.masses[position] - obs) / obs * 1e6
+            parts.append((peak, np.full(total, a_idx), position, obs, ppm))
+
+        if not parts:
+            empty = np.array([], dtype=np.int64)
+            return MassMatches(empty, empty, empty, np.array([]), np.array([]))
+
+        peak, adduct, position, obs, ppm = (np.concatenate(c) for c in zip(*parts))
+        # One float key (peak + scaled |error| < 1) sorts faster than a lexsort.
+        abs_ppm = np.abs(ppm)
+        order = np.argsort(peak + abs_ppm / (abs_ppm.max() + 1.0), kind="stable")
+        peak, adduct, position, obs, ppm = peak[order], adduct[order], position[order], obs[order], ppm[order]
+
+        # Rank within each peak's run and keep the first top_k.
+        run_start = np.r_[0, np.flatnonzero(np.diff(peak)) + 1]
+        rank = np.arange(len(peak)) - np.repeat(run_start, np.diff(np.r_[run_start, len(peak)]))
+        keep = rank < top_k
+        return MassMatches(peak[keep], adduct[keep], position[keep], obs[keep], ppm[keep])
+
+    def annotate(self, mzs, tolerance=10.0, unit="ppm", adducts=DEFAULT_ADDUCTS, top_k=5):
+        """
+        Same as search_arrays, returned as one list of MassCandidate per input
+        m/z (empty list when nothing falls inside the window).
+        """
+        mzs = np.atleast_1d(mzs)
+        m = self.search_arrays(mzs, tolerance, unit, adducts, top_k)
+        out = [[] for _ in range(len(mzs))]
+        rows = zip(
+            m.peak.tolist(), self.ids[m.position].tolist(), self.hmdb_ids[m.position].tolist(),
+            self.names[m.position].tolist(), m.adduct.tolist(), self.masses[m.position].tolist(),
+            m.ppm_error.tolist()
+        )
+        for peak, mid, hmdb_id, name, a_idx, mass, ppm in rows:
+            out[peak].append(MassCandidate(mid, hmdb_id, name, adducts[a_idx], mass, ppm))
+        return out
+
+
+#######################################
+# Demo Testing
+#######################################
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    n = 220_000
+    masses = rng.uniform(50, 1200, n)
+    idx = MassIndex(np.arange(1, n + 1), [f"HMDB{i:07d}" for i in range(1, n + 1)], ["?"] * n, masses)
+
+    peaks = masses[rng.integers(0, n, 10_000)] + 1.007276
+    start = time.perf_counter()
+    m = idx.search_arrays(peaks, tolerance=5, adducts=DEFAULT_ADDUCTS, top_k=5)
+    print(f"search_arrays: 10k peaks -> {len(m.peak)} candidates in {1000 * (time.perf_counter() - start):.1f} ms")
+    start = time.perf_counter()
+    idx.annotate(peaks, tolerance=5)
+    print(f"annotate:      10k peaks in {1000 * (time.perf_counter() - start):.1f} ms")
@@ -1,21 +1,188 @@
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
 import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from utils.query_stats import QueryStats
 
 # Load environment variables
 load_dotenv()
 
+# Write counters summed over the batches of query_many
+COUNTERS = ("nodes_created", "nodes_deleted", "relationships_created", "relationships_deleted",
+            "properties_set", "labels_added", "labels_removed")
+
+
 class Neo4JConnection:
-    def __init__(self):
+    """
+    One driver (and its connection pool) per process; each thread reuses a
+    long-lived session instead of opening one per call.
+
+    - query(): auto-commit, returns the records (schema statements, one-offs)
+    - execute_read / execute_write: managed transactions, which the driver
+      retries on transient errors (deadlocks, leader changes, dropped
+      connections) for up to `max_retry_time_s`
+    - query_many(): one UNWIND statement over a parameter list, sent in
+      write transactions of `batch_size` rows
+    - stream(): a generator over a large result, fetched `fetch_size`
+      records at a time
+
+    Every call is timed into `self.stats` (QueryStats, keyed by call kind)
+    and passed to the hooks added with add_query_hook().
+    """
+
+    def __init__(self, uri=None, user=None, password=None, database=None,
+                 max_pool_size=50, acquisition_timeout_s=60.0, max_lifetime_s=3600.0,
+                 max_retry_time_s=30.0, fetch_size=1000, stats=None, slow_query_ms=1000):
         self._driver = GraphDatabase.driver(
-            os.getenv("NEO4J_URI"), 
-            auth=(os.getenv("NEO4J_USER"), os.getenv("NEO4J_PASSWORD"))
+            uri or os.getenv("NEO4J_URI"),
+            auth=(user or os.getenv("NEO4J_USER"), password or os.getenv("NEO4J_PASSWORD")),
+            max_connection_pool_size=max_pool_size,
+            connection_acquisition_timeout=acquisition_timeout_s,
+            max_connection_lifetime=max_lifetime_s,
+            max_transaction_retry_time=max_retry_time_s,
         )
+        self.database = database or os.getenv("NEO4J_DATABASE")
+        self.fetch_size = fetch_size
+        self.stats = stats or QueryStats(slow_query_threshold=slow_query_ms / 1000.0, capture_plans=False)
+        self.retries = 0
+        self._hooks = []
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
 
     def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
         self._driver.close()
 
+    ############################################
+    # Sessions and timing
+    ############################################
+    def _session(self):
+        """This thread's long-lived session (sessions are not thread-safe)."""
+        session = getattr(self._local, "session", None)
+        if session is None or session.closed():
+            session = self._driver.session(database=self.database, fetch_size=self.fetch_size)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def add_query_hook(self, hook):
+        """hook(kind, query, seconds, rows, error) after every call, e.g. to log or export metrics."""
+        self._hooks.append(hook)
+
+    def _record(self, kind, query, parameters, start, rows, error):
+        seconds = time.perf_counter() - start
+        self.stats.record_call(kind, seconds, rows, error=error)
+        if seconds >= self.stats.slow_query_threshold:
+            self.stats.record_slow_query(query, _describe_params(parameters), seconds, method=kind)
+        for hook in self._hooks:
+            hook(kind, query, seconds, rows, error)
+
+    def _timed(self, kind, query, parameters, run):
+        start = time.perf_counter()
+        rows, error = 0, True
+        try:
+            result = run()
+            rows, error = (len(result) if isinstance(result, list) else result.get("rows", 0)), False
+            return result
+        finally:
+            self._record(kind, query, parameters, start, rows, error)
+
+    def _counting_retries(self, work):
+        """Wrap a transaction function: the driver calls it again on every retry, which is how retries are counted."""
+        attempts = [0]
+
+        def counted(tx, *args):
+            attempts[0] += 1
+            if attempts[0] > 1:
+                with self._lock:
+                    self.retries += 1
+            return work(tx, *args)
+        return counted
+
+    def _work(self, query, parameters):
+        return self._counting_retries(lambda tx: list(tx.run(query, parameters or {})))
+
+    ############################################
+    # Queries
+    ############################################
     def query(self, query, parameters=None):
-        with self._driver.session() as session:
-            result = session.run(query, parameters)
-            return [record for record in result]
+        return self._timed("query", query, parameters,
+                           lambda: list(self._session().run(query, parameters)))
+
+    def execute_read(self, query, parameters=None):
+        """Records of a read query in a managed (retried) read transaction; may go to a read replica."""
+        return self._timed("read", query, parameters,
+                           lambda: self._session().execute_read(self._work(query, parameters)))
+
+    def execute_write(self, query, parameters=None):
+        """Records of a write query in a managed (retried) write transaction."""
+        return self._timed("write", query, parameters,
+                           lambda: self._session().execute_write(self._work(query, parameters)))
+
+    def query_many(self, query, rows, batch_size=1000, param="rows"):
+        """
+        Run `query` (which UNWINDs ${param}) over an iterable of parameter
+        rows, one retried write transaction per batch. Returns
+        {"rows", "batches", <summed write counters>}.
+        """
+        def write_batch(tx, batch):
+            summary = tx.run(query, {param: batch}).consume()
+            return {name: getattr(summary.counters, name, 0) for name in COUNTERS}
+
+        def run():
+            totals = dict.fromkeys(COUNTERS + ("rows", "batches"), 0)
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    _add(totals, self._session().execute_write(self._counting_retries(write_batch), batch), len(batch))
+                    batch = []
+            if batch:
+                _add(totals, self._session().execute_write(self._counting_retries(write_batch), batch), len(batch))
+            return totals
+        return self._timed("many", query, None, run)
+
+    def stream(self, query, parameters=None, fetch_size=None):
+        """
+        Yield records one by one, holding at most `fetch_size` in memory.
+        Runs on its own session so other calls on this thread can interleave
+        with the iteration; not retried (records may already be consumed).
+        """
+        start = time.perf_counter()
+        rows, error = 0, True
+        session = self._driver.session(database=self.database, fetch_size=fetch_size or self.fetch_size)
+        try:
+            for record in session.run(query, parameters):
+                rows += 1
+                yield record
+            error = False
+        except GeneratorExit:
+            error = False  # consumer stopped early
+            raise
+        finally:
+            session.close()
+            self._record("stream", query, parameters, start, rows, error)
+
+
+def _add(totals, counters, n):
+    for name, value in counters.items():
+        totals[name] += value
+    totals["rows"] += n
+    totals["batches"] += 1
+
+
+def _describe_params(parameters):
+    """Slow-query log entry for the parameters: list sizes instead of contents."""
+    if not parameters:
+        return parameters
+    return {k: f"<{len(v)} items>" if isinstance(v, list) else v for k, v in parameters.items()}
@@ -1,12 +1,17 @@
 import os
+import sys
+import argparse
+import hashlib
 import json
 import logging
 import time
 import xml.etree.ElementTree as ET
-from typing import List, Optional
-from psycopg2.extras import execute_values
+from typing import Iterator, List, Optional
 from concurrent.futures import ThreadPoolExecutor
-import psycopg2
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from utils.formula_index import parse_formula
 
 #########################################
 # 1) CONFIG & LOGGING
@@ -37,6 +42,8 @@ DATA_FILES = [
 #########################################
 def connect_db():
     """Returns a new psycopg2 connection."""
+    # imported here: build_sqlite_db reuses this module's XML extraction without psycopg2
+    import psycopg2
     return psycopg2.connect(
         dbname=DB_NAME,
         user=DB_USER,
@@ -58,6 +65,7 @@ def create_tables():
             name TEXT,
             chemical_formula TEXT,
             synonyms JSONB,
+            description TEXT,
             status TEXT,
             molecular_weight_avg REAL,
             molecular_weight_monoisotopic REAL,
@@ -74,12 +82,49 @@ def create_tables():
             cellular_locations JSONB,
             biospecimen_locations JSONB,
             tissue_locations JSONB,
+            element_counts JSONB,
             creation_date TIMESTAMP NULL,
             update_date TIMESTAMP NULL,
             version TEXT
         );
     ''')
 
+    # Free-text description, embedded by semantic_index.py
+    cur.execute("ALTER TABLE metabolites ADD COLUMN IF NOT EXISTS description TEXT;")
+
+    # Parsed chemical_formula ({"C": 6, "H": 12, "O": 6}); see formula_index.py
+    # Formula queries run on the in-memory FormulaIndex, so the column is not indexed.
+    cur.execute("ALTER TABLE metabolites ADD COLUMN IF NOT EXISTS element_counts JSONB;")
+    cur.execute("DROP INDEX IF EXISTS idx_metabolites_element_counts;")
+
+    # Typo-tolerant name lookups (PostgresDBHandler.trigram_search)
+    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_metabolites_name_trgm
+            ON metabolites USING GIN (name gin_trgm_ops);
+    ''')
+
+    # Range index for MS peak annotation (PostgresDBHandler.query_by_mass)
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_metabolites_mono_mass
+            ON metabolites (molecular_weight_monoisotopic);
+    ''')
+
+    # Structure identifier lookups (PostgresDBHandler.query_by_inchikeys / query_by_inchis):
+    # full key + prefix, stereo-insensitive first block, and InChI by hash.
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_metabolites_inchikey
+            ON metabolites (inchikey text_pattern_ops);
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_metabolites_inchikey_block1
+            ON metabolites (left(inchikey, 14));
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_metabolites_inchi_md5
+            ON metabolites (md5(inchi));
+    ''')
+
     # Pathways table
     cur.execute('''
         CREATE TABLE IF NOT EXISTS pathways (
@@ -137,6 +182,15 @@ def create_tables():
         );
     ''')
 
+    # Dataset version stamp, bumped by every ingestion run. In-memory indexes
+    # (facets, mass/formula, graph, snapshots) rebuild when it changes.
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS dataset_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    ''')
+
     conn.commit()
     conn.close()
     logger.info("Tables created or verified successfully.")
@@ -148,187 +202,238 @@ def safe_text(element: Optional[ET.Element]) -> Optional[str]:
     """Returns stripped text from an XML element or None if missing."""
     return element.text.strip() if element is not None and element.text else None
 
+def safe_float(element: Optional[ET.Element]) -> Optional[float]:
+    """Returns the element text as a float, or None if missing/not numeric."""
+    try:
+        return float(safe_text(element))
+    except (TypeError, ValueError):
+        return None
+
 def extract_list_values(parent: ET.Element, child_tag: str, ns: str) -> List[str]:
     """Returns all text values from <child_tag> under 'parent' as a list."""
     return [safe_text(c) for c in parent.findall(f"{ns}{child_tag}") if safe_text(c)]
 
-def parse_hmdb_xml(xml_file: str, conn):
-    """Parses the HMDB XML file and inserts relevant data into PostgreSQL."""
+def extract_metabolite_record(elem: ET.Element, ns: str) -> dict:
+    """
+    Turns one <metabolite> element into a plain dict (metabolite columns plus
+    pathway/disease/protein lists). Storage-agnostic, so every backend loader
+    (Postgres here, SQLite in sqlite_backend.py) ingests the same records.
+    """
+    bio_root = elem.find(f"{ns}biological_properties/{ns}biospecimen_locations")
+    cell_root = elem.find(f"{ns}biological_properties/{ns}cellular_locations")
+    tissue_root = elem.find(f"{ns}biological_properties/{ns}tissue_locations")
+    syn_root = elem.find(f"{ns}synonyms")
+    tax_root = elem.find(f"{ns}taxonomy")
+    alt_root = tax_root.find(f"{ns}alternative_parents") if tax_root is not None else None
+
+    def taxonomy(tag):
+        return safe_text(tax_root.find(f"{ns}{tag}")) if tax_root is not None else None
+
+    record = {
+        "hmdb_id": safe_text(elem.find(f"{ns}accession")),
+        "name": safe_text(elem.find(f"{ns}name")),
+        "chemical_formula": safe_text(elem.find(f"{ns}chemical_formula")),
+        "molecular_weight_avg": safe_float(elem.find(f"{ns}average_molecular_weight")),
+        # (sic) HMDB spells the tag "monisotopic"
+        "molecular_weight_monoisotopic": safe_float(elem.find(f"{ns}monisotopic_molecular_weight")),
+        "smiles": safe_text(elem.find(f"{ns}smiles")),
+        "inchi": safe_text(elem.find(f"{ns}inchi")),
+        "inchikey": safe_text(elem.find(f"{ns}inchikey")),
+        "synonyms": extract_list_values(syn_root, "synonym", ns) if syn_root is not None else [],
+        "description": safe_text(elem.find(f"{ns}description")),
+        "biospecimen_locations": [safe_text(b) for b in bio_root.findall(f"{ns}biospecimen")] if bio_root is not None else [],
+        "cellular_locations": [safe_text(c) for c in cell_root.findall(f"{ns}cellular")] if cell_root is not None else [],
+        "tissue_locations": [safe_text(t) for t in tissue_root.findall(f"{ns}tissue")] if tissue_root is not None else [],
+        # ClassyFire taxonomy (<taxonomy>); taxonomy_class backs the facet of the same name
+        "taxonomy_kingdom": taxonomy("kingdom"),
+        "taxonomy_superclass": taxonomy("super_class"),
+        "taxonomy_class": taxonomy("class"),
+        "taxonomy_subclass": taxonomy("sub_class"),
+        "taxonomy_direct_parent": taxonomy("direct_parent"),
+        "taxonomy_alternative_parents": extract_list_values(alt_root, "alternative_parent", ns) if alt_root is not None else [],
+        "pathways": [],
+        "diseases": [],
+        "proteins": [],
+    }
+
+    pwy_root = elem.find(f"{ns}biological_properties/{ns}pathways")
+    if pwy_root is not None:
+        for pwy in pwy_root.findall(f"{ns}pathway"):
+            pathway_name = safe_text(pwy.find(f"{ns}name"))
+            if pathway_name:
+                record["pathways"].append((
+                    pathway_name,
+                    safe_text(pwy.find(f"{ns}kegg_map_id")),
+                    safe_text(pwy.find(f"{ns}smpdb_id")),
+                ))
+
+    dis_root = elem.find(f"{ns}diseases")
+    if dis_root is not None:
+        for disease_el in dis_root.findall(f"{ns}disease"):
+            disease_name = safe_text(disease_el.find(f"{ns}name"))
+            if disease_name:
+                record["diseases"].append((disease_name, safe_text(disease_el.find(f"{ns}references"))))
+
+    prot_root = elem.find(f"{ns}protein_associations")
+    if prot_root is not None:
+        for prot in prot_root.findall(f"{ns}protein"):
+            uniprot_id = safe_text(prot.find(f"{ns}uniprot_id"))
+            if uniprot_id:
+                record["proteins"].append((
+                    uniprot_id,
+                    safe_text(prot.find(f"{ns}name")),
+                    safe_text(prot.find(f"{ns}gene_name")),
+                ))
+
+    try:
+        record["element_counts"] = parse_formula(record["chemical_formula"])
+    except ValueError:
+        record["element_counts"] = None
+
+    return record
+
+def iter_hmdb_records(xml_file: str) -> Iterator[dict]:
+    """Streams one record dict per <metabolite> in an HMDB XML file."""
     if not os.path.exists(xml_file):
         logger.warning(f"File not found: {xml_file}")
         return
 
-    cursor = conn.cursor()
     ns = "{http://www.hmdb.ca}"
-    context = ET.iterparse(xml_file, events=("start", "end"))
-    context = iter(context)
-    event, root = next(context)
-
-    for event, elem in context:
+    for event, elem in ET.iterparse(xml_file, events=("end",)):
+        if elem.tag != f"{ns}metabolite":
+            continue
         try:
-            if event == "end" and elem.tag == f"{ns}metabolite":
-                # Parse basic metabolite info
-                hmdb_id = safe_text(elem.find(f"{ns}accession"))
-                name = safe_text(elem.find(f"{ns}name"))
-                formula = safe_text(elem.find(f"{ns}chemical_formula"))
-                smiles = safe_text(elem.find(f"{ns}smiles"))
-                inchi = safe_text(elem.find(f"{ns}inchi"))
-                inchikey = safe_text(elem.find(f"{ns}inchikey"))
-                bio_locs = extract_list_values(elem, "biospecimen_location", ns)
-                # Extract locations
-                bio_root = elem.find(f"{ns}biological_properties/{ns}biospecimen_locations")
-                bio_locs = [safe_text(b) for b in bio_root.findall(f"{ns}biospecimen")] if bio_root is not None else []
-
-                cell_root = elem.find(f"{ns}biological_properties/{ns}cellular_locations")
-                cell_locs = [safe_text(c) for c in cell_root.findall(f"{ns}cellular")] if cell_root is not None else []
-
-                tissue_root = elem.find(f"{ns}biological_properties/{ns}tissue_locations")
-                tissue_locs = [safe_text(t) for t in tissue_root.findall(f"{ns}tissue")] if tissue_root is not None else []
-
-                # Insert metabolite and get ID
-                # cursor.execute("""
-                #     INSERT INTO metabolites (hmdb_id, name, chemical_formula, smiles, inchi, inchikey, biospecimen_locations)
-                #     VALUES (%s, %s, %s, %s, %s, %s, %s)
-                #     ON CONFLICT (hmdb_id) DO NOTHING
-                #     RETURNING id
-                # """, (hmdb_id, name, formula, smiles, inchi, inchikey, json.dumps(bio_locs)))
-
-                # result = cursor.fetchone()
-                # if result is None:
-                #     cursor.execute("SELECT id FROM metabolites WHERE hmdb_id = %s", (hmdb_id,))
-                #     result = cursor.fetchone()
-
-                # if result is None:
-                #     logger.error(f"Metabolite {hmdb_id} not found/inserted")
-                #     continue
-
-                # metabolite_id = result[0]
-
-                # Insert metabolite with all location fields
-                cursor.execute("""
-                    INSERT INTO metabolites (
-                        hmdb_id, name, chemical_formula, smiles, inchi, inchikey,
-                        biospecimen_locations, cellular_locations, tissue_locations
-                    )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (hmdb_id) DO UPDATE SET
-                        name = EXCLUDED.name,
-                        chemical_formula = EXCLUDED.chemical_formula,
-                        smiles = EXCLUDED.smiles,
-                        inchi = EXCLUDED.inchi,
-                        inchikey = EXCLUDED.inchikey,
-                        biospecimen_locations = EXCLUDED.biospecimen_locations,
-                        cellular_locations = EXCLUDED.cellular_locations,
-                        tissue_locations = EXCLUDED.tissue_locations
-                    RETURNING id
-                """, (
-                    hmdb_id, name, formula, smiles, inchi, inchikey,
-                    json.dumps(bio_locs), json.dumps(cell_locs), json.dumps(tissue_locs)
-                ))
-
-                result = cursor.fetchone()
-                if result is None:
-                    cursor.execute("SELECT id FROM metabolites WHERE hmdb_id = %s", (hmdb_id,))
-                    result = cursor.fetchone()
-
-                metabolite_id = result[0] if result else None
-
-                # if bio_locs:
-                #     cursor.execute("""
-                #         UPDATE metabolites 
-                #         SET biospecimen_locations = to_jsonb(%s) 
-                #         WHERE id = %s
-                #     """, (json.dumps(bio_locs), metabolite_id))
-
-                # ✅ Pathway Insertion & Linking
-                pwy_root = elem.find(f"{ns}biological_properties/{ns}pathways")
-                if pwy_root is not None:
-                    for pwy in pwy_root.findall(f"{ns}pathway"):
-                        pathway_name = safe_text(pwy.find(f"{ns}name"))
-                        kegg_id = safe_text(pwy.find(f"{ns}kegg_map_id"))
-                        smpdb_id = safe_text(pwy.find(f"{ns}smpdb_id"))
-
-                        if pathway_name:
-                            cursor.execute("""
-                                INSERT INTO pathways (pathway_name, kegg_id, smpdb_id)
-                                VALUES (%s, %s, %s)
-                                ON CONFLICT (pathway_name, kegg_id, smpdb_id) DO NOTHING
-                                RETURNING id
-                            """, (pathway_name, kegg_id, smpdb_id))
-
-                            pathway_id = cursor.fetchone()
-                            if pathway_id is None:
-                                cursor.execute("SELECT id FROM pathways WHERE pathway_name = %s", (pathway_name,))
-                                pathway_id = cursor.fetchone()
-
-                            if pathway_id:
-                                cursor.execute("""
-                                    INSERT INTO metabolite_pathways (metabolite_id, pathway_id)
-                                    VALUES (%s, %s)
-                                    ON CONFLICT (metabolite_id, pathway_id) DO NOTHING
-                                """, (metabolite_id, pathway_id[0]))
-
-                # ✅ Disease Insertion & Linking
-                dis_root = elem.find(f"{ns}diseases")
-                if dis_root is not None:
-                    for disease_el in dis_root.findall(f"{ns}disease"):
-                        disease_name = safe_text(disease_el.find(f"{ns}name"))
-                        references = safe_text(disease_el.find(f"{ns}references"))
-
-                        if disease_name:
-                            cursor.execute("""
-                                INSERT INTO diseases (disease_name, "references")
-                                VALUES (%s, %s)
-                                ON CONFLICT (disease_name, "references") DO NOTHING
-                                RETURNING id
-                            """, (disease_name, references))
-
-                            disease_id = cursor.fetchone()
-                            if disease_id is None:
-                                cursor.execute("SELECT id FROM diseases WHERE disease_name = %s", (disease_name,))
-                                disease_id = cursor.fetchone()
-
-                            if disease_id:
-                                cursor.execute("""
-                                    INSERT INTO disease_metabolites (metabolite_id, disease_id)
-                                    VALUES (%s, %s)
-                                    ON CONFLICT (metabolite_id, disease_id) DO NOTHING
-                                """, (metabolite_id, disease_id[0]))
-
-                # ✅ Protein Insertion & Linking
-                # Improved Protein Insertion & Linking
-                prot_root = elem.find(f"{ns}protein_associations")
-                if prot_root is not None:
-                    for prot in prot_root.findall(f"{ns}protein"):
-                        uniprot_id = safe_text(prot.find(f"{ns}uniprot_id"))
-                        protein_name = safe_text(prot.find(f"{ns}name"))
-                        gene_name = safe_text(prot.find(f"{ns}gene_name"))
-
-                        if uniprot_id:
-                            # Insert protein
-                            cursor.execute("""
-                                INSERT INTO proteins (uniprot_id, protein_name, gene_name)
-                                VALUES (%s, %s, %s)
-                                ON CONFLICT (uniprot_id) DO NOTHING
-                                RETURNING id
-                            """, (uniprot_id, protein_name, gene_name))
-
-                            protein_id = cursor.fetchone()
-                            if protein_id is None:
-                                cursor.execute("SELECT id FROM proteins WHERE uniprot_id = %s", (uniprot_id,))
-                                protein_id = cursor.fetchone()
-
-                            if protein_id:
-                                # Link the current metabolite to this protein
-                                cursor.execute("""
-                                    INSERT INTO protein_metabolites (metabolite_id, protein_id)
-                                    VALUES (%s, %s)
-                                    ON CONFLICT (metabolite_id, protein_id) DO NOTHING
-                                """, (metabolite_id, protein_id[0]))
-                
-
-                elem.clear()
+            record = extract_metabolite_record(elem, ns)
+        except Exception as e:
+            logger.error(f"Error processing element: {str(e)}")
+            continue
+        finally:
+            elem.clear()
+        yield record
+
+def insert_record(cursor, record: dict):
+    """Inserts one metabolite record and its pathway/disease/protein links."""
+    # Insert metabolite with all location fields
+    cursor.execute("""
+        INSERT INTO metabolites (
+            hmdb_id, name, chemical_formula, molecular_weight_avg, molecular_weight_monoisotopic,
+            element_counts, smiles, inchi, inchikey, synonyms, description,
+            biospecimen_locations, cellular_locations, tissue_locations,
+            taxonomy_kingdom, taxonomy_superclass, taxonomy_class, taxonomy_subclass,
+            taxonomy_direct_parent, taxonomy_alternative_parents
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (hmdb_id) DO UPDATE SET
+            name = EXCLUDED.name,
+            chemical_formula = EXCLUDED.chemical_formula,
+            molecular_weight_avg = EXCLUDED.molecular_weight_avg,
+            molecular_weight_monoisotopic = EXCLUDED.molecular_weight_monoisotopic,
+            element_counts = EXCLUDED.element_counts,
+            smiles = EXCLUDED.smiles,
+            inchi = EXCLUDED.inchi,
+            inchikey = EXCLUDED.inchikey,
+            synonyms = EXCLUDED.synonyms,
+            description = EXCLUDED.description,
+            biospecimen_locations = EXCLUDED.biospecimen_locations,
+            cellular_locations = EXCLUDED.cellular_locations,
+            tissue_locations = EXCLUDED.tissue_locations,
+            taxonomy_kingdom = EXCLUDED.taxonomy_kingdom,
+            taxonomy_superclass = EXCLUDED.taxonomy_superclass,
+            taxonomy_class = EXCLUDED.taxonomy_class,
+            taxonomy_subclass = EXCLUDED.taxonomy_subclass,
+            taxonomy_direct_parent = EXCLUDED.taxonomy_direct_parent,
+            taxonomy_alternative_parents = EXCLUDED.taxonomy_alternative_parents
+        RETURNING id
+    """, (
+        record["hmdb_id"], record["name"], record["chemical_formula"],
+        record["molecular_weight_avg"], record["molecular_weight_monoisotopic"],
+        json.dumps(record["element_counts"]) if record["element_counts"] else None, record["smiles"],
+        record["inchi"], record["inchikey"], json.dumps(record["synonyms"]),
+        record["description"],
+        json.dumps(record["biospecimen_locations"]), json.dumps(record["cellular_locations"]),
+        json.dumps(record["tissue_locations"]),
+        record["taxonomy_kingdom"], record["taxonomy_superclass"], record["taxonomy_class"],
+        record["taxonomy_subclass"], record["taxonomy_direct_parent"],
+        json.dumps(record["taxonomy_alternative_parents"])
+    ))
+
+    result = cursor.fetchone()
+    if result is None:
+        cursor.execute("SELECT id FROM metabolites WHERE hmdb_id = %s", (record["hmdb_id"],))
+        result = cursor.fetchone()
+
+    metabolite_id = result[0] if result else None
+
+    # ✅ Pathway Insertion & Linking
+    for pathway_name, kegg_id, smpdb_id in record["pathways"]:
+        cursor.execute("""
+            INSERT INTO pathways (pathway_name, kegg_id, smpdb_id)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (pathway_name, kegg_id, smpdb_id) DO NOTHING
+            RETURNING id
+        """, (pathway_name, kegg_id, smpdb_id))
+
+        pathway_id = cursor.fetchone()
+        if pathway_id is None:
+            cursor.execute("SELECT id FROM pathways WHERE pathway_name = %s", (pathway_name,))
+            pathway_id = cursor.fetchone()
+
+        if pathway_id:
+            cursor.execute("""
+                INSERT INTO metabolite_pathways (metabolite_id, pathway_id)
+                VALUES (%s, %s)
+                ON CONFLICT (metabolite_id, pathway_id) DO NOTHING
+            """, (metabolite_id, pathway_id[0]))
+
+    # ✅ Disease Insertion & Linking
+    for disease_name, references in record["diseases"]:
+        cursor.execute("""
+            INSERT INTO diseases (disease_name, "references")
+            VALUES (%s, %s)
+            ON CONFLICT (disease_name, "references") DO NOTHING
+            RETURNING id
+        """, (disease_name, references))
+
+        disease_id = cursor.fetchone()
+        if disease_id is None:
+            cursor.execute("SELECT id FROM diseases WHERE disease_name = %s", (disease_name,))
+            disease_id = cursor.fetchone()
+
+        if disease_id:
+            cursor.execute("""
+                INSERT INTO disease_metabolites (metabolite_id, disease_id)
+                VALUES (%s, %s)
+                ON CONFLICT (metabolite_id, disease_id) DO NOTHING
+            """, (metabolite_id, disease_id[0]))
+
+    # ✅ Protein Insertion & Linking
+    for uniprot_id, protein_name, gene_name in record["proteins"]:
+        cursor.execute("""
+            INSERT INTO proteins (uniprot_id, protein_name, gene_name)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (uniprot_id) DO NOTHING
+            RETURNING id
+        """, (uniprot_id, protein_name, gene_name))
+
+        protein_id = cursor.fetchone()
+        if protein_id is None:
+            cursor.execute("SELECT id FROM proteins WHERE uniprot_id = %s", (uniprot_id,))
+            protein_id = cursor.fetchone()
+
+        if protein_id:
+            # Link the current metabolite to this protein
+            cursor.execute("""
+                INSERT INTO protein_metabolites (metabolite_id, protein_id)
+                VALUES (%s, %s)
+                ON CONFLICT (metabolite_id, protein_id) DO NOTHING
+            """, (metabolite_id, protein_id[0]))
 
+def parse_hmdb_xml(xml_file: str, conn):
+    """Parses the HMDB XML file and inserts relevant data into PostgreSQL."""
+    cursor = conn.cursor()
+    for record in iter_hmdb_records(xml_file):
+        try:
+            insert_record(cursor, record)
         except Exception as e:
             logger.error(f"Error processing element: {str(e)}")
             conn.rollback()
@@ -339,10 +444,58 @@ def parse_hmdb_xml(xml_file: str, conn):
 
 
 
+def make_dataset_version(data_files: List[str]) -> str:
+    """UTC ingestion time plus a digest of the input files' names, sizes and mtimes."""
+    digest = hashlib.sha1()
+    for path in data_files:
+        if os.path.exists(path):
+            st = os.stat(path)
+            digest.update(f"{os.path.basename(path)}:{st.st_size}:{int(st.st_mtime)};".encode())
+    return time.strftime("%Y%m%dT%H%M%SZ", time.gmtime()) + "-" + digest.hexdigest()[:8]
+
+def stamp_dataset_version(conn, version: str):
+    """Record the dataset version after a successful load."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO dataset_meta (key, value) VALUES ('version', %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+    """, (version,))
+    conn.commit()
+    cursor.close()
+    logger.info(f"Dataset version: {version}")
+
+
+
 #########################################
 # 4) MAIN EXECUTION
 #########################################
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest HMDB XML files into Postgres or an embedded SQLite file.")
+    parser.add_argument("--backend", choices=["postgres", "sqlite"], default="postgres",
+                        help="Storage backend to build (default: postgres)")
+    parser.add_argument("--sqlite-path", default="./data/metabolites.sqlite",
+                        help="Output file for --backend sqlite (default: ./data/metabolites.sqlite)")
+    parser.add_argument("--kb-snapshot", default="./data/kb_snapshot.bin",
+                        help="Memory-mapped snapshot rebuilt after ingestion, 'off' to skip "
+                             "(default: ./data/kb_snapshot.bin)")
+    args = parser.parse_args()
+
+    def rebuild_snapshot():
+        if args.kb_snapshot.lower() == "off":
+            return
+        from utils.kb_snapshot import build_snapshot
+        from utils.storage_backend import create_db_handler
+        handler = create_db_handler(args.backend, sqlite_path=args.sqlite_path, kb_snapshot="off",
+                                    dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+        header = build_snapshot(handler, args.kb_snapshot)
+        logger.info(f"Knowledge-base snapshot {args.kb_snapshot}: {header['counts']}")
+
+    if args.backend == "sqlite":
+        from utils.sqlite_backend import build_sqlite_db
+        build_sqlite_db(args.sqlite_path, DATA_FILES)
+        rebuild_snapshot()
+        raise SystemExit(0)
+
     logger.info("Creating tables (if needed)...")
     create_tables()
 
@@ -357,6 +510,9 @@ if __name__ == "__main__":
         conn.commit()
         cursor.close()
 
+        stamp_dataset_version(conn, make_dataset_version(DATA_FILES))
+        rebuild_snapshot()
+
     finally:
         conn.close()
         logger.info("All XML files processed successfully!")
\ No newline at end of file
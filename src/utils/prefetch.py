@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+
+def related_lookups(handler, hmdb_id):
+    """
+    (key, fetch) for the per-metabolite lookups a follow-up question usually
+    needs. Every key here is one run_llma.query_database reads through, so a
+    prefetched entry is found by the foreground query; a lookup it never
+    reads would only count as waste.
+    """
+    return [
+        (("hmdb_id", hmdb_id), lambda: handler.query_by_hmdb_id(hmdb_id)),
+        (("proteins", hmdb_id), lambda: handler.query_proteins(hmdb_id)),
+        (("concentrations", hmdb_id, "normal"), lambda: handler.query_concentrations(hmdb_id, "normal")),
+        (("concentrations", hmdb_id, "abnormal"), lambda: handler.query_concentrations(hmdb_id, "abnormal")),
+    ]
+
+
+class ResultCache:
+    """
+    Thread-safe LRU of lookup results shared by the foreground queries and
+    the Prefetcher. Entries written by the prefetcher are flagged until a
+    foreground read claims them (a prefetch hit); flagged entries evicted
+    or dropped on a dataset change unread count as waste.
+
+    A foreground read of a key that is being prefetched right now waits for
+    that fetch instead of issuing the same query a second time.
+    """
+
+    def __init__(self, max_entries=2048, dataset_version=None, version_check_interval=60.0):
+        self.max_entries = max_entries
+        self.dataset_version = dataset_version  # callable; a new version empties the cache
+        self.version_check_interval = version_check_interval
+        self.metrics = Counter()
+        self._entries = OrderedDict()  # key -> [value, prefetched]
+        self._inflight = {}  # key -> Event, for prefetches still running
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = None
+
+    def _check_version(self):
+        if self.dataset_version is None:
+            return
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.version_check_interval:
+            return
+        version = self.dataset_version()
+        with self._lock:
+            self._checked_at = now
+            if self._version is not None and version != self._version:
+                self.metrics["prefetch_wasted"] += sum(1 for _, p in self._entries.values() if p)
+                self._entries.clear()
+            self._version = version
+
+    def _store(self, key, value, prefetched):
+        # caller holds the lock
+        self._entries[key] = [value, prefetched]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            _, (_, was_prefetched) = self._entries.popitem(last=False)
+            if was_prefetched:
+                self.metrics["prefetch_wasted"] += 1
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries or key in self._inflight
+
+    def get_or_fetch(self, key, fetch, wait_s=5.0):
+        """Cached value of `key`, else fetch() (waiting for an in-flight prefetch of it first)."""
+        self._check_version()
+        with self._lock:
+            pending = self._inflight.get(key)
+        if pending is not None:
+            pending.wait(wait_s)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.metrics["hits"] += 1
+                if entry[1]:
+                    entry[1] = False
+                    self.metrics["prefetch_hits"] += 1
+                    if pending is not None:
+                        self.metrics["prefetch_hits_late"] += 1  # still running when asked for
+                return entry[0]
+            self.metrics["misses"] += 1
+        value = fetch()
+        with self._lock:
+            self._store(key, value, prefetched=False)
+        return value
+
+    def prefetch(self, key, fetch):
+        """fetch() into the cache unless the key is already there or being fetched. Returns whether it ran."""
+        with self._lock:
+            if key in self._entries or key in self._inflight:
+                return False
+            done = self._inflight[key] = threading.Event()
+        try:
+            value = fetch()
+            with self._lock:
+                self._store(key, value, prefetched=True)
+                self.metrics["prefetched"] += 1
+            return True
+        except Exception:
+            with self._lock:
+                self.metrics["prefetch_errors"] += 1
+            return False
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self):
+        with self._lock:
+            out = dict(self.metrics)
+            out["entries"] = len(self._entries)
+            out["unclaimed"] = sum(1 for _, p in self._entries.values() if p)
+        reads = out.get("hits", 0) + out.get("misses", 0)
+        prefetched = out.get("prefetched", 0)
+        out["hit_rate"] = round(out.get("hits", 0) / reads, 3) if reads else None
+        # share of prefetched results that a later question used / that were thrown away unread
+        out["prefetch_hit_rate"] = round(out.get("prefetch_hits", 0) / prefetched, 3) if prefetched else None
+        out["prefetch_waste_rate"] = round(out.get("prefetch_wasted", 0) / prefetched, 3) if prefetched else None
+        return out
+
+
+class Prefetcher:
+    """
+    Speculatively loads the related-entity profile (related_lookups) of the
+    metabolites a question resolved to into the handler's ResultCache, on a
+    small worker pool, while the LLM is busy with the answer.
+
+    Budget: at most `max_ids` metabolites per question and `max_pending`
+    lookups queued or running; anything over is dropped, not queued, so a
+    burst of questions can't pile speculative work onto the database.
+    """
+
+    def __init__(self, handler, workers=2, max_ids=3, max_pending=16, cache=None):
+        self.handler = handler
+        self.cache = cache or handler.result_cache()
+        self.max_ids = max_ids
+        self.max_pending = max_pending
+        self.metrics = Counter()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+
+    def _run(self, key, fetch):
+        try:
+            self.cache.prefetch(key, fetch)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def submit(self, hmdb_ids):
+        """Queue the related lookups of up to max_ids metabolites; returns how many were queued."""
+        queued = 0
+        seen = set()
+        for hmdb_id in hmdb_ids:
+            if not hmdb_id or hmdb_id in seen:
+                continue
+            seen.add(hmdb_id)
+            if len(seen) > self.max_ids:
+                break
+            for key, fetch in related_lookups(self.handler, hmdb_id):
+                if key in self.cache:
+                    continue
+                with self._lock:
+                    if self._pending >= self.max_pending:
+                        self.metrics["over_budget"] += 1
+                        continue
+                    self._pending += 1
+                self._pool.submit(self._run, key, fetch)
+                queued += 1
+        self.metrics["queued"] += queued
+        return queued
+
+    def snapshot(self):
+        with self._lock:
+            out = dict(self.metrics, pending=self._pending)
+        out.update(self.cache.snapshot())
+        return out
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+#######################################
+# Demo Testing
+#######################################
+if __name__ == "__main__":
+    class SlowStore:
+        """The per-metabolite lookups only, each taking 50 ms."""
+        def _slow(self, *row):
+            time.sleep(0.05)
+            return [row]
+
+        def query_by_hmdb_id(self, hmdb_id):
+            return self._slow(hmdb_id)[0]
+
+        def query_proteins(self, hmdb_id):
+            return self._slow("P31639", "SGLT2")
+
+        def query_concentrations(self, hmdb_id, ctype="normal"):
+            return self._slow(ctype, "Blood", "5.0 mM")
+
+    store, cache = SlowStore(), ResultCache()
+    prefetcher = Prefetcher(store, cache=cache, max_pending=8)
+    # turn 1 resolves glucose; the LLM would now take a few seconds
+    cache.get_or_fetch(("hmdb_id", "HMDB0000122"), lambda: store.query_by_hmdb_id("HMDB0000122"))
+    print(f"queued {prefetcher.submit(['HMDB0000122', 'HMDB0000660'])} lookups")
+    time.sleep(0.3)
+    # turn 2: "which proteins interact with it?"
+    start = time.perf_counter()
+    cache.get_or_fetch(("proteins", "HMDB0000122"), lambda: store.query_proteins("HMDB0000122"))
+    print(f"follow-up lookup {1000 * (time.perf_counter() - start):.1f} ms")
+    print(prefetcher.snapshot())
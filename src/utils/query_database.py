@@ -1,33 +1,212 @@
 #!/usr/bin/env python3
 
+import hashlib
+import os
+import sys
+import time
+import uuid
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.pool
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from utils.identifiers import group_inchikey_matches, inchikey_block, normalize_inchikey
+from utils.query_stats import QueryStats, instrumented
+from utils.storage_backend import GRAPH_EXPORTS, MetaboliteStore
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """
+    Cursor that times every execute() and records SELECTs that run past the
+    connection's slow-query threshold. Their EXPLAIN (ANALYZE, BUFFERS) plan
+    is captured by re-running the statement, which the handler does on a
+    background thread (see PostgresDBHandler._explain_later) so the slow
+    request itself does not pay for it twice.
+    """
+
+    def execute(self, query, vars=None):
+        stats = getattr(self.connection, "query_stats", None)
+        start = time.perf_counter()
+        result = super().execute(query, vars)
+        elapsed = time.perf_counter() - start
+        if stats is not None and elapsed >= stats.slow_query_threshold:
+            entry = stats.record_slow_query(query, vars, elapsed)
+            explain = getattr(self.connection, "explain", None)
+            # Named cursors only DECLARE here, and re-running writes is unsafe.
+            if stats.capture_plans and explain is not None and self.name is None and _is_read_only(query):
+                explain(entry, query, vars)
+        return result
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """
+    psycopg2 connection that carries the handler's QueryStats. Connections
+    checked out of the handler's pool go back to it when their `with` block
+    ends (plain psycopg2 only ends the transaction there).
+    """
+    query_stats = None
+    release = None
+    explain = None
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            return super().__exit__(exc_type, exc, tb)
+        finally:
+            if self.release is not None:
+                self.release(self)
+
+
+def _is_read_only(query):
+    text = query.lstrip().upper()
+    return text.startswith("SELECT") or (
+        text.startswith("WITH") and not any(w in text for w in ("UPDATE ", "INSERT ", "DELETE "))
+    )
+
 
-class PostgresDBHandler:
+class PostgresDBHandler(MetaboliteStore):
     """
     A class for fast, accurate queries of your HMDB-based Postgres schema,
     using weighted full-text search plus direct join queries.
+
+    The query_by_* methods return a small LIMIT-ed list. For exports that need
+    every matching row, use the iter_* generators (server-side cursors, rows
+    fetched `itersize` at a time) or the page_* keyset-paginated variants.
+
+    Every public method is instrumented: latency, rows, connection wait and
+    exact->fuzzy fallbacks are collected in `self.stats` (see query_stats.py),
+    and statements slower than `slow_query_ms` get their plan captured.
+
+    By default every call opens its own connection. With pool_size (or
+    open_pool()) calls share a ThreadedConnectionPool instead, and a caller
+    blocks until a connection is free; the wait shows up in conn_wait.
     """
 
     def __init__(self, dbname="metabolites_pg", user="postgres",
-                 password="your_password", host="localhost", port="5432"):
+                 password="your_password", host="localhost", port="5432",
+                 itersize=2000, stats=None, slow_query_ms=500, pool_size=None):
         self.dbname = dbname
         self.user = user
         self.password = password
         self.host = host
         self.port = port
+        self.itersize = itersize
+        self.stats = stats or QueryStats(slow_query_threshold=slow_query_ms / 1000.0)
+        self._pool = None
+        self._plan_lock = threading.Lock()
+        self._plan_worker = None
+        self._plan_pending = False
+        if pool_size:
+            self.open_pool(pool_size)
 
-    def _connect(self):
-        return psycopg2.connect(
+    def _connect_kwargs(self):
+        return dict(
             dbname=self.dbname,
             user=self.user,
             password=self.password,
             host=self.host,
-            port=self.port
+            port=self.port,
+            connection_factory=InstrumentedConnection,
+            cursor_factory=InstrumentedCursor
         )
 
+    def _connect(self):
+        start = time.perf_counter()
+        if self._pool is not None:
+            self._pool_slots.acquire()
+            try:
+                conn = self._pool.getconn()
+            except Exception:
+                self._pool_slots.release()
+                raise
+            conn.release = self._release
+        else:
+            conn = psycopg2.connect(**self._connect_kwargs())
+        conn.query_stats = self.stats
+        conn.explain = self._explain_later
+        self.stats.record_conn_wait(time.perf_counter() - start)
+        return conn
+
+    def _explain_later(self, entry, query, vars):
+        """
+        Capture the plan of a slow query into its slow-query log entry on a
+        background thread, on a connection of its own. One capture at a time:
+        slow queries arriving while one is running keep plan=None rather than
+        piling EXPLAIN ANALYZE re-runs onto an already struggling database.
+        """
+        with self._plan_lock:
+            if self._plan_pending:
+                return
+            self._plan_pending = True
+            if self._plan_worker is None:
+                self._plan_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+        self._plan_worker.submit(self._explain, entry, query, vars)
+
+    def _explain(self, entry, query, vars):
+        try:
+            conn = psycopg2.connect(**dict(self._connect_kwargs(), cursor_factory=None))
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, vars)
+                    entry["plan"] = "\n".join(r[0] for r in cur.fetchall())
+            finally:
+                conn.rollback()
+                conn.close()
+        except psycopg2.Error as e:
+            entry["plan"] = f"<EXPLAIN failed: {e}>"
+        finally:
+            with self._plan_lock:
+                self._plan_pending = False
+
+    ############################################
+    # Connection pool
+    ############################################
+    def open_pool(self, size, min_idle=1):
+        """Share up to `size` connections between threads from now on."""
+        if self._pool is not None:
+            return
+        self._pool_size = size
+        self._pool_slots = threading.BoundedSemaphore(size)
+        self._pool = psycopg2.pool.ThreadedConnectionPool(min(min_idle, size), size, **self._connect_kwargs())
+
+    def close_pool(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.closeall()
+
+    def _release(self, conn):
+        """Return a pooled connection (the pool rolls back any open transaction)."""
+        conn.release = None
+        try:
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._pool_slots.release()
+
+    def pool_status(self):
+        if self._pool is None:
+            return None
+        return {"size": self._pool_size, "in_use": len(self._pool._used), "idle": len(self._pool._pool)}
+
+    def dataset_version(self):
+        """Version stamped by the last ingestion run (dataset_meta), or None."""
+        with self._connect() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT value FROM dataset_meta WHERE key = 'version'")
+            except psycopg2.errors.UndefinedTable:
+                return None
+            row = cur.fetchone()
+            return row[0] if row else None
+
     ######################################################
     # refresh_doc_column
     ######################################################
+    @instrumented
     def refresh_doc_column(self):
         """
         Rebuild or refresh the weighted 'doc' tsvector column in 'metabolites'
@@ -86,6 +265,7 @@ class PostgresDBHandler:
     ############################################
     # FULL-TEXT SEARCH with Weighted Fields
     ############################################
+    @instrumented
     def full_text_search(self, term, limit=5):
         """
         Weighted FTS on the 'doc' column.
@@ -107,6 +287,7 @@ class PostgresDBHandler:
             if rows:
                 return rows
 
+            self.stats.record_fallback("full_text_search")
             # Fallback partial match
             query_fallback = """
                 SELECT id, hmdb_id, name
@@ -119,9 +300,32 @@ class PostgresDBHandler:
             cur.execute(query_fallback, (f"%{term}%", f"%{term}%", f"%{term}%", limit))
             return cur.fetchall()
 
+    ############################################
+    # Trigram similarity (pg_trgm, typo-tolerant name match)
+    ############################################
+    @instrumented
+    def trigram_search(self, term, limit=5, threshold=0.3):
+        """Names similar to `term` by pg_trgm similarity(), served by the GIN trigram index."""
+        with self._connect() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, true)", (str(threshold),))
+                cur.execute("""
+                    SELECT id, hmdb_id, name, similarity(name, %s) AS sim
+                      FROM metabolites
+                     WHERE name %% %s
+                     ORDER BY sim DESC, id
+                     LIMIT %s
+                """, (term, term, limit))
+            except (psycopg2.errors.UndefinedFunction, psycopg2.errors.UndefinedObject):  # pg_trgm not installed
+                self.stats.record_fallback("trigram_search")
+                return []
+            return cur.fetchall()
+
     ############################################
     # Query by Name (Exact -> partial fallback)
     ############################################
+    @instrumented
     def query_by_name(self, name, limit=5):
         with self._connect() as conn:
             cur = conn.cursor()
@@ -136,6 +340,7 @@ class PostgresDBHandler:
             if rows:
                 return rows
 
+            self.stats.record_fallback("query_by_name")
             # partial
             cur.execute("""
                 SELECT id, hmdb_id, name, chemical_formula, molecular_weight_avg, smiles
@@ -149,6 +354,7 @@ class PostgresDBHandler:
     ############################################
     # Query by Disease (Exact -> partial with synonyms)
     ############################################
+    @instrumented
     def query_by_disease(self, disease, limit=5):
         with self._connect() as conn:
             cur = conn.cursor()
@@ -165,6 +371,7 @@ class PostgresDBHandler:
             if exact:
                 return exact
 
+            self.stats.record_fallback("query_by_disease")
             # partial with potential synonym support (Note: assumes disease_synonyms table exists; adjust if not)
             cur.execute("""
                 SELECT m.id, m.hmdb_id, m.name, d.disease_name
@@ -184,6 +391,7 @@ class PostgresDBHandler:
     ############################################
     # Query by Pathway (Exact -> partial with synonyms)
     ############################################
+    @instrumented
     def query_by_pathway(self, pathway, limit=5):
         with self._connect() as conn:
             cur = conn.cursor()
@@ -200,6 +408,7 @@ class PostgresDBHandler:
             if rows:
                 return rows
 
+            self.stats.record_fallback("query_by_pathway")
             # partial with potential synonym support (Note: assumes pathway_synonyms table exists; adjust if not)
             cur.execute("""
                 SELECT m.id, m.hmdb_id, m.name, p.pathway_name
@@ -219,6 +428,7 @@ class PostgresDBHandler:
     ############################################
     # Query by Biofluid (New Method)
     ############################################
+    @instrumented
     def query_by_biofluid(self, biofluid, limit=5):
         """
         Query metabolites detected in a specific biofluid (e.g., CSF, urine).
@@ -237,6 +447,7 @@ class PostgresDBHandler:
     ############################################
     # Predicted Properties
     ############################################
+    @instrumented
     def query_predicted_properties(self, hmdb_id):
         """
         Return predicted props (logP, pKa, etc.) for HMDB ID
@@ -259,6 +470,7 @@ class PostgresDBHandler:
     ############################################
     # Concentrations
     ############################################
+    @instrumented
     def query_concentrations(self, hmdb_id, ctype='normal'):
         with self._connect() as conn:
             cur = conn.cursor()
@@ -276,6 +488,7 @@ class PostgresDBHandler:
     ############################################
     # Proteins
     ############################################
+    @instrumented
     def query_proteins(self, hmdb_id):
         with self._connect() as conn:
             cur = conn.cursor()
@@ -289,6 +502,7 @@ class PostgresDBHandler:
             """, (hmdb_id,))  # Use hmdb_id directly in query
             return cur.fetchall()
 
+    @instrumented
     def query_by_hmdb_id(self, hmdb_id):
         """
         Fetch the single metabolite record that matches exactly the given HMDB ID.
@@ -305,6 +519,459 @@ class PostgresDBHandler:
             row = cur.fetchone()
             return row  # Either (id, hmdb_id, name, formula, mol_weight, smiles) or None
 
+    ############################################
+    # Monoisotopic mass (MS peak annotation)
+    ############################################
+    @instrumented
+    def query_by_mass(self, mz, tolerance=10.0, unit="ppm", adduct="[M]", limit=5):
+        """
+        Single m/z lookup through the btree index on molecular_weight_monoisotopic,
+        closest first. For thousands of peaks use annotate_peaks() instead.
+        """
+        from utils.mass_search import mass_window
+        mass, low, high = mass_window(mz, tolerance, unit, adduct)
+        with self._connect() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT id, hmdb_id, name, chemical_formula, molecular_weight_monoisotopic,
+                       (molecular_weight_monoisotopic - %s) / %s * 1e6 AS ppm_error
+                  FROM metabolites
+                 WHERE molecular_weight_monoisotopic BETWEEN %s AND %s
+                 ORDER BY abs(molecular_weight_monoisotopic - %s)
+                 LIMIT %s
+            """, (mass, mass, low, high, mass, limit))
+            return cur.fetchall()
+
+    @instrumented
+    def iter_monoisotopic_masses(self):
+        """Stream (id, hmdb_id, name, mass) for every metabolite with a known mass."""
+        yield from self._stream("""
+                SELECT id, hmdb_id, name, molecular_weight_monoisotopic
+                  FROM metabolites
+                 WHERE molecular_weight_monoisotopic IS NOT NULL
+            """, (), "masses")
+
+    @instrumented
+    def iter_element_counts(self):
+        """Stream (id, hmdb_id, name, chemical_formula, element_counts) for the formula index."""
+        yield from self._stream("""
+                SELECT id, hmdb_id, name, chemical_formula, element_counts
+                  FROM metabolites
+                 WHERE chemical_formula IS NOT NULL
+            """, (), "element_counts")
+
+    ############################################
+    # Structure identifiers (InChIKey / InChI)
+    ############################################
+    @instrumented
+    def query_by_inchikeys(self, keys):
+        """
+        Resolve many InChIKeys (full keys or bare 14-char first blocks) in one
+        round trip through the left(inchikey, 14) index. Matching is
+        stereo-insensitive; full-key hits are flagged "exact" and come first.
+        Returns {input_key: [(id, hmdb_id, name, inchikey, match_type), ...]}.
+        """
+        keys = list(keys)
+        blocks = sorted({inchikey_block(k) for k in map(normalize_inchikey, keys) if k})
+        if not blocks:
+            return {k: [] for k in keys}
+        with self._connect() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT id, hmdb_id, name, inchikey
+                  FROM metabolites
+                 WHERE left(inchikey, 14) = ANY(%s)
+            """, (blocks,))
+            return group_inchikey_matches(keys, cur.fetchall())
+
+    @instrumented
+    def query_by_inchikey_prefix(self, prefix, limit=50):
+        """Index-backed prefix match on the full InChIKey (e.g. first block + part of the second)."""
+        prefix = prefix.strip().upper()
+        if not prefix or not all(c.isalpha() or c == "-" for c in prefix):
+            return []
+        with self._connect() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT id, hmdb_id, name, inchikey
+                  FROM metabolites
+                 WHERE inchikey LIKE %s
+                 ORDER BY inchikey
+                 LIMIT %s
+            """, (prefix + "%", limit))
+            return cur.fetchall()
+
+    @instrumented
+    def query_by_inchis(self, inchis):
+        """
+        Resolve many InChI strings at once via the md5(inchi) index.
+        Returns {inchi: [(id, hmdb_id, name, inchikey), ...]}.
+        """
+        inchis = list(inchis)
+        hashes = sorted({hashlib.md5(i.strip().encode("utf-8")).hexdigest() for i in inchis if i})
+        out = {i: [] for i in inchis}
+        if not hashes:
+            return out
+        with self._connect() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT inchi, id, hmdb_id, name, inchikey
+                  FROM metabolites
+                 WHERE md5(inchi) = ANY(%s)
+            """, (hashes,))
+            by_inchi = {}
+            for row in cur.fetchall():
+                by_inchi.setdefault(row[0], []).append(row[1:])
+        for i in inchis:
+            out[i] = by_inchi.get(i.strip(), []) if i else []
+        return out
+
+    @instrumented
+    def iter_facet_memberships(self):
+        """Stream (facet, value, metabolite_id) triples for the in-memory FacetIndex."""
+        yield from self._stream("""
+                SELECT 'biospecimen', jsonb_array_elements_text(biospecimen_locations), id
+                  FROM metabolites WHERE jsonb_typeof(biospecimen_locations) = 'array'
+                UNION ALL
+                SELECT 'tissue', jsonb_array_elements_text(tissue_locations), id
+                  FROM metabolites WHERE jsonb_typeof(tissue_locations) = 'array'
+                UNION ALL
+                SELECT 'cellular', jsonb_array_elements_text(cellular_locations), id
+                  FROM metabolites WHERE jsonb_typeof(cellular_locations) = 'array'
+                UNION ALL
+                SELECT 'taxonomy_class', taxonomy_class, id
+                  FROM metabolites WHERE taxonomy_class IS NOT NULL
+                UNION ALL
+                SELECT 'disease', d.disease_name, dm.metabolite_id
+                  FROM disease_metabolites dm JOIN diseases d ON dm.disease_id = d.id
+                UNION ALL
+                SELECT 'pathway', p.pathway_name, mp.metabolite_id
+                  FROM metabolite_pathways mp JOIN pathways p ON mp.pathway_id = p.id
+                UNION ALL
+                SELECT 'protein', p.protein_name, pm.metabolite_id
+                  FROM protein_metabolites pm JOIN proteins p ON pm.protein_id = p.id
+                UNION ALL
+                SELECT 'gene', p.gene_name, pm.metabolite_id
+                  FROM protein_metabolites pm JOIN proteins p ON pm.protein_id = p.id
+            """, (), "facets")
+
+    @instrumented
+    def iter_entity_names(self):
+        """Stream (entity_type, entity_id, canonical, surface) rows for the entity recognizer."""
+        yield from self._stream("""
+                SELECT 'metabolite', hmdb_id, name, name FROM metabolites WHERE name IS NOT NULL
+                UNION ALL
+                SELECT 'metabolite', hmdb_id, name, jsonb_array_elements_text(synonyms)
+                  FROM metabolites WHERE jsonb_typeof(synonyms) = 'array'
+                UNION ALL
+                SELECT 'disease', id::text, disease_name, disease_name FROM diseases
+                UNION ALL
+                SELECT 'pathway', id::text, pathway_name, pathway_name FROM pathways
+                UNION ALL
+                SELECT 'protein', uniprot_id, protein_name, protein_name
+                  FROM proteins WHERE protein_name IS NOT NULL
+                UNION ALL
+                SELECT 'protein', uniprot_id, protein_name, gene_name
+                  FROM proteins WHERE gene_name IS NOT NULL
+                UNION ALL
+                SELECT DISTINCT 'biofluid', b, b, b
+                  FROM metabolites, jsonb_array_elements_text(biospecimen_locations) b
+                 WHERE jsonb_typeof(biospecimen_locations) = 'array'
+            """, (), "entities")
+
+    @instrumented
+    def iter_embedding_documents(self):
+        """Stream (id, hmdb_id, name, description, diseases, pathways) for semantic_index.py."""
+        yield from self._stream("""
+                SELECT m.id, m.hmdb_id, m.name, m.description,
+                       (SELECT string_agg(d.disease_name, '; ')
+                          FROM disease_metabolites dm JOIN diseases d ON dm.disease_id = d.id
+                         WHERE dm.metabolite_id = m.id),
+                       (SELECT string_agg(p.pathway_name, '; ')
+                          FROM metabolite_pathways mp JOIN pathways p ON mp.pathway_id = p.id
+                         WHERE mp.metabolite_id = m.id)
+                  FROM metabolites m
+                 ORDER BY m.id
+            """, (), "embedding_documents")
+
+    @instrumented
+    def iter_graph_rows(self, kind):
+        """Stream one node or link table for the Neo4j sync (GRAPH_EXPORTS in storage_backend.py)."""
+        yield from self._stream(GRAPH_EXPORTS[kind], (), f"graph_{kind}")
+
+    ############################################
+    # Streaming (server-side cursors)
+    ############################################
+    def _stream(self, sql, params, label):
+        """
+        Run `sql` on a named (server-side) cursor and yield rows one by one.
+        Postgres keeps the result set; the client only holds `itersize` rows
+        at a time, so memory stays flat no matter how many rows match.
+        """
+        conn = self._connect()
+        try:
+            cur = conn.cursor(name=f"{label}_{uuid.uuid4().hex[:12]}")
+            cur.itersize = self.itersize
+            cur.execute(sql, params)
+            for row in cur:
+                yield row
+            cur.close()
+        finally:
+            # read-only: closing (or returning to the pool) rolls back the cursor's transaction
+            if conn.release is not None:
+                conn.release(conn)
+            else:
+                conn.close()
+
+    @instrumented
+    def iter_full_text_search(self, term):
+        """
+        Streaming variant of full_text_search (no LIMIT), ordered by rank.
+        Falls back to the ILIKE match only if FTS yields nothing.
+        """
+        found = False
+        for row in self._stream("""
+                SELECT id, hmdb_id, name,
+                       ts_rank_cd(doc, websearch_to_tsquery('english', %s)) AS rank
+                  FROM metabolites
+                 WHERE doc @@ websearch_to_tsquery('english', %s)
+                 ORDER BY rank DESC, id
+            """, (term, term), "fts"):
+            found = True
+            yield row
+        if found:
+            return
+
+        self.stats.record_fallback("iter_full_text_search")
+        yield from self._stream("""
+                SELECT id, hmdb_id, name
+                  FROM metabolites
+                 WHERE name ILIKE %s
+                    OR synonyms::text ILIKE %s
+                    OR biospecimen_locations::text ILIKE %s
+            """, (f"%{term}%", f"%{term}%", f"%{term}%"), "fts_fallback")
+
+    @instrumented
+    def iter_by_disease(self, disease):
+        """Streaming variant of query_by_disease (exact -> partial)."""
+        found = False
+        for row in self._stream("""
+                SELECT m.id, m.hmdb_id, m.name, d.disease_name
+                  FROM disease_metabolites dm
+                  JOIN diseases d ON dm.disease_id = d.id
+                  JOIN metabolites m ON dm.metabolite_id = m.id
+                 WHERE lower(d.disease_name) = lower(%s)
+            """, (disease,), "disease"):
+            found = True
+            yield row
+        if found:
+            return
+
+        self.stats.record_fallback("iter_by_disease")
+        yield from self._stream("""
+                SELECT m.id, m.hmdb_id, m.name, d.disease_name
+                  FROM disease_metabolites dm
+                  JOIN diseases d ON dm.disease_id = d.id
+                  JOIN metabolites m ON dm.metabolite_id = m.id
+                 WHERE d.disease_name ILIKE %s
+                    OR EXISTS (
+                        SELECT 1 FROM disease_synonyms ds
+                        WHERE ds.disease_name = d.disease_name
+                        AND ds.synonym ILIKE %s
+                    )
+            """, (f"%{disease}%", f"%{disease}%"), "disease_partial")
+
+    @instrumented
+    def iter_by_pathway(self, pathway):
+        """Streaming variant of query_by_pathway (exact -> partial)."""
+        found = False
+        for row in self._stream("""
+                SELECT m.id, m.hmdb_id, m.name, p.pathway_name
+                  FROM metabolite_pathways mp
+                  JOIN pathways p ON mp.pathway_id = p.id
+                  JOIN metabolites m ON mp.metabolite_id = m.id
+                 WHERE lower(p.pathway_name) = lower(%s)
+            """, (pathway,), "pathway"):
+            found = True
+            yield row
+        if found:
+            return
+
+        self.stats.record_fallback("iter_by_pathway")
+        yield from self._stream("""
+                SELECT m.id, m.hmdb_id, m.name, p.pathway_name
+                  FROM metabolite_pathways mp
+                  JOIN pathways p ON mp.pathway_id = p.id
+                  JOIN metabolites m ON mp.metabolite_id = m.id
+                 WHERE p.pathway_name ILIKE %s
+                    OR EXISTS (
+                        SELECT 1 FROM pathway_synonyms ps
+                        WHERE ps.pathway_name = p.pathway_name
+                        AND ps.synonym ILIKE %s
+                    )
+            """, (f"%{pathway}%", f"%{pathway}%"), "pathway_partial")
+
+    @instrumented
+    def iter_by_biofluid(self, biofluid):
+        """Streaming variant of query_by_biofluid."""
+        yield from self._stream("""
+                SELECT id, hmdb_id, name, biospecimen_locations
+                  FROM metabolites
+                 WHERE biospecimen_locations @> to_jsonb(ARRAY[%s]::text[])
+            """, (biofluid,), "biofluid")
+
+    ############################################
+    # Keyset pagination
+    ############################################
+    # Each page_* method returns (rows, next_key). Pass next_key back as
+    # `after` to get the following page; next_key is None on the last page.
+    # Keys are opaque tuples that also remember whether the exact or the
+    # partial match was used, so later pages never re-check.
+    def _fetch_page(self, sql, params):
+        with self._connect() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            return cur.fetchall()
+
+    @instrumented
+    def page_full_text_search(self, term, after=None, page_size=1000):
+        """Keyset pages of full_text_search, ordered by (rank DESC, id)."""
+        if after is None or after[0] == "fts":
+            last_rank, last_id = (None, 0) if after is None else after[1:]
+            rows = self._fetch_page("""
+                SELECT id, hmdb_id, name, rank
+                  FROM (
+                    SELECT id, hmdb_id, name,
+                           ts_rank_cd(doc, websearch_to_tsquery('english', %s)) AS rank
+                      FROM metabolites
+                     WHERE doc @@ websearch_to_tsquery('english', %s)
+                  ) hits
+                 WHERE %s IS NULL
+                    OR rank < %s
+                    OR (rank = %s AND id > %s)
+                 ORDER BY rank DESC, id
+                 LIMIT %s
+            """, (term, term, last_rank, last_rank, last_rank, last_id, page_size))
+            if rows or after is not None:
+                next_key = ("fts", rows[-1][3], rows[-1][0]) if len(rows) == page_size else None
+                return rows, next_key
+
+        if after is None:
+            self.stats.record_fallback("page_full_text_search")
+        last_id = 0 if after is None else after[1]
+        rows = self._fetch_page("""
+            SELECT id, hmdb_id, name
+              FROM metabolites
+             WHERE (name ILIKE %s
+                    OR synonyms::text ILIKE %s
+                    OR biospecimen_locations::text ILIKE %s)
+               AND id > %s
+             ORDER BY id
+             LIMIT %s
+        """, (f"%{term}%", f"%{term}%", f"%{term}%", last_id, page_size))
+        next_key = ("fallback", rows[-1][0]) if len(rows) == page_size else None
+        return rows, next_key
+
+    @instrumented
+    def page_by_disease(self, disease, after=None, page_size=1000):
+        """Keyset pages of query_by_disease, ordered by (metabolite id, disease id)."""
+        if after is None or after[0] == "exact":
+            last = (0, 0) if after is None else after[1:]
+            rows = self._fetch_page("""
+                SELECT m.id, m.hmdb_id, m.name, d.disease_name, d.id
+                  FROM disease_metabolites dm
+                  JOIN diseases d ON dm.disease_id = d.id
+                  JOIN metabolites m ON dm.metabolite_id = m.id
+                 WHERE lower(d.disease_name) = lower(%s)
+                   AND (m.id, d.id) > (%s, %s)
+                 ORDER BY m.id, d.id
+                 LIMIT %s
+            """, (disease, last[0], last[1], page_size))
+            if rows or after is not None:
+                return self._keyset_result(rows, page_size, "exact")
+
+        if after is None:
+            self.stats.record_fallback("page_by_disease")
+        last = (0, 0) if after is None else after[1:]
+        rows = self._fetch_page("""
+            SELECT m.id, m.hmdb_id, m.name, d.disease_name, d.id
+              FROM disease_metabolites dm
+              JOIN diseases d ON dm.disease_id = d.id
+              JOIN metabolites m ON dm.metabolite_id = m.id
+             WHERE (d.disease_name ILIKE %s
+                    OR EXISTS (
+                        SELECT 1 FROM disease_synonyms ds
+                        WHERE ds.disease_name = d.disease_name
+                        AND ds.synonym ILIKE %s
+                    ))
+               AND (m.id, d.id) > (%s, %s)
+             ORDER BY m.id, d.id
+             LIMIT %s
+        """, (f"%{disease}%", f"%{disease}%", last[0], last[1], page_size))
+        return self._keyset_result(rows, page_size, "partial")
+
+    @instrumented
+    def page_by_pathway(self, pathway, after=None, page_size=1000):
+        """Keyset pages of query_by_pathway, ordered by (metabolite id, pathway id)."""
+        if after is None or after[0] == "exact":
+            last = (0, 0) if after is None else after[1:]
+            rows = self._fetch_page("""
+                SELECT m.id, m.hmdb_id, m.name, p.pathway_name, p.id
+                  FROM metabolite_pathways mp
+                  JOIN pathways p ON mp.pathway_id = p.id
+                  JOIN metabolites m ON mp.metabolite_id = m.id
+                 WHERE lower(p.pathway_name) = lower(%s)
+                   AND (m.id, p.id) > (%s, %s)
+                 ORDER BY m.id, p.id
+                 LIMIT %s
+            """, (pathway, last[0], last[1], page_size))
+            if rows or after is not None:
+                return self._keyset_result(rows, page_size, "exact")
+
+        if after is None:
+            self.stats.record_fallback("page_by_pathway")
+        last = (0, 0) if after is None else after[1:]
+        rows = self._fetch_page("""
+            SELECT m.id, m.hmdb_id, m.name, p.pathway_name, p.id
+              FROM metabolite_pathways mp
+              JOIN pathways p ON mp.pathway_id = p.id
+              JOIN metabolites m ON mp.metabolite_id = m.id
+             WHERE (p.pathway_name ILIKE %s
+                    OR EXISTS (
+                        SELECT 1 FROM pathway_synonyms ps
+                        WHERE ps.pathway_name = p.pathway_name
+                        AND ps.synonym ILIKE %s
+                    ))
+               AND (m.id, p.id) > (%s, %s)
+             ORDER BY m.id, p.id
+             LIMIT %s
+        """, (f"%{pathway}%", f"%{pathway}%", last[0], last[1], page_size))
+        return self._keyset_result(rows, page_size, "partial")
+
+    @instrumented
+    def page_by_biofluid(self, biofluid, after=None, page_size=1000):
+        """Keyset pages of query_by_biofluid, ordered by metabolite id."""
+        last_id = 0 if after is None else after[1]
+        rows = self._fetch_page("""
+            SELECT id, hmdb_id, name, biospecimen_locations
+              FROM metabolites
+             WHERE biospecimen_locations @> to_jsonb(ARRAY[%s]::text[])
+               AND id > %s
+             ORDER BY id
+             LIMIT %s
+        """, (biofluid, last_id, page_size))
+        next_key = ("biofluid", rows[-1][0]) if len(rows) == page_size else None
+        return rows, next_key
+
+    @staticmethod
+    def _keyset_result(rows, page_size, mode):
+        """
+        Strip the trailing link-table id (only selected for the keyset) and
+        build the next key from the last row.
+        """
+        next_key = (mode, rows[-1][0], rows[-1][-1]) if len(rows) == page_size else None
+        return [r[:-1] for r in rows], next_key
+
 #######################################
 # Demo Testing
 #######################################
@@ -366,4 +1033,18 @@ if __name__ == "__main__":
     prots = db.query_proteins("HMDB0000001")
     print("Proteins =>", len(prots))
     for pr in prots[:3]:
-        print("  ", pr)
\ No newline at end of file
+        print("  ", pr)
+
+    print("\n=== Streaming / Keyset Pages ===")
+    n_urine = sum(1 for _ in db.iter_by_biofluid("Urine"))
+    print("All urine metabolites (streamed) =>", n_urine)
+    page, key = db.page_by_pathway("glycolysis", page_size=100)
+    n_pages = 1
+    while key is not None:
+        page, key = db.page_by_pathway("glycolysis", after=key, page_size=100)
+        n_pages += 1
+    print("Glycolysis pathway pages of 100 =>", n_pages)
+    print("\n=== Query Stats ===")
+    print(db.stats.to_prometheus())
+    for slow in db.stats.slow_queries():
+        print(f"[slow {slow['seconds']:.3f}s in {slow['method']}]\n{slow['plan']}")
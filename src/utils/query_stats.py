@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+import functools
+import inspect
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Latency histogram buckets (seconds), Prometheus-style upper bounds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _MethodStats:
+    def __init__(self, buckets):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.rows = 0
+        self.conn_waits = 0
+        self.conn_wait_seconds = 0.0
+        self.fallbacks = 0
+        self.slow_queries = 0
+        self.bucket_counts = [0] * len(buckets)
+        self.recent = deque(maxlen=1024)  # recent latencies for percentiles
+
+
+class QueryStats:
+    """
+    Per-method latency histograms, row counts, connection wait time and
+    exact->fuzzy fallback counts for a DB handler, plus the EXPLAIN plans of
+    queries slower than `slow_query_threshold` seconds.
+
+    Read it back with snapshot() (plain dict) or to_prometheus() (text
+    exposition format).
+    """
+
+    def __init__(self, slow_query_threshold=0.5, capture_plans=True,
+                 buckets=DEFAULT_BUCKETS, max_slow_queries=100):
+        self.slow_query_threshold = slow_query_threshold
+        self.capture_plans = capture_plans
+        self.buckets = tuple(buckets)
+        self._methods = defaultdict(lambda: _MethodStats(self.buckets))
+        self._slow = deque(maxlen=max_slow_queries)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    ############################################
+    # Recording
+    ############################################
+    @property
+    def current_method(self):
+        """Name of the handler method running on this thread, if any."""
+        return getattr(self._local, "method", None)
+
+    @contextmanager
+    def method_scope(self, name):
+        previous = self.current_method
+        self._local.method = name
+        try:
+            yield
+        finally:
+            self._local.method = previous
+
+    def record_call(self, method, seconds, rows, error=False):
+        with self._lock:
+            m = self._methods[method]
+            m.calls += 1
+            m.errors += int(error)
+            m.total_seconds += seconds
+            m.rows += rows
+            m.recent.append(seconds)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    m.bucket_counts[i] += 1
+                    break
+
+    def record_conn_wait(self, seconds, method=None):
+        method = method or self.current_method or "<unknown>"
+        with self._lock:
+            m = self._methods[method]
+            m.conn_waits += 1
+            m.conn_wait_seconds += seconds
+
+    def record_fallback(self, method):
+        """Count an exact-match attempt that fell through to a fuzzy query."""
+        with self._lock:
+            self._methods[method].fallbacks += 1
+
+    def record_slow_query(self, sql, params, seconds, plan=None, method=None):
+        """Log a slow query; returns its entry, whose "plan" may be filled in later."""
+        method = method or self.current_method or "<unknown>"
+        entry = {
+            "method": method,
+            "seconds": seconds,
+            "sql": " ".join(sql.split()),
+            "params": params,
+            "plan": plan,
+            "at": time.time(),
+        }
+        with self._lock:
+            self._methods[method].slow_queries += 1
+            self._slow.append(entry)
+        return entry
+
+    def reset(self):
+        with self._lock:
+            self._methods.clear()
+            self._slow.clear()
+
+    ############################################
+    # Reporting
+    ############################################
+    def slow_queries(self):
+        """Most recent slow queries (oldest first), with their captured plans."""
+        with self._lock:
+            return list(self._slow)
+
+    def snapshot(self):
+        """Return {method: {...}} with counts, totals and latency percentiles."""
+        with self._lock:
+            out = {}
+            for name, m in self._methods.items():
+                recent = sorted(m.recent)
+                out[name] = {
+                    "calls": m.calls,
+                    "errors": m.errors,
+                    "rows": m.rows,
+                    "total_seconds": m.total_seconds,
+                    "mean_seconds": m.total_seconds / m.calls if m.calls else 0.0,
+                    "p50_seconds": _percentile(recent, 0.50),
+                    "p95_seconds": _percentile(recent, 0.95),
+                    "p99_seconds": _percentile(recent, 0.99),
+                    "conn_waits": m.conn_waits,
+                    "conn_wait_seconds": m.conn_wait_seconds,
+                    "fallbacks": m.fallbacks,
+                    "slow_queries": m.slow_queries,
+                    "histogram": dict(zip(self.buckets, m.bucket_counts)),
+                }
+            return out
+
+    def to_prometheus(self, prefix="metabochat_db"):
+        """Render all counters in the Prometheus text exposition format."""
+        with self._lock:
+            items = sorted(self._methods.items())
+            lines = [
+                f"# HELP {prefix}_query_duration_seconds Handler method latency.",
+                f"# TYPE {prefix}_query_duration_seconds histogram",
+            ]
+            for name, m in items:
+                cumulative = 0
+                for bound, count in zip(self.buckets, m.bucket_counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_query_duration_seconds_bucket{{method="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_query_duration_seconds_bucket{{method="{name}",le="+Inf"}} {m.calls}')
+                lines.append(f'{prefix}_query_duration_seconds_sum{{method="{name}"}} {m.total_seconds:.6f}')
+                lines.append(f'{prefix}_query_duration_seconds_count{{method="{name}"}} {m.calls}')
+
+            counters = [
+                ("query_errors_total", "Handler calls that raised.", lambda m: m.errors),
+                ("query_rows_total", "Rows returned by handler calls.", lambda m: m.rows),
+                ("connection_waits_total", "Connections opened.", lambda m: m.conn_waits),
+                ("connection_wait_seconds_total", "Time spent waiting for a connection.",
+                 lambda m: f"{m.conn_wait_seconds:.6f}"),
+                ("fallbacks_total", "Exact matches that fell through to a fuzzy query.", lambda m: m.fallbacks),
+                ("slow_queries_total", "Statements slower than the slow-query threshold.", lambda m: m.slow_queries),
+            ]
+            for metric, help_text, value in counters:
+                lines.append(f"# HELP {prefix}_{metric} {help_text}")
+                lines.append(f"# TYPE {prefix}_{metric} counter")
+                for name, m in items:
+                    lines.append(f'{prefix}_{metric}{{method="{name}"}} {value(m)}')
+            return "\n".join(lines) + "\n"
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def _count_rows(result):
+    """Best-effort row count for whatever a handler method returned."""
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict):
+        return sum(len(v) for v in result.values())  # batch lookups keyed by input
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])  # (rows, next_key) from the page_* methods
+    return 1
+
+
+def instrumented(func):
+    """
+    Decorator for handler methods: times the call, counts rows and errors
+    into `self.stats`, and marks the method as current so connection wait
+    and slow-query capture are attributed to it. Generator methods are timed
+    from first to last row.
+    """
+    name = func.__name__
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def gen_wrapper(self, *args, **kwargs):
+            stats = self.stats
+            start = time.perf_counter()
+            rows = 0
+            error = False
+            gen = func(self, *args, **kwargs)
+            try:
+                while True:
+                    with stats.method_scope(name):
+                        try:
+                            row = next(gen)
+                        except StopIteration:
+                            return
+                    rows += 1
+                    yield row
+            except GeneratorExit:
+                raise  # consumer stopped early; not an error
+            except BaseException:
+                error = True
+                raise
+            finally:
+                gen.close()
+                stats.record_call(name, time.perf_counter() - start, rows, error=error)
+        return gen_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        stats = self.stats
+        start = time.perf_counter()
+        with stats.method_scope(name):
+            try:
+                result = func(self, *args, **kwargs)
+            except Exception:
+                stats.record_call(name, time.perf_counter() - start, 0, error=True)
+                raise
+        stats.record_call(name, time.perf_counter() - start, _count_rows(result))
+        return result
+    return wrapper
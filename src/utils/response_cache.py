@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    system_hash TEXT NOT NULL,
+    context_hash TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    response TEXT NOT NULL,
+    dataset_version TEXT,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL,
+    embedding BLOB
+);
+CREATE INDEX IF NOT EXISTS idx_responses_lru ON responses (last_access);
+CREATE INDEX IF NOT EXISTS idx_responses_bucket ON responses (model, system_hash, context_hash);
+CREATE TABLE IF NOT EXISTS cache_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def normalize_prompt(prompt):
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a question."""
+    text = re.sub(r"\s+", " ", (prompt or "").strip().lower())
+    return text.rstrip(" ?!.")
+
+
+def _sha(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk LLM answer cache (one SQLite file), keyed by
+    (model_id, system prompt, normalized user prompt, DB-context hash).
+
+    - Size-bounded: once the stored responses exceed max_bytes, the least
+      recently used entries are evicted down to 90% of the limit.
+    - Dataset-aware: entries carry the dataset_version they were answered
+      against; a different version drops the stale ones. `dataset_version`
+      may be a callable (e.g. db_handler.dataset_version), re-checked at
+      most every version_check_interval seconds.
+    - Optional semantic tier: with an `embedder` (texts -> unit vectors),
+      a miss falls back to the most similar cached question in the same
+      (model, system prompt, DB context) bucket when the cosine similarity
+      is at least `similarity_threshold`.
+    """
+
+    version_check_interval = 60.0
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, dataset_version=None,
+                 embedder=None, similarity_threshold=0.92):
+        self.path = path
+        self._version_source = dataset_version if callable(dataset_version) else None
+        self._version_checked = time.monotonic()
+        self.max_bytes = max_bytes
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+        self.hits = self.semantic_hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self.dataset_version = None
+        self.set_dataset_version(dataset_version() if self._version_source else dataset_version)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def make_key(model, system, prompt, context):
+        return _sha("\0".join((model, _sha(system), normalize_prompt(prompt), _sha(context))))
+
+    def set_dataset_version(self, version):
+        """Drop entries answered against another dataset version."""
+        with self._lock:
+            self.dataset_version = version
+            if version is None:
+                return
+            self._conn.execute("DELETE FROM responses WHERE dataset_version IS NOT ?", (version,))
+            self._conn.execute("INSERT OR REPLACE INTO cache_meta (key, value) VALUES ('dataset_version', ?)",
+                               (version,))
+            self._conn.commit()
+
+    def _check_version(self):
+        now = time.monotonic()
+        if self._version_source is None or now - self._version_checked < self.version_check_interval:
+            return
+        self._version_checked = now
+        version = self._version_source()
+        if version != self.dataset_version:
+            self.set_dataset_version(version)
+
+    ############################################
+    # Lookup / store
+    ############################################
+    def get(self, model, system, prompt, context):
+        """Cached response (str) or None. Exact key first, then the semantic tier."""
+        self._check_version()
+        key = self.make_key(model, system, prompt, context)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+                self.hits += 1
+                return row[0]
+        if self.embedder is not None:
+            hit = self._nearest(model, system, prompt, context)
+            if hit is not None:
+                with self._lock:
+                    self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, hit[0]))
+                    self._conn.commit()
+                self.semantic_hits += 1
+                return hit[1]
+        self.misses += 1
+        return None
+
+    def _embed(self, prompt):
+        return np.asarray(self.embedder([normalize_prompt(prompt)])[0], dtype=np.float32)
+
+    def _nearest(self, model, system, prompt, context):
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT key, response, embedding FROM responses
+                 WHERE model = ? AND system_hash = ? AND context_hash = ? AND embedding IS NOT NULL
+            """, (model, _sha(system), _sha(context))).fetchall()
+        if not rows:
+            return None
+        query = self._embed(prompt)
+        matrix = np.stack([np.frombuffer(r[2], dtype=np.float32) for r in rows])
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        return rows[best][:2] if scores[best] >= self.similarity_threshold else None
+
+    def put(self, model, system, prompt, context, response):
+        key = self.make_key(model, system, prompt, context)
+        embedding = self._embed(prompt).tobytes() if self.embedder is not None else None
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""
+                INSERT OR REPLACE INTO responses
+                    (key, model, system_hash, context_hash, prompt, response, dataset_version,
+                     size, created, last_access, embedding)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (key, model, _sha(system), _sha(context), normalize_prompt(prompt), response,
+                  self.dataset_version, len(response.encode("utf-8")) + len(prompt), now, now, embedding))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = total - int(0.9 * self.max_bytes)
+        freed = 0
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            doomed.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"entries": entries, "bytes": size, "hits": self.hits,
+                "semantic_hits": self.semantic_hits, "misses": self.misses}
+
+
+#######################################
+# Demo Testing
+#######################################
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), "cache.sqlite")
+    cache = ResponseCache(path, max_bytes=2000, dataset_version="v1")
+    cache.put("m", "sys", "What is glucose?", "ctx", "A sugar.")
+    print(cache.get("m", "sys", "  what is GLUCOSE ", "ctx"), cache.get("m", "sys", "What is glucose?", "other ctx"))
+    for i in range(100):
+        cache.put("m", "sys", f"q{i}", "ctx", "x" * 100)
+    print(cache.stats())
+    cache.set_dataset_version("v2")
+    print(cache.stats())
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+import time
+from functools import lru_cache
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+VECTORS_FILE = "embeddings.f16"
+META_FILE = "meta.json"
+ROWS_FILE = "rows.npz"
+IVF_FILE = "ivf.npz"
+
+
+def document_text(name, description, diseases, pathways, max_chars=2000):
+    """The text embedded for one metabolite: name first, then description and context."""
+    parts = [name or ""]
+    if description:
+        parts.append(description)
+    if diseases:
+        parts.append(f"Associated diseases: {diseases}.")
+    if pathways:
+        parts.append(f"Pathways: {pathways}.")
+    return " ".join(parts)[:max_chars]
+
+
+############################################
+# Encoder (transformers + torch, CPU)
+############################################
+class TextEmbedder:
+    """Mean-pooled, L2-normalized sentence embeddings from a small encoder on CPU."""
+
+    def __init__(self, model_name=DEFAULT_MODEL, max_length=256):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self._torch = torch
+        self.model_name = model_name
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+
+    def encode(self, texts, batch_size=32):
+        torch = self._torch
+        out = []
+        with torch.inference_mode():
+            for i in range(0, len(texts), batch_size):
+                batch = self.tokenizer(texts[i:i + batch_size], padding=True, truncation=True,
+                                       max_length=self.max_length, return_tensors="pt")
+                hidden = self.model(**batch).last_hidden_state
+                mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+                out.append(torch.nn.functional.normalize(pooled, dim=1).numpy())
+        return np.concatenate(out).astype(np.float32) if out else np.zeros((0, 0), dtype=np.float32)
+
+
+@lru_cache(maxsize=2)
+def get_embedder(model_name=DEFAULT_MODEL):
+    """One loaded model per process; reloading a SemanticIndex reuses it."""
+    return TextEmbedder(model_name)
+
+
+############################################
+# IVF (coarse k-means partition)
+############################################
+def kmeans(vectors, k, iters=15, sample=50_000, seed=0):
+    """Spherical k-means on a sample of unit vectors. Returns (k, d) unit centroids."""
+    rng = np.random.default_rng(seed)
+    x = vectors[rng.choice(len(vectors), min(sample, len(vectors)), replace=False)].astype(np.float32)
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        empty = np.bincount(assign, minlength=k) == 0
+        sums[empty] = x[rng.choice(len(x), int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-9)
+    return centroids
+
+
+def build_ivf(vectors, nlist=None, chunk=65_536):
+    """Centroids plus CSR inverted lists (list_ptr, list_rows) over `vectors`."""
+    n = len(vectors)
+    nlist = nlist or max(1, min(n, int(4 * np.sqrt(n))))
+    centroids = kmeans(vectors, nlist)
+    assign = np.empty(n, dtype=np.int32)
+    for i in range(0, n, chunk):
+        assign[i:i + chunk] = np.argmax(vectors[i:i + chunk].astype(np.float32) @ centroids.T, axis=1)
+    list_rows = np.argsort(assign, kind="stable").astype(np.int32)
+    list_ptr = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assign, minlength=nlist), out=list_ptr[1:])
+    return centroids, list_ptr, list_rows
+
+
+############################################
+# Offline build
+############################################
+def build_index(db_handler, out_dir, model_name=DEFAULT_MODEL, batch_size=64, nlist=None, ivf=True):
+    """
+    Embed every metabolite (db_handler.iter_embedding_documents()) and write
+    a float16 row matrix streamed to disk, the row -> metabolite mapping and
+    optionally an IVF partition. Returns the number of rows.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    embedder = get_embedder(model_name)
+    ids, hmdb_ids, names = [], [], []
+    dim = None
+
+    def flush(texts, f):
+        vecs = embedder.encode(texts, batch_size=batch_size)
+        f.write(vecs.astype(np.float16).tobytes())
+        return vecs.shape[1]
+
+    tmp = os.path.join(out_dir, VECTORS_FILE + ".tmp")
+    with open(tmp, "wb") as f:
+        texts = []
+        for mid, hmdb_id, name, description, diseases, pathways in db_handler.iter_embedding_documents():
+            ids.append(mid)
+            hmdb_ids.append(hmdb_id)
+            names.append(name or "")
+            texts.append(document_text(name, description, diseases, pathways))
+            if len(texts) >= 1024:
+                dim = flush(texts, f)
+                texts = []
+                print(f"  embedded {len(ids)} metabolites")
+        if texts:
+            dim = flush(texts, f)
+    os.replace(tmp, os.path.join(out_dir, VECTORS_FILE))
+
+    np.savez(os.path.join(out_dir, ROWS_FILE), ids=np.asarray(ids, dtype=np.int64),
+             hmdb_ids=np.asarray(hmdb_ids, dtype=str), names=np.asarray(names, dtype=str))
+    if ivf and ids:
+        vectors = np.memmap(os.path.join(out_dir, VECTORS_FILE), dtype=np.float16, mode="r", shape=(len(ids), dim))
+        centroids, list_ptr, list_rows = build_ivf(vectors, nlist)
+        np.savez(os.path.join(out_dir, IVF_FILE), centroids=centroids, list_ptr=list_ptr, list_rows=list_rows)
+    with open(os.path.join(out_dir, META_FILE), "w") as f:
+        json.dump({"model": model_name, "dim": dim, "rows": len(ids),
+                   "dataset_version": db_handler.dataset_version()}, f)
+    return len(ids)
+
+
+############################################
+# Query-time index
+############################################
+class SemanticIndex:
+    """
+    Memory-mapped float16 embeddings with two search modes:
+
+      exact - brute-force dot product. The matrix is upcast to float32 once
+              on first use (rows x dim x 4 bytes of RAM), since NumPy has no
+              BLAS path for float16.
+      ivf   - score the centroids, then only the rows of the `nprobe`
+              nearest lists, gathered straight from the memmap.
+
+    mode="auto" uses ivf when the partition was built, exact otherwise.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.version = self.meta.get("dataset_version")
+        rows = np.load(os.path.join(path, ROWS_FILE))
+        self.ids, self.hmdb_ids, self.names = rows["ids"], rows["hmdb_ids"], rows["names"]
+        self.vectors = np.memmap(os.path.join(path, VECTORS_FILE), dtype=np.float16, mode="r",
+                                 shape=(self.meta["rows"], self.meta["dim"]))
+        self._dense = None
+        self.centroids = self.list_ptr = self.list_rows = None
+        ivf_path = os.path.join(path, IVF_FILE)
+        if os.path.exists(ivf_path):
+            ivf = np.load(ivf_path)
+            self.centroids, self.list_ptr, self.list_rows = ivf["centroids"], ivf["list_ptr"], ivf["list_rows"]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _top_k(scores, k):
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.array([], dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def search_vector(self, query, k=5, mode="auto", nprobe=16):
+        """(row indexes, cosine scores) of the k nearest rows to a unit query vector."""
+        query = np.asarray(query, dtype=np.float32)
+        if mode == "auto":
+            mode = "ivf" if self.centroids is not None else "exact"
+        if mode == "exact":
+            if self._dense is None:
+                self._dense = np.asarray(self.vectors, dtype=np.float32)
+            scores = self._dense @ query
+            top = self._top_k(scores, k)
+            return top, scores[top]
+        if mode != "ivf":
+            raise ValueError(f"Unknown search mode '{mode}', expected 'auto', 'exact' or 'ivf'")
+        if self.centroids is None:
+            raise ValueError(f"No IVF partition in {self.path}; rebuild with --ivf or use mode='exact'")
+        lists = self._top_k(self.centroids @ query, nprobe)
+        rows = np.concatenate([self.list_rows[self.list_ptr[l]:self.list_ptr[l + 1]] for l in lists])
+        rows.sort()  # sequential memmap reads
+        scores = self.vectors[rows].astype(np.float32) @ query
+        top = self._top_k(scores, k)
+        return rows[top], scores[top]
+
+    def search(self, text, k=5, mode="auto", nprobe=16):
+        """Rows (id, hmdb_id, name, score) for a free-text query."""
+        query = get_embedder(self.meta["model"]).encode([text])[0]
+        rows, scores = self.search_vector(query, k, mode, nprobe)
+        return [(int(self.ids[r]), str(self.hmdb_ids[r]), str(self.names[r]), float(s))
+                for r, s in zip(rows, scores)]
+
+
+def load_index(path=None, db_handler=None):
+    """
+    Load the index at `path` (default $METABOCHAT_SEMANTIC_INDEX), or None if
+    absent. With `db_handler`, an index embedded from another dataset version
+    is also None: re-embedding is too slow to do inline, so the semantic
+    ranker stays off until the index is rebuilt with --build.
+    """
+    path = path or os.environ.get("METABOCHAT_SEMANTIC_INDEX", "./data/semantic")
+    if not os.path.exists(os.path.join(path, META_FILE)):
+        return None
+    index = SemanticIndex(path)
+    if db_handler is not None and index.version != db_handler.dataset_version():
+        print(f"Warning: semantic index {path} was built from dataset version {index.version}, "
+              f"store is at {db_handler.dataset_version()}; semantic search disabled until "
+              f"it is rebuilt with --build")
+        return None
+    return index
+
+
+#######################################
+# Build index / Demo Testing
+#######################################
+if __name__ == "__main__":
+    from utils.storage_backend import BACKENDS, create_db_handler
+
+    parser = argparse.ArgumentParser(description="Build or query the metabolite semantic index.")
+    parser.add_argument("--backend", choices=BACKENDS, default=None)
+    parser.add_argument("--sqlite-path", default=None)
+    parser.add_argument("--index", default=os.environ.get("METABOCHAT_SEMANTIC_INDEX", "./data/semantic"))
+    parser.add_argument("--build", action="store_true", help="embed all metabolites into --index")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--no-ivf", action="store_true")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("queries", nargs="*")
+    args = parser.parse_args()
+
+    if args.build:
+        start = time.perf_counter()
+        db = create_db_handler(args.backend, sqlite_path=args.sqlite_path)
+        n = build_index(db, args.index, args.model, nlist=args.nlist, ivf=not args.no_ivf)
+        print(f"Embedded {n} metabolites in {time.perf_counter() - start:.1f}s -> {args.index}")
+
+    index = SemanticIndex(args.index)
+    for q in args.queries:
+        for mode in ("exact", "ivf") if index.centroids is not None else ("exact",):
+            index.search(q, 5, mode)  # warm up (model load, float32 upcast)
+            start = time.perf_counter()
+            hits = index.search(q, 5, mode)
+            print(f"\n{q!r} [{mode}] {1000 * (time.perf_counter() - start):.1f} ms")
+            for row in hits:
+                print(f"  {row[1]}  {row[3]:.3f}  {row[2]}")
@@ -0,0 +1,1019 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from contextlib import closing
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from utils.identifiers import group_inchikey_matches, inchikey_block, normalize_inchikey
+from utils.query_stats import QueryStats, instrumented
+from utils.storage_backend import GRAPH_EXPORTS, MetaboliteStore
+
+#########################################
+# SCHEMA
+#########################################
+# Mirrors create_tables() in parse_hmdb_postgres.py. JSONB columns become
+# JSON text; the weighted tsvector 'doc' becomes the FTS5 table below, and
+# biospecimen membership gets its own indexed table (SQLite has no GIN).
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metabolites (
+    id INTEGER PRIMARY KEY,
+    hmdb_id TEXT UNIQUE NOT NULL,
+    name TEXT,
+    chemical_formula TEXT,
+    synonyms TEXT,
+    description TEXT,
+    status TEXT,
+    molecular_weight_avg REAL,
+    molecular_weight_monoisotopic REAL,
+    iupac_name TEXT,
+    smiles TEXT,
+    inchi TEXT,
+    inchikey TEXT,
+    taxonomy_kingdom TEXT,
+    taxonomy_superclass TEXT,
+    taxonomy_class TEXT,
+    taxonomy_subclass TEXT,
+    taxonomy_direct_parent TEXT,
+    taxonomy_alternative_parents TEXT,
+    cellular_locations TEXT,
+    biospecimen_locations TEXT,
+    tissue_locations TEXT,
+    element_counts TEXT,
+    creation_date TEXT,
+    update_date TEXT,
+    version TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_metabolites_lower_name ON metabolites (lower(name));
+CREATE INDEX IF NOT EXISTS idx_metabolites_mono_mass ON metabolites (molecular_weight_monoisotopic);
+CREATE INDEX IF NOT EXISTS idx_metabolites_inchikey ON metabolites (inchikey);
+CREATE INDEX IF NOT EXISTS idx_metabolites_inchikey_block1 ON metabolites (substr(inchikey, 1, 14));
+CREATE INDEX IF NOT EXISTS idx_metabolites_inchi ON metabolites (inchi);
+
+CREATE TABLE IF NOT EXISTS metabolite_biospecimens (
+    metabolite_id INTEGER REFERENCES metabolites(id) ON DELETE CASCADE,
+    biospecimen TEXT NOT NULL,
+    UNIQUE (biospecimen, metabolite_id)
+);
+
+CREATE TABLE IF NOT EXISTS pathways (
+    id INTEGER PRIMARY KEY,
+    pathway_name TEXT UNIQUE NOT NULL,
+    kegg_id TEXT,
+    smpdb_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_pathways_lower_name ON pathways (lower(pathway_name));
+
+CREATE TABLE IF NOT EXISTS diseases (
+    id INTEGER PRIMARY KEY,
+    disease_name TEXT UNIQUE NOT NULL,
+    "references" TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_diseases_lower_name ON diseases (lower(disease_name));
+
+CREATE TABLE IF NOT EXISTS proteins (
+    id INTEGER PRIMARY KEY,
+    uniprot_id TEXT UNIQUE NOT NULL,
+    protein_name TEXT,
+    gene_name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS metabolite_pathways (
+    id INTEGER PRIMARY KEY,
+    metabolite_id INTEGER REFERENCES metabolites(id) ON DELETE CASCADE,
+    pathway_id INTEGER REFERENCES pathways(id) ON DELETE CASCADE,
+    UNIQUE (metabolite_id, pathway_id)
+);
+CREATE INDEX IF NOT EXISTS idx_metabolite_pathways_pathway ON metabolite_pathways (pathway_id);
+
+CREATE TABLE IF NOT EXISTS disease_metabolites (
+    id INTEGER PRIMARY KEY,
+    metabolite_id INTEGER REFERENCES metabolites(id) ON DELETE CASCADE,
+    disease_id INTEGER REFERENCES diseases(id) ON DELETE CASCADE,
+    UNIQUE (metabolite_id, disease_id)
+);
+CREATE INDEX IF NOT EXISTS idx_disease_metabolites_disease ON disease_metabolites (disease_id);
+
+CREATE TABLE IF NOT EXISTS protein_metabolites (
+    id INTEGER PRIMARY KEY,
+    metabolite_id INTEGER REFERENCES metabolites(id) ON DELETE CASCADE,
+    protein_id INTEGER REFERENCES proteins(id) ON DELETE CASCADE,
+    UNIQUE (metabolite_id, protein_id)
+);
+
+CREATE TABLE IF NOT EXISTS predicted_properties (
+    id INTEGER PRIMARY KEY,
+    metabolite_id INTEGER REFERENCES metabolites(id) ON DELETE CASCADE,
+    property_kind TEXT,
+    property_value TEXT,
+    property_source TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_predicted_properties_metabolite ON predicted_properties (metabolite_id);
+
+CREATE TABLE IF NOT EXISTS concentrations (
+    id INTEGER PRIMARY KEY,
+    metabolite_id INTEGER REFERENCES metabolites(id) ON DELETE CASCADE,
+    concentration_type TEXT,
+    biofluid_type TEXT,
+    concentration_value TEXT,
+    subject_age TEXT,
+    subject_sex TEXT,
+    subject_condition TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_concentrations_metabolite ON concentrations (metabolite_id, concentration_type);
+
+CREATE TABLE IF NOT EXISTS disease_synonyms (
+    disease_name TEXT NOT NULL,
+    synonym TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS pathway_synonyms (
+    pathway_name TEXT NOT NULL,
+    synonym TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS dataset_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+-- Weighted search document: one FTS5 column per Postgres weight class.
+CREATE VIRTUAL TABLE IF NOT EXISTS metabolites_fts USING fts5(
+    name, biospecimen_locations, synonyms, diseases, pathways,
+    tokenize = 'porter unicode61'
+);
+
+-- Name trigrams: candidate generation for trigram_search (pg_trgm stand-in).
+CREATE VIRTUAL TABLE IF NOT EXISTS metabolites_trgm USING fts5(name, tokenize = 'trigram');
+"""
+
+# bm25() column weights mirroring Postgres' default ts_rank weights
+# {A: 1.0, B: 0.4, C: 0.2, D: 0.1}: name=A, biospecimen_locations=B,
+# synonyms/diseases=C, pathways=D.
+FTS_RANK = "-bm25(metabolites_fts, 1.0, 0.4, 0.2, 0.2, 0.1)"
+
+# websearch_to_tsquery('english', ...) drops stop words; FTS5 does not, so
+# strip the common ones before building the MATCH expression.
+_STOPWORDS = frozenset("""
+    a an and are as at be but by can do does for from has have how i in is it
+    its of on or that the their this to was what when where which who why with
+""".split())
+
+
+def fts_match_query(term):
+    """
+    Turn free text into an FTS5 MATCH expression: every non-stop-word token
+    quoted (so FTS5 syntax in user input is inert) and AND-ed together, the
+    same semantics as websearch_to_tsquery for plain words.
+    """
+    tokens = [t for t in re.findall(r"\w+", term.lower()) if t not in _STOPWORDS]
+    return " ".join(f'"{t}"' for t in tokens)
+
+
+def _trigrams(text):
+    """pg_trgm's trigram set: each lower-cased word padded with two leading and one trailing space."""
+    grams = set()
+    for word in re.findall(r"[^\W_]+", (text or "").lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def trigram_similarity(a, b):
+    """Same definition as pg_trgm similarity(): shared trigrams over the union."""
+    ta, tb = _trigrams(a), _trigrams(b)
+    return len(ta & tb) / len(ta | tb) if ta and tb else 0.0
+
+
+def trgm_match_query(term):
+    """FTS5 trigram MATCH expression: any 3-character window of the term."""
+    text = " ".join(re.findall(r"[^\W_]+", term.lower()))
+    grams = {text[i:i + 3] for i in range(len(text) - 2)}
+    return " OR ".join(f'"{g}"' for g in sorted(grams) if " " not in g)
+
+
+#########################################
+# BUILD (same records as the Postgres ingestion)
+#########################################
+def insert_record(conn, record):
+    """SQLite twin of parse_hmdb_postgres.insert_record()."""
+    conn.execute("""
+        INSERT INTO metabolites (
+            hmdb_id, name, chemical_formula, molecular_weight_avg, molecular_weight_monoisotopic,
+            element_counts, smiles, inchi, inchikey, synonyms, description,
+            biospecimen_locations, cellular_locations, tissue_locations,
+            taxonomy_kingdom, taxonomy_superclass, taxonomy_class, taxonomy_subclass,
+            taxonomy_direct_parent, taxonomy_alternative_parents
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (hmdb_id) DO UPDATE SET
+            name = excluded.name,
+            chemical_formula = excluded.chemical_formula,
+            molecular_weight_avg = excluded.molecular_weight_avg,
+            molecular_weight_monoisotopic = excluded.molecular_weight_monoisotopic,
+            element_counts = excluded.element_counts,
+            smiles = excluded.smiles,
+            inchi = excluded.inchi,
+            inchikey = excluded.inchikey,
+            synonyms = excluded.synonyms,
+            description = excluded.description,
+            biospecimen_locations = excluded.biospecimen_locations,
+            cellular_locations = excluded.cellular_locations,
+            tissue_locations = excluded.tissue_locations,
+            taxonomy_kingdom = excluded.taxonomy_kingdom,
+            taxonomy_superclass = excluded.taxonomy_superclass,
+            taxonomy_class = excluded.taxonomy_class,
+            taxonomy_subclass = excluded.taxonomy_subclass,
+            taxonomy_direct_parent = excluded.taxonomy_direct_parent,
+            taxonomy_alternative_parents = excluded.taxonomy_alternative_parents
+    """, (
+        record["hmdb_id"], record["name"], record["chemical_formula"],
+        record["molecular_weight_avg"], record["molecular_weight_monoisotopic"],
+        json.dumps(record["element_counts"]) if record["element_counts"] else None, record["smiles"],
+        record["inchi"], record["inchikey"], json.dumps(record["synonyms"]),
+        record["description"],
+        json.dumps(record["biospecimen_locations"]), json.dumps(record["cellular_locations"]),
+        json.dumps(record["tissue_locations"]),
+        record["taxonomy_kingdom"], record["taxonomy_superclass"], record["taxonomy_class"],
+        record["taxonomy_subclass"], record["taxonomy_direct_parent"],
+        json.dumps(record["taxonomy_alternative_parents"])
+    ))
+    metabolite_id = conn.execute(
+        "SELECT id FROM metabolites WHERE hmdb_id = ?", (record["hmdb_id"],)
+    ).fetchone()[0]
+
+    conn.execute("DELETE FROM metabolite_biospecimens WHERE metabolite_id = ?", (metabolite_id,))
+    conn.executemany(
+        "INSERT OR IGNORE INTO metabolite_biospecimens (metabolite_id, biospecimen) VALUES (?, ?)",
+        [(metabolite_id, b) for b in record["biospecimen_locations"] if b]
+    )
+
+    for pathway_name, kegg_id, smpdb_id in record["pathways"]:
+        conn.execute("""
+            INSERT INTO pathways (pathway_name, kegg_id, smpdb_id) VALUES (?, ?, ?)
+            ON CONFLICT (pathway_name) DO NOTHING
+        """, (pathway_name, kegg_id, smpdb_id))
+        conn.execute("""
+            INSERT OR IGNORE INTO metabolite_pathways (metabolite_id, pathway_id)
+            SELECT ?, id FROM pathways WHERE pathway_name = ?
+        """, (metabolite_id, pathway_name))
+
+    for disease_name, references in record["diseases"]:
+        conn.execute("""
+            INSERT INTO diseases (disease_name, "references") VALUES (?, ?)
+            ON CONFLICT (disease_name) DO NOTHING
+        """, (disease_name, references))
+        conn.execute("""
+            INSERT OR IGNORE INTO disease_metabolites (metabolite_id, disease_id)
+            SELECT ?, id FROM diseases WHERE disease_name = ?
+        """, (metabolite_id, disease_name))
+
+    for uniprot_id, protein_name, gene_name in record["proteins"]:
+        conn.execute("""
+            INSERT INTO proteins (uniprot_id, protein_name, gene_name) VALUES (?, ?, ?)
+            ON CONFLICT (uniprot_id) DO NOTHING
+        """, (uniprot_id, protein_name, gene_name))
+        conn.execute("""
+            INSERT OR IGNORE INTO protein_metabolites (metabolite_id, protein_id)
+            SELECT ?, id FROM proteins WHERE uniprot_id = ?
+        """, (metabolite_id, uniprot_id))
+
+
+def build_sqlite_db(db_path, data_files):
+    """
+    Build (or update) the embedded database from HMDB XML files, using the
+    same record extraction as the Postgres ingestion, then rebuild the FTS
+    index. Files are loaded one after another: SQLite has a single writer.
+    """
+    from utils.parse_hmdb_postgres import iter_hmdb_records, logger, make_dataset_version
+
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    handler = SQLiteDBHandler(db_path, read_only=False)
+    with closing(handler._connect()) as conn:
+        conn.executescript(SCHEMA)
+        conn.execute("PRAGMA synchronous = OFF")
+        for xml_file in data_files:
+            n = 0
+            for record in iter_hmdb_records(xml_file):
+                try:
+                    insert_record(conn, record)
+                    n += 1
+                except sqlite3.Error as e:
+                    logger.error(f"Error processing element: {str(e)}")
+            conn.commit()
+            logger.info(f"Processed {xml_file} ({n} records) into {db_path}")
+
+    handler.refresh_doc_column()
+    version = make_dataset_version(data_files)
+    with closing(handler._connect()) as conn:
+        conn.execute("""
+            INSERT INTO dataset_meta (key, value) VALUES ('version', ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        """, (version,))
+        conn.execute("ANALYZE")
+        conn.commit()
+    logger.info(f"SQLite backend ready at {db_path} (dataset version {version})")
+
+
+#########################################
+# HANDLER
+#########################################
+class SQLiteDBHandler(MetaboliteStore):
+    """
+    Embedded, single-file drop-in for PostgresDBHandler. Same method names,
+    same row shapes; FTS5 with bm25 column weights stands in for the weighted
+    tsvector. Read-only by default, so many processes can share one file.
+    """
+
+    def __init__(self, db_path="./data/metabolites.sqlite", itersize=2000,
+                 stats=None, slow_query_ms=500, read_only=True):
+        self.db_path = db_path
+        self.itersize = itersize
+        self.read_only = read_only
+        self.stats = stats or QueryStats(slow_query_threshold=slow_query_ms / 1000.0)
+
+    def _connect(self, write=False):
+        start = time.perf_counter()
+        if self.read_only and not write:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.stats.record_conn_wait(time.perf_counter() - start)
+        return conn
+
+    def _execute(self, conn, sql, params=()):
+        """Execute and, when slow, record the statement with its query plan."""
+        start = time.perf_counter()
+        cur = conn.execute(sql, params)
+        elapsed = time.perf_counter() - start
+        if elapsed >= self.stats.slow_query_threshold:
+            plan = None
+            if self.stats.capture_plans:
+                plan = "\n".join(str(r[-1]) for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+            self.stats.record_slow_query(sql, params, elapsed, plan=plan)
+        return cur
+
+    def _fetchall(self, sql, params=()):
+        with closing(self._connect()) as conn:
+            return self._execute(conn, sql, params).fetchall()
+
+    def dataset_version(self):
+        try:
+            rows = self._fetchall("SELECT value FROM dataset_meta WHERE key = 'version'")
+        except sqlite3.OperationalError:  # file built before dataset_meta existed
+            return None
+        return rows[0][0] if rows else None
+
+    ######################################################
+    # refresh_doc_column
+    ######################################################
+    @instrumented
+    def refresh_doc_column(self):
+        """
+        Rebuild the FTS5 search document from metabolites, diseases and
+        pathways (the SQLite counterpart of the weighted 'doc' column).
+        """
+        with closing(self._connect(write=True)) as conn:
+            conn.execute("DELETE FROM metabolites_fts")
+            conn.execute("""
+                INSERT INTO metabolites_fts (rowid, name, biospecimen_locations, synonyms, diseases, pathways)
+                SELECT m.id,
+                       COALESCE(m.name, ''),
+                       COALESCE(m.biospecimen_locations, ''),
+                       COALESCE(m.synonyms, ''),
+                       COALESCE((SELECT group_concat(d.disease_name, ' ')
+                                   FROM disease_metabolites dm
+                                   JOIN diseases d ON dm.disease_id = d.id
+                                  WHERE dm.metabolite_id = m.id), ''),
+                       COALESCE((SELECT group_concat(p.pathway_name, ' ')
+                                   FROM metabolite_pathways mp
+                                   JOIN pathways p ON mp.pathway_id = p.id
+                                  WHERE mp.metabolite_id = m.id), '')
+                  FROM metabolites m
+            """)
+            conn.execute("INSERT INTO metabolites_fts (metabolites_fts) VALUES ('optimize')")
+            conn.execute("DELETE FROM metabolites_trgm")
+            conn.execute("INSERT INTO metabolites_trgm (rowid, name) SELECT id, name FROM metabolites WHERE name IS NOT NULL")
+            conn.commit()
+            print("Refreshed FTS5 index with weighting: name=A, biospecimen_locations=B, synonyms/diseases=C, pathways=D.")
+
+    ############################################
+    # FULL-TEXT SEARCH with Weighted Fields
+    ############################################
+    @instrumented
+    def full_text_search(self, term, limit=5):
+        """
+        Weighted FTS5 search; if no hits, fallback to partial LIKE on
+        name/synonyms/biospecimen_locations.
+        """
+        match = fts_match_query(term)
+        if match:
+            rows = self._fetchall(f"""
+                SELECT m.id, m.hmdb_id, m.name, {FTS_RANK} AS rank
+                  FROM metabolites_fts
+                  JOIN metabolites m ON m.id = metabolites_fts.rowid
+                 WHERE metabolites_fts MATCH ?
+                 ORDER BY rank DESC
+                 LIMIT ?
+            """, (match, limit))
+            if rows:
+                return rows
+
+        self.stats.record_fallback("full_text_search")
+        return self._fetchall("""
+            SELECT id, hmdb_id, name
+              FROM metabolites
+             WHERE name LIKE ?
+                OR synonyms LIKE ?
+                OR biospecimen_locations LIKE ?
+             LIMIT ?
+        """, (f"%{term}%", f"%{term}%", f"%{term}%", limit))
+
+    ############################################
+    # Trigram similarity (typo-tolerant name match)
+    ############################################
+    @instrumented
+    def trigram_search(self, term, limit=5, threshold=0.3, candidates=200):
+        """
+        Names similar to `term` by pg_trgm-style similarity. FTS5's trigram
+        index proposes candidates sharing any trigram; they are re-scored
+        here with the pg_trgm definition so both backends rank alike.
+        """
+        match = trgm_match_query(term)
+        if not match:
+            return []
+        try:
+            rows = self._fetchall("""
+                SELECT m.id, m.hmdb_id, m.name
+                  FROM metabolites_trgm
+                  JOIN metabolites m ON m.id = metabolites_trgm.rowid
+                 WHERE metabolites_trgm MATCH ?
+                 ORDER BY bm25(metabolites_trgm)
+                 LIMIT ?
+            """, (match, candidates))
+        except sqlite3.OperationalError:  # file built before metabolites_trgm existed
+            self.stats.record_fallback("trigram_search")
+            return []
+        scored = [r + (trigram_similarity(term, r[2]),) for r in rows]
+        scored = [r for r in scored if r[3] >= threshold]
+        scored.sort(key=lambda r: (-r[3], r[0]))
+        return scored[:limit]
+
+    ############################################
+    # Query by Name / Disease / Pathway / Biofluid
+    ############################################
+    @instrumented
+    def query_by_name(self, name, limit=5):
+        rows = self._fetchall("""
+            SELECT id, hmdb_id, name, chemical_formula, molecular_weight_avg, smiles
+              FROM metabolites
+             WHERE lower(name) = lower(?)
+             LIMIT ?
+        """, (name, limit))
+        if rows:
+            return rows
+
+        self.stats.record_fallback("query_by_name")
+        return self._fetchall("""
+            SELECT id, hmdb_id, name, chemical_formula, molecular_weight_avg, smiles
+              FROM metabolites
+             WHERE name LIKE ?
+                OR synonyms LIKE ?
+             LIMIT ?
+        """, (f"%{name}%", f"%{name}%", limit))
+
+    @instrumented
+    def query_by_disease(self, disease, limit=5):
+        rows = self._fetchall("""
+            SELECT m.id, m.hmdb_id, m.name, d.disease_name
+              FROM disease_metabolites dm
+              JOIN diseases d ON dm.disease_id = d.id
+              JOIN metabolites m ON dm.metabolite_id = m.id
+             WHERE lower(d.disease_name) = lower(?)
+             LIMIT ?
+        """, (disease, limit))
+        if rows:
+            return rows
+
+        self.stats.record_fallback("query_by_disease")
+        return self._fetchall("""
+            SELECT m.id, m.hmdb_id, m.name, d.disease_name
+              FROM disease_metabolites dm
+              JOIN diseases d ON dm.disease_id = d.id
+              JOIN metabolites m ON dm.metabolite_id = m.id
+             WHERE d.disease_name LIKE ?
+                OR EXISTS (
+                    SELECT 1 FROM disease_synonyms ds
+                    WHERE ds.disease_name = d.disease_name
+                    AND ds.synonym LIKE ?
+                )
+             LIMIT ?
+        """, (f"%{disease}%", f"%{disease}%", limit))
+
+    @instrumented
+    def query_by_pathway(self, pathway, limit=5):
+        rows = self._fetchall("""
+            SELECT m.id, m.hmdb_id, m.name, p.pathway_name
+              FROM metabolite_pathways mp
+              JOIN pathways p ON mp.pathway_id = p.id
+              JOIN metabolites m ON mp.metabolite_id = m.id
+             WHERE lower(p.pathway_name) = lower(?)
+             LIMIT ?
+        """, (pathway, limit))
+        if rows:
+            return rows
+
+        self.stats.record_fallback("query_by_pathway")
+        return self._fetchall("""
+            SELECT m.id, m.hmdb_id, m.name, p.pathway_name
+              FROM metabolite_pathways mp
+              JOIN pathways p ON mp.pathway_id = p.id
+              JOIN metabolites m ON mp.metabolite_id = m.id
+             WHERE p.pathway_name LIKE ?
+                OR EXISTS (
+                    SELECT 1 FROM pathway_synonyms ps
+                    WHERE ps.pathway_name = p.pathway_name
+                    AND ps.synonym LIKE ?
+                )
+             LIMIT ?
+        """, (f"%{pathway}%", f"%{pathway}%", limit))
+
+    @instrumented
+    def query_by_biofluid(self, biofluid, limit=5):
+        """Exact biofluid name, like the JSONB @> match in Postgres."""
+        rows = self._fetchall("""
+            SELECT m.id, m.hmdb_id, m.name, m.biospecimen_locations
+              FROM metabolite_biospecimens mb
+              JOIN metabolites m ON mb.metabolite_id = m.id
+             WHERE mb.biospecimen = ?
+             LIMIT ?
+        """, (biofluid, limit))
+        return [_decode_locations(r) for r in rows]
+
+    ############################################
+    # Per-metabolite details
+    ############################################
+    @instrumented
+    def query_predicted_properties(self, hmdb_id):
+        return self._fetchall("""
+            SELECT pp.property_kind, pp.property_value, pp.property_source
+              FROM predicted_properties pp
+              JOIN metabolites m ON pp.metabolite_id = m.id
+             WHERE m.hmdb_id = ?
+        """, (hmdb_id,))
+
+    @instrumented
+    def query_concentrations(self, hmdb_id, ctype='normal'):
+        return self._fetchall("""
+            SELECT c.concentration_type, c.biofluid_type, c.concentration_value,
+                   c.subject_age, c.subject_sex, c.subject_condition
+              FROM concentrations c
+              JOIN metabolites m ON c.metabolite_id = m.id
+             WHERE m.hmdb_id = ?
+               AND c.concentration_type = ?
+        """, (hmdb_id, ctype))
+
+    @instrumented
+    def query_proteins(self, hmdb_id):
+        return self._fetchall("""
+            SELECT p.uniprot_id, p.protein_name, p.gene_name
+              FROM protein_metabolites pm
+              JOIN proteins p ON pm.protein_id = p.id
+              JOIN metabolites m ON pm.metabolite_id = m.id
+             WHERE m.hmdb_id = ?
+        """, (hmdb_id,))
+
+    @instrumented
+    def query_by_hmdb_id(self, hmdb_id):
+        rows = self._fetchall("""
+            SELECT id, hmdb_id, name, chemical_formula, molecular_weight_avg, smiles
+              FROM metabolites
+             WHERE hmdb_id = ?
+             LIMIT 1
+        """, (hmdb_id,))
+        return rows[0] if rows else None
+
+    ############################################
+    # Monoisotopic mass (MS peak annotation)
+    ############################################
+    @instrumented
+    def query_by_mass(self, mz, tolerance=10.0, unit="ppm", adduct="[M]", limit=5):
+        from utils.mass_search import mass_window
+        mass, low, high = mass_window(mz, tolerance, unit, adduct)
+        return self._fetchall("""
+            SELECT id, hmdb_id, name, chemical_formula, molecular_weight_monoisotopic,
+                   (molecular_weight_monoisotopic - ?) / ? * 1e6 AS ppm_error
+              FROM metabolites
+             WHERE molecular_weight_monoisotopic BETWEEN ? AND ?
+             ORDER BY abs(molecular_weight_monoisotopic - ?)
+             LIMIT ?
+        """, (mass, mass, low, high, mass, limit))
+
+    @instrumented
+    def iter_monoisotopic_masses(self):
+        yield from self._stream("""
+            SELECT id, hmdb_id, name, molecular_weight_monoisotopic
+              FROM metabolites
+             WHERE molecular_weight_monoisotopic IS NOT NULL
+        """, ())
+
+    @instrumented
+    def iter_element_counts(self):
+        yield from self._stream("""
+            SELECT id, hmdb_id, name, chemical_formula, element_counts
+              FROM metabolites
+             WHERE chemical_formula IS NOT NULL
+        """, ())
+
+    @instrumented
+    def iter_facet_memberships(self):
+        yield from self._stream("""
+            SELECT 'biospecimen', j.value, m.id
+              FROM metabolites m, json_each(m.biospecimen_locations) j
+             WHERE json_valid(m.biospecimen_locations)
+            UNION ALL
+            SELECT 'tissue', j.value, m.id
+              FROM metabolites m, json_each(m.tissue_locations) j
+             WHERE json_valid(m.tissue_locations)
+            UNION ALL
+            SELECT 'cellular', j.value, m.id
+              FROM metabolites m, json_each(m.cellular_locations) j
+             WHERE json_valid(m.cellular_locations)
+            UNION ALL
+            SELECT 'taxonomy_class', taxonomy_class, id
+              FROM metabolites WHERE taxonomy_class IS NOT NULL
+            UNION ALL
+            SELECT 'disease', d.disease_name, dm.metabolite_id
+              FROM disease_metabolites dm JOIN diseases d ON dm.disease_id = d.id
+            UNION ALL
+            SELECT 'pathway', p.pathway_name, mp.metabolite_id
+              FROM metabolite_pathways mp JOIN pathways p ON mp.pathway_id = p.id
+            UNION ALL
+            SELECT 'protein', p.protein_name, pm.metabolite_id
+              FROM protein_metabolites pm JOIN proteins p ON pm.protein_id = p.id
+            UNION ALL
+            SELECT 'gene', p.gene_name, pm.metabolite_id
+              FROM protein_metabolites pm JOIN proteins p ON pm.protein_id = p.id
+        """, ())
+
+    @instrumented
+    def iter_entity_names(self):
+        yield from self._stream("""
+            SELECT 'metabolite', hmdb_id, name, name FROM metabolites WHERE name IS NOT NULL
+            UNION ALL
+            SELECT 'metabolite', m.hmdb_id, m.name, j.value
+              FROM metabolites m, json_each(m.synonyms) j
+             WHERE json_valid(m.synonyms)
+            UNION ALL
+            SELECT 'disease', CAST(id AS TEXT), disease_name, disease_name FROM diseases
+            UNION ALL
+            SELECT 'pathway', CAST(id AS TEXT), pathway_name, pathway_name FROM pathways
+            UNION ALL
+            SELECT 'protein', uniprot_id, protein_name, protein_name
+              FROM proteins WHERE protein_name IS NOT NULL
+            UNION ALL
+            SELECT 'protein', uniprot_id, protein_name, gene_name
+              FROM proteins WHERE gene_name IS NOT NULL
+            UNION ALL
+            SELECT DISTINCT 'biofluid', j.value, j.value, j.value
+              FROM metabolites m, json_each(m.biospecimen_locations) j
+             WHERE json_valid(m.biospecimen_locations)
+        """, ())
+
+    @instrumented
+    def iter_embedding_documents(self):
+        yield from self._stream("""
+            SELECT m.id, m.hmdb_id, m.name, m.description,
+                   (SELECT group_concat(d.disease_name, '; ')
+                      FROM disease_metabolites dm JOIN diseases d ON dm.disease_id = d.id
+                     WHERE dm.metabolite_id = m.id),
+                   (SELECT group_concat(p.pathway_name, '; ')
+                      FROM metabolite_pathways mp JOIN pathways p ON mp.pathway_id = p.id
+                     WHERE mp.metabolite_id = m.id)
+              FROM metabolites m
+             ORDER BY m.id
+        """, ())
+
+    @instrumented
+    def iter_graph_rows(self, kind):
+        yield from self._stream(GRAPH_EXPORTS[kind], ())
+
+    ############################################
+    # Structure identifiers (InChIKey / InChI)
+    ############################################
+    @instrumented
+    def query_by_inchikeys(self, keys):
+        keys = list(keys)
+        blocks = sorted({inchikey_block(k) for k in map(normalize_inchikey, keys) if k})
+        if not blocks:
+            return {k: [] for k in keys}
+        rows = self._fetchall("""
+            SELECT id, hmdb_id, name, inchikey
+              FROM metabolites
+             WHERE substr(inchikey, 1, 14) IN (SELECT value FROM json_each(?))
+        """, (json.dumps(blocks),))
+        return group_inchikey_matches(keys, rows)
+
+    @instrumented
+    def query_by_inchikey_prefix(self, prefix, limit=50):
+        prefix = prefix.strip().upper()
+        if not prefix or not all(c.isalpha() or c == "-" for c in prefix):
+            return []
+        # Range scan instead of LIKE so the plain inchikey index is used.
+        return self._fetchall("""
+            SELECT id, hmdb_id, name, inchikey
+              FROM metabolites
+             WHERE inchikey >= ? AND inchikey < ?
+             ORDER BY inchikey
+             LIMIT ?
+        """, (prefix, prefix + "\x7f", limit))
+
+    @instrumented
+    def query_by_inchis(self, inchis):
+        inchis = list(inchis)
+        wanted = sorted({i.strip() for i in inchis if i})
+        out = {i: [] for i in inchis}
+        if not wanted:
+            return out
+        by_inchi = {}
+        for row in self._fetchall("""
+            SELECT inchi, id, hmdb_id, name, inchikey
+              FROM metabolites
+             WHERE inchi IN (SELECT value FROM json_each(?))
+        """, (json.dumps(wanted),)):
+            by_inchi.setdefault(row[0], []).append(row[1:])
+        for i in inchis:
+            out[i] = by_inchi.get(i.strip(), []) if i else []
+        return out
+
+    ############################################
+    # Streaming
+    ############################################
+    def _stream(self, sql, params):
+        """SQLite steps rows lazily; fetch `itersize` at a time."""
+        with closing(self._connect()) as conn:
+            cur = self._execute(conn, sql, params)
+            while True:
+                batch = cur.fetchmany(self.itersize)
+                if not batch:
+                    return
+                yield from batch
+
+    @instrumented
+    def iter_full_text_search(self, term):
+        match = fts_match_query(term)
+        found = False
+        if match:
+            for row in self._stream(f"""
+                    SELECT m.id, m.hmdb_id, m.name, {FTS_RANK} AS rank
+                      FROM metabolites_fts
+                      JOIN metabolites m ON m.id = metabolites_fts.rowid
+                     WHERE metabolites_fts MATCH ?
+                     ORDER BY rank DESC, m.id
+                """, (match,)):
+                found = True
+                yield row
+        if found:
+            return
+
+        self.stats.record_fallback("iter_full_text_search")
+        yield from self._stream("""
+            SELECT id, hmdb_id, name
+              FROM metabolites
+             WHERE name LIKE ? OR synonyms LIKE ? OR biospecimen_locations LIKE ?
+        """, (f"%{term}%", f"%{term}%", f"%{term}%"))
+
+    @instrumented
+    def iter_by_disease(self, disease):
+        found = False
+        for row in self._stream("""
+                SELECT m.id, m.hmdb_id, m.name, d.disease_name
+                  FROM disease_metabolites dm
+                  JOIN diseases d ON dm.disease_id = d.id
+                  JOIN metabolites m ON dm.metabolite_id = m.id
+                 WHERE lower(d.disease_name) = lower(?)
+            """, (disease,)):
+            found = True
+            yield row
+        if found:
+            return
+
+        self.stats.record_fallback("iter_by_disease")
+        yield from self._stream("""
+            SELECT m.id, m.hmdb_id, m.name, d.disease_name
+              FROM disease_metabolites dm
+              JOIN diseases d ON dm.disease_id = d.id
+              JOIN metabolites m ON dm.metabolite_id = m.id
+             WHERE d.disease_name LIKE ?
+                OR EXISTS (
+                    SELECT 1 FROM disease_synonyms ds
+                    WHERE ds.disease_name = d.disease_name
+                    AND ds.synonym LIKE ?
+                )
+        """, (f"%{disease}%", f"%{disease}%"))
+
+    @instrumented
+    def iter_by_pathway(self, pathway):
+        found = False
+        for row in self._stream("""
+                SELECT m.id, m.hmdb_id, m.name, p.pathway_name
+                  FROM metabolite_pathways mp
+                  JOIN pathways p ON mp.pathway_id = p.id
+                  JOIN metabolites m ON mp.metabolite_id = m.id
+                 WHERE lower(p.pathway_name) = lower(?)
+            """, (pathway,)):
+            found = True
+            yield row
+        if found:
+            return
+
+        self.stats.record_fallback("iter_by_pathway")
+        yield from self._stream("""
+            SELECT m.id, m.hmdb_id, m.name, p.pathway_name
+              FROM metabolite_pathways mp
+              JOIN pathways p ON mp.pathway_id = p.id
+              JOIN metabolites m ON mp.metabolite_id = m.id
+             WHERE p.pathway_name LIKE ?
+                OR EXISTS (
+                    SELECT 1 FROM pathway_synonyms ps
+                    WHERE ps.pathway_name = p.pathway_name
+                    AND ps.synonym LIKE ?
+                )
+        """, (f"%{pathway}%", f"%{pathway}%"))
+
+    @instrumented
+    def iter_by_biofluid(self, biofluid):
+        for row in self._stream("""
+                SELECT m.id, m.hmdb_id, m.name, m.biospecimen_locations
+                  FROM metabolite_biospecimens mb
+                  JOIN metabolites m ON mb.metabolite_id = m.id
+                 WHERE mb.biospecimen = ?
+            """, (biofluid,)):
+            yield _decode_locations(row)
+
+    ############################################
+    # Keyset pagination (same keys as PostgresDBHandler)
+    ############################################
+    @instrumented
+    def page_full_text_search(self, term, after=None, page_size=1000):
+        match = fts_match_query(term)
+        if match and (after is None or after[0] == "fts"):
+            last_rank, last_id = (None, 0) if after is None else after[1:]
+            rows = self._fetchall(f"""
+                SELECT id, hmdb_id, name, rank
+                  FROM (
+                    SELECT m.id, m.hmdb_id, m.name, {FTS_RANK} AS rank
+                      FROM metabolites_fts
+                      JOIN metabolites m ON m.id = metabolites_fts.rowid
+                     WHERE metabolites_fts MATCH ?
+                  ) hits
+                 WHERE ? IS NULL
+                    OR rank < ?
+                    OR (rank = ? AND id > ?)
+                 ORDER BY rank DESC, id
+                 LIMIT ?
+            """, (match, last_rank, last_rank, last_rank, last_id, page_size))
+            if rows or after is not None:
+                next_key = ("fts", rows[-1][3], rows[-1][0]) if len(rows) == page_size else None
+                return rows, next_key
+
+        if after is None:
+            self.stats.record_fallback("page_full_text_search")
+        last_id = 0 if after is None else after[1]
+        rows = self._fetchall("""
+            SELECT id, hmdb_id, name
+              FROM metabolites
+             WHERE (name LIKE ? OR synonyms LIKE ? OR biospecimen_locations LIKE ?)
+               AND id > ?
+             ORDER BY id
+             LIMIT ?
+        """, (f"%{term}%", f"%{term}%", f"%{term}%", last_id, page_size))
+        next_key = ("fallback", rows[-1][0]) if len(rows) == page_size else None
+        return rows, next_key
+
+    @instrumented
+    def page_by_disease(self, disease, after=None, page_size=1000):
+        if after is None or after[0] == "exact":
+            last = (0, 0) if after is None else after[1:]
+            rows = self._fetchall("""
+                SELECT m.id, m.hmdb_id, m.name, d.disease_name, d.id
+                  FROM disease_metabolites dm
+                  JOIN diseases d ON dm.disease_id = d.id
+                  JOIN metabolites m ON dm.metabolite_id = m.id
+                 WHERE lower(d.disease_name) = lower(?)
+                   AND (m.id, d.id) > (?, ?)
+                 ORDER BY m.id, d.id
+                 LIMIT ?
+            """, (disease, last[0], last[1], page_size))
+            if rows or after is not None:
+                return _keyset_result(rows, page_size, "exact")
+
+        if after is None:
+            self.stats.record_fallback("page_by_disease")
+        last = (0, 0) if after is None else after[1:]
+        rows = self._fetchall("""
+            SELECT m.id, m.hmdb_id, m.name, d.disease_name, d.id
+              FROM disease_metabolites dm
+              JOIN diseases d ON dm.disease_id = d.id
+              JOIN metabolites m ON dm.metabolite_id = m.id
+             WHERE (d.disease_name LIKE ?
+                    OR EXISTS (
+                        SELECT 1 FROM disease_synonyms ds
+                        WHERE ds.disease_name = d.disease_name
+                        AND ds.synonym LIKE ?
+                    ))
+               AND (m.id, d.id) > (?, ?)
+             ORDER BY m.id, d.id
+             LIMIT ?
+        """, (f"%{disease}%", f"%{disease}%", last[0], last[1], page_size))
+        return _keyset_result(rows, page_size, "partial")
+
+    @instrumented
+    def page_by_pathway(self, pathway, after=None, page_size=1000):
+        if after is None or after[0] == "exact":
+            last = (0, 0) if after is None else after[1:]
+            rows = self._fetchall("""
+                SELECT m.id, m.hmdb_id, m.name, p.pathway_name, p.id
+                  FROM metabolite_pathways mp
+                  JOIN pathways p ON mp.pathway_id = p.id
+                  JOIN metabolites m ON mp.metabolite_id = m.id
+                 WHERE lower(p.pathway_name) = lower(?)
+                   AND (m.id, p.id) > (?, ?)
+                 ORDER BY m.id, p.id
+                 LIMIT ?
+            """, (pathway, last[0], last[1], page_size))
+            if rows or after is not None:
+                return _keyset_result(rows, page_size, "exact")
+
+        if after is None:
+            self.stats.record_fallback("page_by_pathway")
+        last = (0, 0) if after is None else after[1:]
+        rows = self._fetchall("""
+            SELECT m.id, m.hmdb_id, m.name, p.pathway_name, p.id
+              FROM metabolite_pathways mp
+              JOIN pathways p ON mp.pathway_id = p.id
+              JOIN metabolites m ON mp.metabolite_id = m.id
+             WHERE (p.pathway_name LIKE ?
+                    OR EXISTS (
+                        SELECT 1 FROM pathway_synonyms ps
+                        WHERE ps.pathway_name = p.pathway_name
+                        AND ps.synonym LIKE ?
+                    ))
+               AND (m.id, p.id) > (?, ?)
+             ORDER BY m.id, p.id
+             LIMIT ?
+        """, (f"%{pathway}%", f"%{pathway}%", last[0], last[1], page_size))
+        return _keyset_result(rows, page_size, "partial")
+
+    @instrumented
+    def page_by_biofluid(self, biofluid, after=None, page_size=1000):
+        last_id = 0 if after is None else after[1]
+        rows = self._fetchall("""
+            SELECT m.id, m.hmdb_id, m.name, m.biospecimen_locations
+              FROM metabolite_biospecimens mb
+              JOIN metabolites m ON mb.metabolite_id = m.id
+             WHERE mb.biospecimen = ?
+               AND m.id > ?
+             ORDER BY m.id
+             LIMIT ?
+        """, (biofluid, last_id, page_size))
+        next_key = ("biofluid", rows[-1][0]) if len(rows) == page_size else None
+        return [_decode_locations(r) for r in rows], next_key
+
+
+def _decode_locations(row):
+    """psycopg2 hands back JSONB as Python lists; do the same here."""
+    return row[:3] + (json.loads(row[3]) if row[3] else [],)
+
+
+def _keyset_result(rows, page_size, mode):
+    next_key = (mode, rows[-1][0], rows[-1][-1]) if len(rows) == page_size else None
+    return [r[:-1] for r in rows], next_key
+
+
+#######################################
+# Demo Testing
+#######################################
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or query the embedded SQLite backend.")
+    parser.add_argument("--db", default="./data/metabolites.sqlite", help="SQLite file path")
+    parser.add_argument("--build", nargs="*", metavar="XML",
+                        help="Build the database from these HMDB XML files first")
+    args = parser.parse_args()
+
+    if args.build:
+        build_sqlite_db(args.db, args.build)
+
+    db = SQLiteDBHandler(args.db)
+    for t in ["glucose", "serotonin", "oxidative stress"]:
+        print(f"FTS '{t}' =>", db.full_text_search(t, limit=5))
+    for bio in ["Urine", "Cerebrospinal Fluid (CSF)"]:
+        print(f"Biofluid '{bio}' =>", db.query_by_biofluid(bio, limit=3))
+    print(db.stats.to_prometheus())
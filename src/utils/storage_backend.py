@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+import abc
+import os
+import threading
+import time
+
+
+# Node and link tables exported to the Neo4j knowledge graph by graph_sync.py and
+# to the memory-mapped snapshot by kb_snapshot.py, as portable SQL (the two
+# backends share these table and column names). Nodes are (key, *properties);
+# links are (metabolite hmdb_id, other node's key).
+GRAPH_EXPORTS = {
+    "metabolite_records": """
+        SELECT id, hmdb_id, name, chemical_formula, molecular_weight_avg, smiles
+          FROM metabolites ORDER BY id""",
+    "metabolites": """
+        SELECT hmdb_id, name, chemical_formula, molecular_weight_avg,
+               molecular_weight_monoisotopic, inchikey, taxonomy_class
+          FROM metabolites ORDER BY id""",
+    "proteins": "SELECT uniprot_id, protein_name, gene_name FROM proteins ORDER BY id",
+    "diseases": "SELECT disease_name FROM diseases ORDER BY id",
+    "pathways": "SELECT pathway_name, kegg_id, smpdb_id FROM pathways ORDER BY id",
+    "metabolite_proteins": """
+        SELECT m.hmdb_id, p.uniprot_id
+          FROM protein_metabolites pm
+          JOIN metabolites m ON pm.metabolite_id = m.id
+          JOIN proteins p ON pm.protein_id = p.id""",
+    "metabolite_diseases": """
+        SELECT m.hmdb_id, d.disease_name
+          FROM disease_metabolites dm
+          JOIN metabolites m ON dm.metabolite_id = m.id
+          JOIN diseases d ON dm.disease_id = d.id""",
+    "metabolite_pathways": """
+        SELECT m.hmdb_id, p.pathway_name
+          FROM metabolite_pathways mp
+          JOIN metabolites m ON mp.metabolite_id = m.id
+          JOIN pathways p ON mp.pathway_id = p.id""",
+}
+
+
+class MetaboliteStore(abc.ABC):
+    """
+    The read-side lookup API the chatbot depends on. PostgresDBHandler
+    (query_database.py) and SQLiteDBHandler (sqlite_backend.py) both implement
+    it and return rows of the same shape, so callers can swap backends
+    without code changes.
+
+    Row shapes:
+      full_text_search   -> (id, hmdb_id, name, rank)   [fallback: (id, hmdb_id, name)]
+      trigram_search     -> (id, hmdb_id, name, similarity)
+      query_by_name      -> (id, hmdb_id, name, formula, molecular_weight_avg, smiles)
+      query_by_disease   -> (id, hmdb_id, name, disease_name)
+      query_by_pathway   -> (id, hmdb_id, name, pathway_name)
+      query_by_biofluid  -> (id, hmdb_id, name, biospecimen_locations)
+      query_by_hmdb_id   -> single (id, hmdb_id, name, formula, molecular_weight_avg, smiles) or None
+      query_by_mass      -> (id, hmdb_id, name, formula, molecular_weight_monoisotopic, ppm_error)
+      query_by_inchikeys -> {input_key: [(id, hmdb_id, name, inchikey, "exact"|"connectivity"), ...]}
+      query_facets       -> (count, [id, ...])
+      semantic_search    -> (id, hmdb_id, name, cosine_score)
+    """
+
+    # Cached in-memory indexes re-check dataset_version() at most this often (seconds).
+    index_version_check_interval = 60.0
+
+    @abc.abstractmethod
+    def dataset_version(self): ...
+
+    @abc.abstractmethod
+    def refresh_doc_column(self): ...
+
+    @abc.abstractmethod
+    def full_text_search(self, term, limit=5): ...
+
+    @abc.abstractmethod
+    def trigram_search(self, term, limit=5, threshold=0.3): ...
+
+    @abc.abstractmethod
+    def query_by_name(self, name, limit=5): ...
+
+    @abc.abstractmethod
+    def query_by_disease(self, disease, limit=5): ...
+
+    @abc.abstractmethod
+    def query_by_pathway(self, pathway, limit=5): ...
+
+    @abc.abstractmethod
+    def query_by_biofluid(self, biofluid, limit=5): ...
+
+    @abc.abstractmethod
+    def query_predicted_properties(self, hmdb_id): ...
+
+    @abc.abstractmethod
+    def query_concentrations(self, hmdb_id, ctype='normal'): ...
+
+    @abc.abstractmethod
+    def query_proteins(self, hmdb_id): ...
+
+    @abc.abstractmethod
+    def query_by_hmdb_id(self, hmdb_id): ...
+
+    @abc.abstractmethod
+    def iter_full_text_search(self, term): ...
+
+    @abc.abstractmethod
+    def iter_by_disease(self, disease): ...
+
+    @abc.abstractmethod
+    def iter_by_pathway(self, pathway): ...
+
+    @abc.abstractmethod
+    def iter_by_biofluid(self, biofluid): ...
+
+    @abc.abstractmethod
+    def page_full_text_search(self, term, after=None, page_size=1000): ...
+
+    @abc.abstractmethod
+    def page_by_disease(self, disease, after=None, page_size=1000): ...
+
+    @abc.abstractmethod
+    def page_by_pathway(self, pathway, after=None, page_size=1000): ...
+
+    @abc.abstractmethod
+    def page_by_biofluid(self, biofluid, after=None, page_size=1000): ...
+
+    @abc.abstractmethod
+    def query_by_mass(self, mz, tolerance=10.0, unit="ppm", adduct="[M]", limit=5): ...
+
+    @abc.abstractmethod
+    def iter_monoisotopic_masses(self): ...
+
+    @abc.abstractmethod
+    def query_by_inchikeys(self, keys): ...
+
+    @abc.abstractmethod
+    def query_by_inchikey_prefix(self, prefix, limit=50): ...
+
+    @abc.abstractmethod
+    def query_by_inchis(self, inchis): ...
+
+    @abc.abstractmethod
+    def iter_element_counts(self): ...
+
+    @abc.abstractmethod
+    def iter_facet_memberships(self): ...
+
+    @abc.abstractmethod
+    def iter_entity_names(self): ...
+
+    @abc.abstractmethod
+    def iter_embedding_documents(self): ...
+
+    @abc.abstractmethod
+    def iter_graph_rows(self, kind): ...
+
+    def pool_status(self):
+        """{"size", "in_use", "idle"} of the shared connection pool, or None without one."""
+        return None
+
+    def result_cache(self):
+        """
+        LRU of per-metabolite lookup results (prefetch.ResultCache), shared by
+        the chatbot's queries and its speculative Prefetcher.
+        """
+        from utils.prefetch import ResultCache
+        with self.__dict__.setdefault("_index_lock", threading.Lock()):
+            cache = self.__dict__.get("_result_cache")
+            if cache is None:
+                cache = self._result_cache = ResultCache(
+                    dataset_version=self.dataset_version,
+                    version_check_interval=self.index_version_check_interval)
+            return cache
+
+    ############################################
+    # In-memory indexes (built from the backend on first use)
+    ############################################
+    def _versioned_index(self, name, build, refresh=False):
+        """
+        Return the cached index `name`, (re)building it with build() when it
+        is missing, when refresh=True, or when dataset_version() has changed
+        since it was built. Each index has its own lock, so building a slow
+        one (the graph) does not hold up readers of the others.
+        """
+        with self.__dict__.setdefault("_index_lock", threading.Lock()):
+            lock = self.__dict__.setdefault("_index_locks", {}).setdefault(name, threading.Lock())
+        with lock:
+            cache = self.__dict__.setdefault("_indexes", {})
+            now = time.monotonic()
+            entry = cache.get(name)
+            if entry and not refresh:
+                index, version, checked_at = entry
+                if now - checked_at < self.index_version_check_interval:
+                    return index
+                if self.dataset_version() == version:
+                    cache[name] = (index, version, now)
+                    return index
+            version = self.dataset_version()
+            index = build()
+            cache[name] = (index, version, now)
+            return index
+
+    def mass_index(self, refresh=False):
+        """Sorted NumPy mass index (mass_search.MassIndex), rebuilt per dataset version."""
+        from utils.mass_search import MassIndex
+        return self._versioned_index(
+            "mass", lambda: MassIndex.from_rows(self.iter_monoisotopic_masses()), refresh)
+
+    def annotate_peaks(self, mzs, tolerance=10.0, unit="ppm", adducts=None, top_k=5):
+        """
+        Batch MS peak annotation: ranked MassCandidate lists, one per m/z.
+        Use query_by_mass for one-off lookups that should not load the index.
+        """
+        from utils.mass_search import DEFAULT_ADDUCTS
+        return self.mass_index().annotate(mzs, tolerance, unit, adducts or DEFAULT_ADDUCTS, top_k)
+
+    def formula_index(self, refresh=False):
+        """Element-count matrix (formula_index.FormulaIndex), rebuilt per dataset version."""
+        from utils.formula_index import FormulaIndex
+        return self._versioned_index(
+            "formula", lambda: FormulaIndex.from_rows(self.iter_element_counts()), refresh)
+
+    def query_by_formula(self, formula):
+        """(id, hmdb_id, name, formula) rows with exactly this composition, e.g. all C6H12O6."""
+        return self.formula_index().exact(formula)
+
+    def query_isomers(self, hmdb_id):
+        """Other metabolites with the same elemental composition as `hmdb_id`."""
+        return self.formula_index().isomers_of(hmdb_id)
+
+    def query_by_element_counts(self, ranges, only=False, limit=None):
+        """
+        Per-element constraints, e.g. {"C": (5, 7), "N": 1}: exact counts or
+        inclusive (low, high) ranges. only=True excludes any other element.
+        """
+        return self.formula_index().element_ranges(ranges, only=only, limit=limit)
+
+    def facet_index(self, refresh=False):
+        """Bitmap facet index (facet_index.FacetIndex), rebuilt per dataset version."""
+        from utils.facet_index import FacetIndex
+        return self._versioned_index(
+            "facets", lambda: FacetIndex(self.iter_facet_memberships(), self.dataset_version()), refresh)
+
+    def query_facets(self, all_of=(), any_of=(), none_of=(), limit=None):
+        """
+        Multi-constraint filter in memory, e.g.
+            all_of=[("biospecimen", "Urine"), ("biospecimen", "Cerebrospinal Fluid (CSF)"),
+                    ("disease", "Alzheimer's disease"), ("pathway", "Tryptophan Metabolism")]
+        Returns (count, [metabolite ids]).
+        """
+        index = self.facet_index()
+        bitmap = index.query(all_of, any_of, none_of)
+        return len(bitmap), index.ids_of(bitmap, limit)
+
+    def graph_index(self, refresh=False):
+        """CSR metabolite-protein/pathway/disease graph (graph_index.GraphIndex), rebuilt per dataset version."""
+        from utils.graph_index import GraphIndex
+        return self._versioned_index("graph", lambda: GraphIndex.from_store(self), refresh)
+
+    def related_metabolites(self, hmdb_id, via=None, method="adamic_adar", limit=10):
+        """
+        Metabolites sharing proteins, pathways or diseases (`via`) with hmdb_id,
+        scored by Adamic-Adar, Jaccard or shared count; [] for an unknown id.
+        """
+        graph = self.graph_index()
+        try:
+            return graph.related(hmdb_id, via=via, method=method, limit=limit)
+        except KeyError:
+            return []
+
+    def metabolite_path(self, source, target, via=None, max_hops=8):
+        """Fewest-hop chain of shared proteins / pathways / diseases linking two metabolites, or None."""
+        try:
+            return self.graph_index().shortest_path(source, target, via=via, max_hops=max_hops)
+        except KeyError:
+            return None
+
+    def entity_recognizer(self, refresh=False):
+        """
+        Aho-Corasick name matcher (entity_recognizer.EntityRecognizer) from the
+        snapshot at $METABOCHAT_ENTITY_SNAPSHOT, rebuilt when it was built from
+        another dataset version; None without a snapshot.
+        """
+        from utils.entity_recognizer import load_recognizer
+        return self._versioned_index("entities", lambda: load_recognizer(db_handler=self), refresh)
+
+    def semantic_index(self, refresh=False):
+        """
+        Embedding index built offline by semantic_index.py, loaded from
+        $METABOCHAT_SEMANTIC_INDEX (default ./data/semantic); None without one
+        or when it was built from another dataset version.
+        """
+        from utils.semantic_index import load_index
+        return self._versioned_index("semantic", lambda: load_index(db_handler=self), refresh)
+
+    def semantic_search(self, query, limit=5, mode="auto", nprobe=16):
+        """
+        Conceptual matches for free text ("linked to mitochondrial dysfunction")
+        by embedding similarity. mode is "exact", "ivf" or "auto".
+        """
+        index = self.semantic_index()
+        return index.search(query, limit, mode, nprobe) if index is not None else []
+
+
+BACKENDS = ("postgres", "sqlite")
+
+
+def create_db_handler(backend=None, sqlite_path=None, kb_snapshot=None, **pg_kwargs):
+    """
+    Build the configured MetaboliteStore.
+
+    `backend` defaults to $METABOCHAT_DB_BACKEND (else "postgres"); the SQLite
+    file defaults to $METABOCHAT_SQLITE_PATH. Backend modules are imported
+    lazily so a SQLite-only install never needs psycopg2.
+
+    When the knowledge-base snapshot `kb_snapshot` (default
+    $METABOCHAT_KB_SNAPSHOT, else ./data/kb_snapshot.bin; "off" to disable)
+    exists, the handler is wrapped in kb_snapshot.SnapshotStore.
+    """
+    backend = (backend or os.environ.get("METABOCHAT_DB_BACKEND") or "postgres").lower()
+    if backend == "postgres":
+        from utils.query_database import PostgresDBHandler
+        handler = PostgresDBHandler(**pg_kwargs)
+    elif backend == "sqlite":
+        from utils.sqlite_backend import SQLiteDBHandler
+        path = sqlite_path or os.environ.get("METABOCHAT_SQLITE_PATH", "./data/metabolites.sqlite")
+        kwargs = {k: v for k, v in pg_kwargs.items() if k in ("itersize", "stats")}
+        handler = SQLiteDBHandler(path, **kwargs)
+    else:
+        raise ValueError(f"Unknown DB backend '{backend}', expected one of {BACKENDS}")
+
+    snapshot = kb_snapshot or os.environ.get("METABOCHAT_KB_SNAPSHOT", "./data/kb_snapshot.bin")
+    if snapshot.lower() not in ("off", "none", "") and os.path.exists(snapshot):
+        from utils.kb_snapshot import SnapshotStore
+        return SnapshotStore.open(snapshot, handler)
+    return handler